@@ -229,6 +229,7 @@ def initialize_auth():
 def main():
     initialize_auth()
     auth_manager = st.session_state.auth_manager
+    auth_manager.sync_session_cookie()
     
     # Main app header
     st.markdown("""
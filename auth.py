@@ -1,30 +1,155 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import bcrypt
 from typing import Optional, Dict
-from firebase import get_firestore_db
+from firebase import get_firestore_db, run_in_transaction, get_config_value
+from rate_limiter import get_login_limiter, format_retry_after
+from session_profile import SessionProfile, get_profile_cache
+from session_revocations import get_revoked_sessions
+from write_behind import get_write_behind_queue
+from username_index import get_username_index
+from identity_filter import get_identity_filter
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import hashlib
+import hmac
+import json
+import os
 import re
+import secrets
+import threading
+import time
 import uuid
+import warnings
 from datetime import datetime
 
+# bcrypt cost factor for new hashes; hashes made with another cost are upgraded at login
+DEFAULT_BCRYPT_ROUNDS = 12
+
+_bcrypt_executor = None
+_bcrypt_executor_lock = threading.Lock()
+
+# Signed session tokens live in this cookie so a refresh, or a request served by another
+# replica, restores the session; the URL never carries them, so links and logs cannot leak them
+SESSION_COOKIE = 'cupping_session'
+# Query parameter older versions kept the token in; it is stripped on sight and never trusted
+LEGACY_SESSION_QUERY_PARAM = 'session'
+DEFAULT_SESSION_TTL_HOURS = 12
+
+# SESSION_SECRET values that are refused: the .env.example placeholder, and anything shorter than this
+PLACEHOLDER_SESSION_SECRETS = {'change-me'}
+MIN_SESSION_SECRET_BYTES = 32
+
+# Preferences given to new accounts, and assumed for any key a user has never set
+DEFAULT_PREFERENCES = {
+    'show_name': True,
+    'email_notifications': True,
+    'theme': 'light'
+}
+
+# Written by maintenance.py backfill-identity-keys once every account has key documents;
+# until then lookups that miss a key document fall back to querying users by field
+IDENTITY_KEYS_MARKER = ('maintenance', 'identityKeys')
+# How long a missing marker is trusted before it is read again
+IDENTITY_KEYS_MARKER_TTL_SECONDS = 60
+_identity_keys_backfilled = False
+_identity_keys_checked_at = 0.0
+
+# Used only when SESSION_SECRET is unset or too weak: tokens then survive refreshes but not other replicas
+_fallback_session_secret = secrets.token_bytes(32)
+_weak_secret_warned = False
+
+
+def get_bcrypt_rounds() -> int:
+    """Configured bcrypt cost factor (BCRYPT_ROUNDS)"""
+    return int(get_config_value('BCRYPT_ROUNDS', DEFAULT_BCRYPT_ROUNDS))
+
+
+def get_bcrypt_executor() -> ThreadPoolExecutor:
+    """Bounded worker pool shared by all sessions for bcrypt work"""
+    # bcrypt releases the GIL while hashing, so threads use separate cores, and the
+    # pool size caps how many cores a burst of logins can take (BCRYPT_WORKERS)
+    global _bcrypt_executor
+    if _bcrypt_executor is None:
+        with _bcrypt_executor_lock:
+            if _bcrypt_executor is None:
+                default_workers = max(1, (os.cpu_count() or 2) // 2)
+                workers = int(get_config_value('BCRYPT_WORKERS', default_workers))
+                _bcrypt_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+    return _bcrypt_executor
+
+
+def _get_session_secret() -> bytes:
+    """HMAC key shared by every replica (SESSION_SECRET)"""
+    global _weak_secret_warned
+    secret = (get_config_value('SESSION_SECRET') or '').encode('utf-8')
+    if secret and secret.decode('utf-8') not in PLACEHOLDER_SESSION_SECRETS and len(secret) >= MIN_SESSION_SECRET_BYTES:
+        return secret
+    
+    # A guessable key would let anyone forge a token for any user_id
+    if secret and not _weak_secret_warned:
+        _weak_secret_warned = True
+        warnings.warn(f"SESSION_SECRET is a placeholder or shorter than {MIN_SESSION_SECRET_BYTES} bytes; "
+                      "using a per-process key, so sessions will not survive restarts or move between replicas")
+    return _fallback_session_secret
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _client_address() -> Optional[str]:
+    """Address of the browser behind the current session, for per-client throttling"""
+    try:
+        # Behind a reverse proxy every session shares the proxy's address; the hop
+        # it appends to X-Forwarded-For is the real client
+        if str(get_config_value('LOGIN_TRUST_PROXY', 'false')).lower() in ('1', 'true', 'yes'):
+            forwarded = st.context.headers.get('X-Forwarded-For')
+            if forwarded:
+                return forwarded.split(',')[-1].strip()
+        return st.context.ip_address
+    except Exception:
+        return None
+
+
 class AuthManager:
     def __init__(self):
-        self.db = get_firestore_db()
-        
         # Initialize session state
         if 'authenticated' not in st.session_state:
             st.session_state.authenticated = False
         if 'current_user' not in st.session_state:
             st.session_state.current_user = None
+        
+        if not st.session_state.authenticated:
+            self._restore_session()
+    
+    @property
+    def db(self):
+        """Firestore client, resolved on first use"""
+        return get_firestore_db()
     
     def hash_password(self, password: str) -> str:
-        """Hash password using bcrypt"""
-        salt = bcrypt.gensalt()
-        hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
+        """Hash password using bcrypt on the worker pool"""
+        salt = bcrypt.gensalt(rounds=get_bcrypt_rounds())
+        hashed = get_bcrypt_executor().submit(bcrypt.hashpw, password.encode('utf-8'), salt).result()
         return hashed.decode('utf-8')
     
     def verify_password(self, password: str, hashed: str) -> bool:
-        """Verify password against hash"""
-        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+        """Verify password against hash on the worker pool"""
+        return get_bcrypt_executor().submit(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8')).result()
+    
+    @staticmethod
+    def needs_rehash(hashed: str) -> bool:
+        """Whether a hash was made with a cost factor other than the configured one"""
+        # bcrypt hashes look like $2b$<cost>$<salt+hash>
+        try:
+            return int(hashed.split('$')[2]) != get_bcrypt_rounds()
+        except (IndexError, ValueError):
+            return False
     
     def is_valid_email(self, email: str) -> bool:
         """Validate email format"""
@@ -54,71 +179,251 @@ class AuthManager:
         if not self.is_valid_password(password):
             return False, "Password must be at least 6 characters"
         
-        # Check if user already exists
-        if self.get_user_by_email(email):
-            return False, "Email already registered"
-        
-        if self.get_user_by_username(username):
-            return False, "Username already taken"
-        
-        # Create user
+        # Create user; email and username uniqueness is enforced by the same transaction
         password_hash = self.hash_password(password)
-        success = self.create_user(email, username, password_hash)
+        success, message = self._create_user_record(email, username, password_hash)
         
         if success:
             return True, "Registration successful! Please log in."
         else:
-            return False, "Registration failed. Please try again."
+            return False, message
     
     def login(self, login_field: str, password: str) -> tuple[bool, str]:
         """Login user with email or username"""
-        # Determine if login_field is email or username
-        if '@' in login_field:
-            user = self.get_user_by_email(login_field)
-        else:
-            user = self.get_user_by_username(login_field)
+        # Throttle before the user lookup so rejected attempts cost no reads or bcrypt time
+        limiter = get_login_limiter()
+        allowed, retry_after = limiter.check(login_field, _client_address())
+        if not allowed:
+            return False, f"Too many login attempts. Try again in {format_retry_after(retry_after)}."
         
-        if not user:
-            return False, "Invalid credentials"
+        user = self.authenticate(login_field, password)
         
-        if self.verify_password(password, user['password_hash']):
-            # Update last login
-            self.update_last_login(user['user_id'])
+        if user:
+            limiter.record_success(login_field)
             
-            # Set session state
+            # Session state keeps only the slim profile, never the password hash
+            profile = get_profile_cache().put(SessionProfile.from_user(user))
             st.session_state.authenticated = True
-            st.session_state.current_user = user
+            st.session_state.current_user = profile
+            self._persist_session(profile)
             
             return True, "Login successful!"
         else:
             return False, "Invalid credentials"
     
+    def authenticate(self, login_field: str, password: str) -> Optional[Dict]:
+        """Check credentials and record the login, without touching session state"""
+        # Determine if login_field is email or username
+        if '@' in login_field:
+            user = self.get_user_by_email(login_field)
+        else:
+            user = self.get_user_by_username(login_field)
+        
+        if not user or not self.verify_password(password, user['password_hash']):
+            return None
+        
+        # Upgrade the stored hash to the configured cost while the password is at hand
+        new_hash = self.hash_password(password) if self.needs_rehash(user['password_hash']) else None
+        
+        # Update last login
+        if self.update_last_login(user['user_id'], password_hash=new_hash) and new_hash:
+            user['password_hash'] = new_hash
+        
+        return user
+    
     def logout(self):
         """Logout current user"""
         st.session_state.authenticated = False
         st.session_state.current_user = None
+        
+        # Revoke the token server-side too, in case a copy of it outlived this browser's cookie
+        self._revoke_session_token(st.session_state.pop('session_token', None))
+        self._set_session_cookie(None)
+    
+    def issue_session_token(self, user: Dict, ttl_hours: Optional[float] = None) -> str:
+        """Sign the user fields the app displays into an expiring session token"""
+        if ttl_hours is None:
+            ttl_hours = float(get_config_value('SESSION_TTL_HOURS', DEFAULT_SESSION_TTL_HOURS))
+        
+        created_at = user.get('created_at')
+        payload = {
+            'user_id': user['user_id'],
+            'username': user.get('username'),
+            'email': user.get('email'),
+            'created_at': created_at.isoformat() if hasattr(created_at, 'isoformat') else None,
+            'preferences': dict(user.get('preferences') or {}),
+            'jti': secrets.token_urlsafe(16),
+            'exp': int(time.time() + ttl_hours * 3600)
+        }
+        
+        body = _b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+        signature = _b64encode(hmac.new(_get_session_secret(), body.encode('ascii'), hashlib.sha256).digest())
+        return f"{body}.{signature}"
+    
+    def verify_session_token(self, token: str) -> Optional[Dict]:
+        """Return the user stored in a session token if its signature and expiry are valid"""
+        try:
+            body, signature = token.split('.', 1)
+            expected = _b64encode(hmac.new(_get_session_secret(), body.encode('ascii'), hashlib.sha256).digest())
+            if not hmac.compare_digest(signature, expected):
+                return None
+            
+            payload = json.loads(_b64decode(body))
+            if payload.get('exp', 0) < time.time():
+                return None
+            
+            user = {key: value for key, value in payload.items() if key not in ('exp', 'jti')}
+            if user.get('created_at'):
+                user['created_at'] = datetime.fromisoformat(user['created_at'])
+            return user
+            
+        except (ValueError, TypeError, KeyError):
+            return None
+    
+    @staticmethod
+    def _token_claims(token: str) -> Dict:
+        """The unverified jti and exp of a token this session issued or already verified"""
+        try:
+            payload = json.loads(_b64decode(token.split('.', 1)[0]))
+            return {'jti': payload.get('jti'), 'exp': payload.get('exp', 0)}
+        except (ValueError, TypeError, AttributeError):
+            return {}
+    
+    def _revoke_session_token(self, token: Optional[str]):
+        """Record a token's id as revoked until it would have expired anyway"""
+        claims = self._token_claims(token) if token else {}
+        if not claims.get('jti') or claims['exp'] < time.time():
+            return
+        try:
+            get_revoked_sessions().revoke(claims['jti'], claims['exp'])
+        except Exception as e:
+            st.error(f"Error revoking session: {e}")
+    
+    def _is_revoked(self, token: str) -> bool:
+        """Whether a token was revoked by a logout or replaced by a newer one, from the in-memory set"""
+        jti = self._token_claims(token).get('jti')
+        return not jti or get_revoked_sessions().is_revoked(jti)
+    
+    @staticmethod
+    def _set_session_cookie(token: Optional[str]):
+        """Queue a write (or with None, a clear) of the browser's session cookie"""
+        try:
+            st.session_state.session_cookie = token or ''
+        except Exception:
+            # Outside a Streamlit session (scripts, benchmarks) there is nowhere to keep it
+            pass
+    
+    def sync_session_cookie(self):
+        """Render the cookie write queued by login, logout or a token refresh; call once per rerun"""
+        # Rendered on every rerun rather than once, so a st.rerun() straight after login cannot
+        # unmount the component before its script has run
+        if 'session_cookie' not in st.session_state:
+            return
+        token = st.session_state.session_cookie
+        max_age = int(float(get_config_value('SESSION_TTL_HOURS', DEFAULT_SESSION_TTL_HOURS)) * 3600) if token else 0
+        # Components render in a same-origin iframe, so the cookie is set on the app's own document
+        components.html(f"""<script>
+        const secure = window.parent.location.protocol === 'https:' ? '; Secure' : '';
+        window.parent.document.cookie = {json.dumps(SESSION_COOKIE)} + '=' + {json.dumps(token)} +
+            '; Path=/; Max-Age={max_age}; SameSite=Strict' + secure;
+        </script>""", height=0)
+    
+    def _persist_session(self, user: SessionProfile):
+        """Store a fresh session token in the browser's cookie, revoking the one it replaces"""
+        token = self.issue_session_token(user)
+        try:
+            self._revoke_session_token(st.session_state.get('session_token'))
+            st.session_state.session_token = token
+        except Exception:
+            pass
+        self._set_session_cookie(token)
+    
+    def _restore_session(self):
+        """Log the browser back in from its session cookie, without touching Firestore"""
+        try:
+            # Links made by older versions carried the token; drop it so it is not shared further
+            if LEGACY_SESSION_QUERY_PARAM in st.query_params:
+                del st.query_params[LEGACY_SESSION_QUERY_PARAM]
+            token = st.context.cookies.get(SESSION_COOKIE)
+        except Exception:
+            return
+        
+        user = self.verify_session_token(token) if token else None
+        if user and not self._is_revoked(token):
+            st.session_state.authenticated = True
+            st.session_state.session_token = token
+            # Token claims may be stale, so they serve only this session; the shared cache is
+            # filled from the user document when get_current_user() finds no entry
+            st.session_state.current_user = SessionProfile.from_user(user)
     
     def is_authenticated(self) -> bool:
         """Check if user is authenticated"""
         return st.session_state.get('authenticated', False)
     
-    def get_current_user(self) -> Optional[Dict]:
-        """Get current user data"""
-        return st.session_state.get('current_user')
+    def get_current_user(self) -> Optional[SessionProfile]:
+        """Get the current user's profile, picking up changes made from other sessions"""
+        profile = st.session_state.get('current_user')
+        if profile is None:
+            return None
+        
+        cached = get_profile_cache().get(profile.user_id)
+        if cached is None:
+            # Evicted or invalidated: rebuild once from the user document
+            cached = self._load_profile(profile.user_id) or profile
+        if cached is not profile:
+            st.session_state.current_user = cached
+        return cached
+    
+    def _load_profile(self, user_id: str) -> Optional[SessionProfile]:
+        """Read a user's document into the profile cache"""
+        try:
+            if not self.db:
+                return None
+            
+            doc = self.db.collection('users').document(user_id).get()
+            if doc.exists:
+                return get_profile_cache().put(SessionProfile.from_user(doc.to_dict()))
+            return None
+            
+        except Exception as e:
+            st.error(f"Error loading user profile: {e}")
+            return None
+    
+    def get_preferences(self) -> Dict:
+        """Current user's preferences from the session profile, with defaults filled in"""
+        current_user = self.get_current_user()
+        if not current_user:
+            return dict(DEFAULT_PREFERENCES)
+        return {**DEFAULT_PREFERENCES, **current_user.preferences}
+    
+    def get_preference(self, name: str, default=None):
+        """One preference of the current user, without reading the user document"""
+        return self.get_preferences().get(name, default)
+    
+    def diff_preferences(self, preferences: Dict) -> Dict:
+        """The submitted preferences that differ from the current ones"""
+        current = self.get_preferences()
+        return {key: value for key, value in preferences.items() if current.get(key) != value}
     
     def update_preferences(self, preferences: Dict) -> bool:
-        """Update current user's preferences"""
+        """Update current user's preferences, writing only the fields that changed"""
         if not self.is_authenticated():
             return False
         
         current_user = self.get_current_user()
         if current_user:
-            success = self.update_user_preferences(current_user['user_id'], preferences)
+            changes = self.diff_preferences(preferences)
+            if not changes:
+                return True
+            
+            success = self.update_user_preferences(current_user['user_id'], changes)
             
             if success:
-                # Update session state
-                current_user['preferences'] = preferences
-                st.session_state.current_user = current_user
+                # Update session state and the token that carries the preferences
+                merged = {**current_user.preferences, **changes}
+                profile = get_profile_cache().put(current_user.with_preferences(merged))
+                st.session_state.current_user = profile
+                self._persist_session(profile)
                 return True
         
         return False
@@ -130,22 +435,49 @@ class AuthManager:
         
         current_user = self.get_current_user()
         if current_user:
-            preferences = current_user.get('preferences', {})
-            show_name = preferences.get('show_name', True)
-            
-            if show_name:
-                return current_user.get('username', 'User')
-            else:
-                return "Anonymous"
+            return current_user.display_name or 'User'
         
         return "Guest"
     
+    def is_username_available(self, username: str) -> bool:
+        """Whether a username is free, reading the database only when the filter cannot rule it out"""
+        identity_filter = get_identity_filter()
+        if not identity_filter.might_have_username(username):
+            return True
+        
+        available = self.get_user_by_username(username) is None
+        if available:
+            identity_filter.record_false_positive()
+        return available
+    
+    def is_email_available(self, email: str) -> bool:
+        """Whether an email is free, reading the database only when the filter cannot rule it out"""
+        identity_filter = get_identity_filter()
+        if not identity_filter.might_have_email(email):
+            return True
+        
+        available = self.get_user_by_email(email) is None
+        if available:
+            identity_filter.record_false_positive()
+        return available
+    
+    @staticmethod
+    def _email_key(email: str) -> str:
+        """Document id reserving an email address (emails compare case-insensitively)"""
+        return email.strip().lower()
+    
     def create_user(self, email: str, username: str, password_hash: str) -> bool:
         """Create a new user in Firestore"""
+        success, message = self._create_user_record(email, username, password_hash)
+        if not success:
+            st.error(f"❌ {message}")
+        return success
+    
+    def _create_user_record(self, email: str, username: str, password_hash: str) -> tuple[bool, str]:
+        """Create the user and its usernames/emails key documents in one transaction"""
         try:
             if not self.db:
-                st.error("❌ Database connection not available")
-                return False
+                return False, "Database connection not available"
             
             user_id = str(uuid.uuid4())
             user_data = {
@@ -155,33 +487,102 @@ class AuthManager:
                 'password_hash': password_hash,
                 'created_at': datetime.now(),
                 'last_login': datetime.now(),
-                'preferences': {
-                    'show_name': True,
-                    'email_notifications': True,
-                    'theme': 'light'
-                }
+                'preferences': dict(DEFAULT_PREFERENCES)
             }
             
-            self.db.collection('users').document(user_id).set(user_data)
-            return True
+            # Until the key backfill has run, legacy accounts have no key documents to conflict with
+            if self._needs_legacy_lookup():
+                if self._get_legacy_user('email', email):
+                    return False, "Email already registered"
+                if self._get_legacy_user('username', username):
+                    return False, "Username already taken"
+            
+            user_ref = self.db.collection('users').document(user_id)
+            email_ref = self.db.collection('emails').document(self._email_key(email))
+            username_ref = self.db.collection('usernames').document(username)
+            
+            def create_with_keys(transaction):
+                # Concurrent sign-ups for the same name or email conflict here and retry
+                if email_ref.get(transaction=transaction).exists:
+                    return "Email already registered"
+                if username_ref.get(transaction=transaction).exists:
+                    return "Username already taken"
+                
+                key_data = {'userId': user_id, 'createdAt': user_data['created_at']}
+                transaction.create(email_ref, key_data)
+                transaction.create(username_ref, key_data)
+                transaction.set(user_ref, user_data)
+                return None
+            
+            conflict = run_in_transaction(create_with_keys)
+            if conflict:
+                return False, conflict
+            
+            get_username_index().add(username)
+            get_identity_filter().add_user(username, email)
+            return True, "User created"
             
         except Exception as e:
-            st.error(f"❌ Error creating user: {str(e)}")
+            return False, f"Error creating user: {str(e)}"
+    
+    def _needs_legacy_lookup(self) -> bool:
+        """Whether accounts without key documents may still exist (IDENTITY_KEYS_BACKFILLED skips the check)"""
+        global _identity_keys_backfilled, _identity_keys_checked_at
+        if _identity_keys_backfilled:
             return False
+        if str(get_config_value('IDENTITY_KEYS_BACKFILLED', 'false')).lower() in ('1', 'true', 'yes'):
+            _identity_keys_backfilled = True
+            return False
+        
+        now = time.monotonic()
+        if now - _identity_keys_checked_at > IDENTITY_KEYS_MARKER_TTL_SECONDS:
+            collection, document = IDENTITY_KEYS_MARKER
+            _identity_keys_backfilled = self.db.collection(collection).document(document).get().exists
+            _identity_keys_checked_at = now
+        return not _identity_keys_backfilled
+    
+    def _get_legacy_user(self, field: str, value: str) -> Optional[Dict]:
+        """Find an account created before key documents existed (see maintenance.py backfill-identity-keys)"""
+        if field == 'email':
+            # Key documents compare emails case-insensitively; legacy records hold them as typed
+            query = self.db.collection('users').where('email', 'in', list(dict.fromkeys([value, self._email_key(value)])))
+        else:
+            query = self.db.collection('users').where(field, '==', value)
+        for doc in query.limit(1).stream():
+            return doc.to_dict()
+        return None
+    
+    @staticmethod
+    def _is_valid_key(key: str) -> bool:
+        """Whether a key can be used as a document id (login input is otherwise unchecked)"""
+        return bool(key) and '/' not in key and key not in ('.', '..') and \
+            not (key.startswith('__') and key.endswith('__')) and len(key.encode('utf-8')) <= 1500
+    
+    def _get_user_by_key(self, collection: str, key: str) -> Optional[Dict]:
+        """Resolve a usernames/emails key document to its user with direct gets"""
+        if not self._is_valid_key(key):
+            return None
+        
+        key_doc = self.db.collection(collection).document(key).get()
+        if not key_doc.exists:
+            return None
+        
+        user_doc = self.db.collection('users').document(key_doc.to_dict()['userId']).get()
+        return user_doc.to_dict() if user_doc.exists else None
     
     def get_user_by_email(self, email: str) -> Optional[Dict]:
         """Get user by email"""
         try:
             if not self.db:
                 return None
-                
-            users_ref = self.db.collection('users')
-            query = users_ref.where('email', '==', email).limit(1)
-            docs = query.stream()
             
-            for doc in docs:
-                return doc.to_dict()
-            return None
+            user = self._get_user_by_key('emails', self._email_key(email))
+            if user:
+                return user
+            
+            if not self._needs_legacy_lookup():
+                return None
+            return self._get_legacy_user('email', email)
             
         except Exception as e:
             st.error(f"Error getting user by email: {e}")
@@ -192,27 +593,35 @@ class AuthManager:
         try:
             if not self.db:
                 return None
-                
-            users_ref = self.db.collection('users')
-            query = users_ref.where('username', '==', username).limit(1)
-            docs = query.stream()
             
-            for doc in docs:
-                return doc.to_dict()
-            return None
+            user = self._get_user_by_key('usernames', username)
+            if user:
+                return user
+            
+            if not self._needs_legacy_lookup():
+                return None
+            return self._get_legacy_user('username', username)
             
         except Exception as e:
             st.error(f"Error getting user by username: {e}")
             return None
     
-    def update_last_login(self, user_id: str) -> bool:
-        """Update user's last login timestamp"""
+    def update_last_login(self, user_id: str, password_hash: Optional[str] = None) -> bool:
+        """Update user's last login timestamp, and the password hash when it was upgraded"""
         try:
             if not self.db:
                 return False
                 
+            updates = {'last_login': datetime.now()}
+            
+            # The timestamp alone is low value and is written behind the request
+            if not password_hash:
+                get_write_behind_queue().enqueue('users', user_id, updates)
+                return True
+            
+            updates['password_hash'] = password_hash
             user_ref = self.db.collection('users').document(user_id)
-            user_ref.update({'last_login': datetime.now()})
+            user_ref.update(updates)
             return True
             
         except Exception as e:
@@ -220,13 +629,16 @@ class AuthManager:
             return False
     
     def update_user_preferences(self, user_id: str, preferences: Dict) -> bool:
-        """Update user preferences using merge=True"""
+        """Update the given preference fields using merge=True, leaving the others untouched"""
         try:
             if not self.db:
                 return False
                 
             user_ref = self.db.collection('users').document(user_id)
             user_ref.set({'preferences': preferences}, merge=True)
+            
+            # Sessions of this user rebuild their profile on next access
+            get_profile_cache().invalidate(user_id)
             return True
             
         except Exception as e:
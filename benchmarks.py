@@ -0,0 +1,706 @@
+"""
+Performance benchmarks for the Firestore-backed managers
+
+Usage:
+    python benchmarks.py [--backend memory|firebase] user-invitations [--sizes 1000 10000 100000] [--repeat 20]
+    python benchmarks.py [--backend memory|firebase] startup [--runs 5]
+    python benchmarks.py [--backend memory|firebase] concurrent-evaluations [--participants 5 20 50]
+    python benchmarks.py [--backend memory|firebase] invitation-fanout [--invitees 1 5 15 50 300] [--repeat 5]
+    python benchmarks.py [--backend memory|firebase] logins [--concurrency 1 4 16] [--logins 64] [--rounds 12]
+    python benchmarks.py identity-filter [--sizes 10000 100000 1000000] [--fp-rate 0.01] [--probes 100000]
+    python benchmarks.py cupping-analytics [--cuppings 1000 10000 100000] [--repeat 5]
+    python benchmarks.py cupping-search [--cuppings 10000 100000 1000000] [--repeat 50]
+    python benchmarks.py cupping-similarity [--cuppings 10000 100000 500000] [--k 10] [--repeat 50]
+    python benchmarks.py recommendations [--users 1000 10000 100000] [--ratings-per-user 20] [--coffees 5000]
+
+Benchmarks run against the in-memory backend by default. With --backend firebase
+they write synthetic documents (tagged with a 'benchmark' field) into the
+configured project and remove them afterwards; never point that at production.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+import numpy as np
+
+from firebase import firebase_manager, get_firestore_db, FIRESTORE_BATCH_LIMIT, MEMORY_BACKEND
+from cupper_invitations import CupperInvitationManager
+from auth import AuthManager, get_bcrypt_executor
+from identity_filter import BloomFilter
+from cupping_analytics import CuppingHistory, SCORE_ATTRIBUTES
+from cupping_search import CuppingSearchIndex
+from cupping_similarity import CuppingSimilarityIndex
+from recommendations import RecommendationModel, DEFAULT_FACTORS, DEFAULT_ITERATIONS, DEFAULT_TOP_N
+
+
+def _time_call(func: Callable, repeat: int) -> Dict:
+    """Run func repeatedly and return latency percentiles in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    
+    samples.sort()
+    return {
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+    }
+
+
+def _write_in_batches(db, writes: List[tuple]):
+    """Commit (reference, data) pairs in batches of FIRESTORE_BATCH_LIMIT"""
+    for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for ref, data in writes[start:start + FIRESTORE_BATCH_LIMIT]:
+            batch.set(ref, data)
+        batch.commit()
+
+
+def _delete_in_batches(db, refs: List):
+    """Delete document references in batches of FIRESTORE_BATCH_LIMIT"""
+    for start in range(0, len(refs), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for ref in refs[start:start + FIRESTORE_BATCH_LIMIT]:
+            batch.delete(ref)
+        batch.commit()
+
+
+def _legacy_invitation_scan(db, user_id: str) -> List[Dict]:
+    """The pre-index lookup: stream every invitation and filter inviteeUsers in Python"""
+    matches = []
+    for doc in db.collection('cuppingInvitations').stream():
+        invitation = doc.to_dict()
+        if any(u.get('userId') == user_id for u in invitation.get('inviteeUsers', [])):
+            matches.append(invitation)
+    return matches
+
+
+def bench_user_invitations(db, sizes: List[int], repeat: int, invitations_per_user: int = 20) -> List[Dict]:
+    """Measure get_user_invitations latency as the invitation collection grows"""
+    manager = CupperInvitationManager()
+    
+    target_user_id = f"bench-{uuid.uuid4()}"
+    invitations_ref = db.collection('cuppingInvitations')
+    created_refs = []
+    results = []
+    
+    try:
+        for size in sorted(sizes):
+            writes = []
+            for index in range(len(created_refs), size):
+                invitation_id = f"bench-{uuid.uuid4()}"
+                # The target user keeps a fixed number of invitations while the collection grows
+                is_target = index < invitations_per_user
+                invitee_id = target_user_id if is_target else f"bench-user-{index}"
+                ref = invitations_ref.document(invitation_id)
+                writes.append((ref, {
+                    'invitationId': invitation_id,
+                    'inviterId': 'bench-inviter',
+                    'inviterName': 'Benchmark',
+                    'inviteeUsers': [{'userId': invitee_id, 'username': invitee_id, 'email': ''}],
+                    'inviteeIds': [invitee_id],
+                    'sessionData': {'coffee_name': 'Benchmark Coffee', 'session_type': 'Coffee Cupping'},
+                    'status': 'pending',
+                    'createdAt': datetime.now(),
+                    'expiresAt': datetime.now() + timedelta(days=7),
+                    'responses': {},
+                    'participantEvaluations': {},
+                    'benchmark': True
+                }))
+                created_refs.append(ref)
+            _write_in_batches(db, writes)
+            
+            indexed = _time_call(lambda: manager.get_user_invitations(target_user_id), repeat)
+            legacy = _time_call(lambda: _legacy_invitation_scan(db, target_user_id), max(1, repeat // 10))
+            results.append({
+                'collection_size': size,
+                'matches': len(manager.get_user_invitations(target_user_id)),
+                'indexed_median_ms': indexed['median_ms'],
+                'indexed_p95_ms': indexed['p95_ms'],
+                'legacy_scan_median_ms': legacy['median_ms'],
+            })
+    finally:
+        _delete_in_batches(db, created_refs)
+    
+    return results
+
+
+def bench_concurrent_evaluations(db, participant_counts: List[int]) -> List[Dict]:
+    """Have every participant respond and submit at the same moment and check nothing is lost"""
+    manager = CupperInvitationManager()
+    results = []
+    
+    for participants in participant_counts:
+        invitation_id = f"bench-{uuid.uuid4()}"
+        user_ids = [f"bench-user-{uuid.uuid4()}" for _ in range(participants)]
+        invitation_ref = db.collection('cuppingInvitations').document(invitation_id)
+        invitation_ref.set({
+            'invitationId': invitation_id,
+            'inviterId': 'bench-inviter',
+            'inviteeIds': user_ids,
+            'sessionData': {'coffee_name': 'Benchmark Coffee'},
+            'status': 'pending',
+            'createdAt': datetime.now(),
+            'expiresAt': datetime.now() + timedelta(days=7),
+            'responses': {},
+            'participantEvaluations': {},
+            'benchmark': True
+        })
+        
+        # Release all participants together to maximise write contention
+        barrier = threading.Barrier(participants)
+        
+        def participate(user_id: str) -> bool:
+            barrier.wait()
+            responded = manager.respond_to_invitation(invitation_id, user_id, 'accept', user_id)
+            submitted = manager.submit_collaborative_evaluation(
+                invitation_id, user_id, user_id, {'overall_score': 80, 'aroma': 7.5}
+            )
+            return responded and submitted
+        
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=participants) as pool:
+                succeeded = sum(pool.map(participate, user_ids))
+            wall_ms = (time.perf_counter() - start) * 1000
+            
+            stored = invitation_ref.get().to_dict()
+            responses = len(stored.get('responses', {}))
+            evaluations = len(stored.get('participantEvaluations', {}))
+            results.append({
+                'participants': participants,
+                'succeeded': succeeded,
+                'responses_stored': responses,
+                'evaluations_stored': evaluations,
+                'lost_updates': 2 * participants - responses - evaluations,
+                'wall_ms': round(wall_ms, 1),
+            })
+        finally:
+            _delete_in_batches(db, [invitation_ref] + [db.collection('userSummaries').document(u) for u in user_ids])
+    
+    return results
+
+
+def _legacy_create_invitation(db, invitation_id: str, usernames: List[str]):
+    """The pre-batching create: one users query per invitee, then one write per document"""
+    invitee_user_data = []
+    for username in usernames:
+        user_docs = list(db.collection('users').where('username', '==', username).limit(1).stream())
+        if user_docs:
+            invitee_user_data.append({'userId': user_docs[0].id, 'username': username})
+    
+    db.collection('cuppingInvitations').document(invitation_id).set({
+        'invitationId': invitation_id,
+        'inviteeUsers': invitee_user_data,
+        'createdAt': datetime.now(),
+        'benchmark': True
+    })
+    for user_data in invitee_user_data:
+        notification_id = f"bench-{uuid.uuid4()}"
+        db.collection('notifications').document(notification_id).set({
+            'notificationId': notification_id,
+            'invitationId': invitation_id,
+            'recipientUserId': user_data['userId'],
+            'benchmark': True
+        })
+
+
+def bench_invitation_fanout(db, invitee_counts: List[int], repeat: int) -> List[Dict]:
+    """Measure create_invitation latency and round trips against invitee count"""
+    manager = CupperInvitationManager()
+    # Round trips are only observable on the in-memory backend
+    stats = getattr(db, 'stats', None)
+    
+    user_refs = []
+    invitation_ids = []
+    results = []
+    
+    def round_trips(before: Dict) -> int:
+        after = stats()
+        return (after['queries'] - before['queries']) + (after['commits'] - before['commits'])
+    
+    try:
+        usernames = [f"bench-{uuid.uuid4().hex[:12]}" for _ in range(max(invitee_counts))]
+        writes = []
+        for username in usernames:
+            ref = db.collection('users').document(f"bench-{uuid.uuid4()}")
+            writes.append((ref, {'username': username, 'email': f"{username}@example.com", 'benchmark': True}))
+            user_refs.append(ref)
+        _write_in_batches(db, writes)
+        
+        session_data = {'coffee_name': 'Benchmark Coffee', 'session_type': 'Coffee Cupping', 'benchmark': True}
+        for count in sorted(invitee_counts):
+            invitees = usernames[:count]
+            row = {'invitees': count}
+            
+            def batched():
+                invitation_ids.append(manager.create_invitation(session_data, 'bench-inviter', 'Benchmark', invitees))
+            
+            def legacy():
+                invitation_id = f"bench-{uuid.uuid4()}"
+                invitation_ids.append(invitation_id)
+                _legacy_create_invitation(db, invitation_id, invitees)
+            
+            for label, func in (('batched', batched), ('legacy', legacy)):
+                if stats:
+                    before = stats()
+                    func()
+                    row[f'{label}_round_trips'] = round_trips(before)
+                row[f'{label}_median_ms'] = _time_call(func, repeat)['median_ms']
+            
+            results.append(row)
+    finally:
+        cleanup_refs = list(user_refs)
+        for invitation_id in filter(None, invitation_ids):
+            cleanup_refs.append(db.collection('cuppingInvitations').document(invitation_id))
+            notifications = db.collection('notifications').where('invitationId', '==', invitation_id)
+            cleanup_refs.extend(doc.reference for doc in notifications.stream())
+        cleanup_refs.extend(db.collection('userSummaries').document(ref.id) for ref in user_refs)
+        _delete_in_batches(db, cleanup_refs)
+    
+    return results
+
+
+def bench_logins(db, concurrency_levels: List[int], logins: int, rounds: int, users: int = 16) -> List[Dict]:
+    """Measure login throughput and tail latency with concurrent sessions"""
+    os.environ['BCRYPT_ROUNDS'] = str(rounds)
+    auth_manager = AuthManager()
+    password = 'benchmark-password'
+    
+    usernames = [f"bench_{uuid.uuid4().hex[:12]}" for _ in range(users)]
+    for username in usernames:
+        auth_manager.create_user(f"{username}@example.com", username, auth_manager.hash_password(password))
+    
+    results = []
+    try:
+        for concurrency in concurrency_levels:
+            samples = []
+            
+            def login(index: int):
+                start = time.perf_counter()
+                user = auth_manager.authenticate(usernames[index % users], password)
+                samples.append((time.perf_counter() - start) * 1000)
+                return user is not None
+            
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                succeeded = sum(pool.map(login, range(logins)))
+            wall = time.perf_counter() - start
+            
+            samples.sort()
+            results.append({
+                'concurrency': concurrency,
+                'bcrypt_workers': get_bcrypt_executor()._max_workers,
+                'rounds': rounds,
+                'succeeded': succeeded,
+                'logins_per_sec': round(logins / wall, 1),
+                'p50_ms': round(statistics.median(samples), 1),
+                'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 1),
+            })
+    finally:
+        refs = []
+        for username in usernames:
+            user = auth_manager.get_user_by_username(username)
+            if user:
+                refs.append(db.collection('users').document(user['user_id']))
+            refs.append(db.collection('usernames').document(username))
+            refs.append(db.collection('emails').document(f"{username}@example.com"))
+        _delete_in_batches(db, refs)
+    
+    return results
+
+
+# Runs in a fresh interpreter so import costs are measured cold
+_STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file('main.py', default_timeout=60)
+app.run()
+rendered_ms = (time.perf_counter() - start) * 1000
+
+firebase = sys.modules['firebase']
+login_rendered = any(widget.label == 'Email or Username' for widget in app.text_input)
+firebase_admin_imported = 'firebase_admin' in sys.modules
+initialized_at_render = firebase.firebase_manager.is_initialized()
+
+start = time.perf_counter()
+firebase.get_firestore_db()
+first_use_ms = (time.perf_counter() - start) * 1000
+
+print(json.dumps({
+    'login_rendered': login_rendered,
+    'render_ms': round(rendered_ms, 1),
+    'firebase_admin_imported_at_render': firebase_admin_imported,
+    'db_initialized_at_render': initialized_at_render,
+    'deferred_init_ms': round(first_use_ms, 1),
+}))
+"""
+
+
+def bench_identity_filter(sizes: List[int], fp_rate: float, probes: int) -> List[Dict]:
+    """Memory, lookup time and measured false-positive rate of the registration Bloom filter"""
+    results = []
+    
+    for size in sizes:
+        bloom = BloomFilter(size, fp_rate)
+        for i in range(size):
+            bloom.add(f"u:user{i}")
+        
+        # Names never added: every hit is a false positive
+        start = time.perf_counter()
+        false_positives = sum(1 for i in range(probes) if f"u:free{i}" in bloom)
+        lookup_us = (time.perf_counter() - start) / probes * 1e6
+        
+        results.append({
+            'entries': size,
+            'memory_kib': round(bloom.memory_bytes / 1024, 1),
+            'bits_per_entry': round(bloom.size / size, 2),
+            'hashes': bloom.hash_count,
+            'expected_fp_rate': round(bloom.false_positive_rate(), 5),
+            'measured_fp_rate': round(false_positives / probes, 5),
+            'lookup_us': round(lookup_us, 2)
+        })
+    
+    return results
+
+
+def _legacy_cupping_summary(cuppings: List[Dict]) -> Dict:
+    """List-based statistics as get_cupping_stats used to compute them"""
+    summary = {}
+    for attribute in SCORE_ATTRIBUTES:
+        values = sorted(c[attribute] for c in cuppings if c.get(attribute) is not None)
+        summary[attribute] = {
+            'mean': sum(values) / len(values),
+            'percentiles': [values[min(len(values) - 1, int(len(values) * p / 100))] for p in (25, 50, 75, 90)]
+        }
+    origins = [c['origin'] for c in cuppings if c.get('origin')]
+    roasters = [c['roaster'] for c in cuppings if c.get('roaster')]
+    summary['favorite_origin'] = max(set(origins), key=origins.count)
+    summary['favorite_roaster'] = max(set(roasters), key=roasters.count)
+    return summary
+
+
+def bench_cupping_analytics(cupping_counts: List[int], repeat: int, origins: int = 60, roasters: int = 400) -> List[Dict]:
+    """Columnar build and vectorized summary vs list-based statistics for one user's history"""
+    rng = random.Random(42)
+    results = []
+    
+    for count in cupping_counts:
+        start_time = datetime.now() - timedelta(days=count)
+        cuppings = [{
+            'created_at': start_time + timedelta(days=i),
+            'origin': f"origin-{rng.randrange(origins)}",
+            'roaster': f"roaster-{rng.randrange(roasters)}",
+            'overall_score': rng.randint(60, 100),
+            **{attribute: rng.randint(0, 10) for attribute in ('aroma', 'flavor', 'acidity', 'body')}
+        } for i in range(count)]
+        
+        build = _time_call(lambda: CuppingHistory.from_records(cuppings), repeat)
+        history = CuppingHistory.from_records(cuppings)
+        vectorized = _time_call(history.summary, repeat)
+        legacy = _time_call(lambda: _legacy_cupping_summary(cuppings), max(1, repeat // 2))
+        
+        results.append({
+            'cuppings': count,
+            'build_ms': build['median_ms'],
+            'summary_ms': vectorized['median_ms'],
+            'legacy_ms': legacy['median_ms'],
+            'column_kib': round((history.created_at.nbytes + history.origin_codes.nbytes + history.roaster_codes.nbytes
+                                 + sum(column.nbytes for column in history.scores.values())) / 1024, 1)
+        })
+    
+    return results
+
+
+# Word pools for synthetic cuppings; accents and mixed case exercise the token normalization
+SEARCH_ORIGINS = ['Ethiopia', 'Colombia', 'Guatemala', 'Kenya', 'Brazil', 'Costa Rica', 'Panamá', 'Perú',
+                  'Honduras', 'Rwanda', 'Burundi', 'Yemen', 'Sumatra', 'El Salvador', 'Nicaragua', 'México']
+SEARCH_REGIONS = ['Yirgacheffe', 'Sidamo', 'Guji', 'Huila', 'Nariño', 'Huehuetenango', 'Antigua', 'Nyeri', 'Kirinyaga',
+                  'Cerrado', 'Tarrazú', 'Boquete', 'Cajamarca', 'Marcala', 'Gakenke', 'Kayanza', 'Chiapas', 'Oaxaca']
+SEARCH_PROCESSES = ['Washed', 'Natural', 'Honey', 'Anaerobic', 'Carbonic Maceration', 'Wet Hulled']
+SEARCH_VARIETIES = ['Gesha', 'Bourbon', 'Typica', 'Caturra', 'SL28', 'SL34', 'Pacamara', 'Heirloom', 'Catuaí', 'Pink Bourbon']
+
+
+def bench_cupping_search(cupping_counts: List[int], repeat: int, users: int = 5000, roasters: int = 2000) -> List[Dict]:
+    """Token index build time, memory and query latency for multi-field keyword searches"""
+    rng = random.Random(42)
+    user_ids = [f"user-{i}" for i in range(users)]
+    roaster_names = [f"{rng.choice(['Blue', 'Red', 'Little', 'North', 'Café', 'Old'])} "
+                     f"{rng.choice(['Bottle', 'Fox', 'Mill', 'Hill', 'Harbor', 'Lantern'])} Roasters {i}" for i in range(roasters)]
+    queries = {
+        'common_word': {'text': 'washed'},
+        'two_words': {'text': 'ethiopia gesha'},
+        'accented': {'text': 'NARINO caturra'},
+        'prefix': {'text': 'huehue'},
+        'fields': {'fields': {'origin': 'kenya', 'roaster': 'fox'}},
+        'rare_word': {'text': 'roasters 1234'},
+        'own_cuppings': {'text': 'natural', 'user_id': 'user-7'}
+    }
+    results = []
+    
+    for count in cupping_counts:
+        start_time = datetime.now() - timedelta(minutes=count)
+        cuppings = [{
+            'cupping_id': f"cupping-{i}",
+            'user_id': rng.choice(user_ids),
+            'is_public': rng.random() < 0.5,
+            'coffee_name': f"{rng.choice(SEARCH_REGIONS)} {rng.choice(SEARCH_VARIETIES)} {rng.choice(SEARCH_PROCESSES)}",
+            'origin': rng.choice(SEARCH_ORIGINS),
+            'roaster': rng.choice(roaster_names),
+            'created_at': start_time + timedelta(minutes=i),
+            'updated_at': start_time + timedelta(minutes=i)
+        } for i in range(count)]
+        
+        index = CuppingSearchIndex(refresh_seconds=float('inf'))
+        start = time.perf_counter()
+        index.load(cuppings)
+        build_s = time.perf_counter() - start
+        
+        row = {'cuppings': count, 'build_s': round(build_s, 2), 'memory_mib': round(index.memory_bytes() / 2**20, 1)}
+        for name, query in queries.items():
+            row[f"{name}_ms"] = _time_call(lambda: index.search(**query), repeat)['median_ms']
+        row['matches_common'] = len(index.search('washed', limit=count))
+        results.append(row)
+    
+    return results
+
+
+def bench_cupping_similarity(cupping_counts: List[int], k: int, repeat: int) -> List[Dict]:
+    """Similarity matrix build time, memory, k-NN query latency and incremental insert cost"""
+    rng = random.Random(42)
+    notes = ['chocolate', 'citrus', 'floral', 'berry', 'caramel', 'nutty', 'stone fruit', 'jasmine', 'wine', 'spice']
+    results = []
+    
+    def synthetic(i):
+        return {
+            'cupping_id': f"cupping-{i}",
+            'user_id': f"user-{i % 5000}",
+            'is_public': True,
+            **{attribute: rng.randint(5, 10) for attribute in ('aroma', 'flavor', 'acidity', 'body')},
+            'overall_score': rng.randint(70, 95),
+            'flavor_notes': ', '.join(rng.sample(notes, rng.randint(0, 3)))
+        }
+    
+    for count in cupping_counts:
+        cuppings = [synthetic(i) for i in range(count)]
+        index = CuppingSimilarityIndex(refresh_seconds=float('inf'))
+        start = time.perf_counter()
+        index.load(cuppings)
+        build_s = time.perf_counter() - start
+        
+        memory_bytes = index.memory_bytes()
+        
+        probes = [synthetic(count + i) for i in range(repeat)]
+        probe = iter(probes * 2)
+        query = _time_call(lambda: index.similar(next(probe), k), repeat)
+        filtered = _time_call(lambda: index.similar(next(probe), k, exclude_user_id='user-7'), repeat)
+        
+        # Enough inserts that the occasional capacity doubling is amortized as in production
+        inserts = [synthetic(count + repeat + i) for i in range(max(1000, count // 10))]
+        start = time.perf_counter()
+        for cupping in inserts:
+            index.add(cupping)
+        add_us = (time.perf_counter() - start) / len(inserts) * 1e6
+        
+        results.append({
+            'cuppings': count,
+            'build_s': round(build_s, 2),
+            'memory_mib': round(memory_bytes / 2**20, 1),
+            'knn_median_ms': query['median_ms'],
+            'knn_p95_ms': query['p95_ms'],
+            'knn_excluding_user_ms': filtered['median_ms'],
+            'add_us': round(add_us, 1)
+        })
+    
+    return results
+
+
+def bench_recommendations(user_counts: List[int], ratings_per_user: int, coffees: int, tastes: int = 20) -> List[Dict]:
+    """Full ALS training, top-N generation and incremental fold-in cost vs user count"""
+    results = []
+    
+    for count in user_counts:
+        rng = np.random.default_rng(42)
+        # Users share one of a few tastes: they mostly like their taste's coffees and dislike the rest
+        taste_of_coffee = rng.integers(0, tastes, coffees)
+        events = []
+        for user in range(count):
+            taste = user % tastes
+            for coffee in rng.choice(coffees, ratings_per_user, replace=False).tolist():
+                liked = taste_of_coffee[coffee] == taste
+                rating = float(np.clip(rng.normal(0.85 if liked else 0.3, 0.1), 0, 1))
+                events.append((f"user-{user}", f"beans:coffee {coffee}|", f"Coffee {coffee}", '', 'beans', rating, True))
+        
+        model = RecommendationModel(DEFAULT_FACTORS)
+        users, items, ratings = model.observations(events)
+        start = time.perf_counter()
+        model.fit(users, items, ratings, DEFAULT_ITERATIONS)
+        fit_s = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        recommendations = model.recommend(users, items, DEFAULT_TOP_N)
+        recommend_s = time.perf_counter() - start
+        
+        # Share of recommended coffees that match the user's taste
+        hits = [taste_of_coffee[int(item['name'].split()[-1])] == int(user_id.split('-')[-1]) % tastes
+                for user_id, items in recommendations.items() for item in items]
+        
+        # An incremental run: 1% of users add a few ratings and are folded in
+        changed = np.unique(users)[:max(1, count // 100)]
+        mask = np.isin(users, changed)
+        start = time.perf_counter()
+        model.fold_in(users[mask], items[mask], ratings[mask])
+        model.recommend(users[mask], items[mask], DEFAULT_TOP_N)
+        fold_in_ms = (time.perf_counter() - start) * 1000
+        
+        results.append({
+            'users': count,
+            'coffees': len(model.item_keys),
+            'ratings': len(ratings),
+            'fit_s': round(fit_s, 2),
+            'top_n_s': round(recommend_s, 2),
+            'precision': round(sum(hits) / max(1, len(hits)), 3),
+            'fold_in_users': len(changed),
+            'fold_in_ms': round(fold_in_ms, 1),
+            'model_mib': round((model.item_factors.nbytes + model.user_factors.nbytes) / 2**20, 1)
+        })
+    
+    return results
+
+
+def bench_startup(backend: str, runs: int) -> List[Dict]:
+    """Cold-start the app to the login page and check Firestore was not touched"""
+    env = dict(os.environ, FIRESTORE_BACKEND=backend)
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    
+    for run in range(runs):
+        completed = subprocess.run(
+            [sys.executable, '-c', _STARTUP_PROBE],
+            cwd=repo_dir, env=env, capture_output=True, text=True, check=True
+        )
+        # The probe prints its result as the last stdout line
+        row = json.loads(completed.stdout.strip().splitlines()[-1])
+        results.append({'run': run + 1, **row})
+    
+    return results
+
+
+def _print_table(rows: List[Dict]):
+    """Print benchmark rows as an aligned table"""
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.rjust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row[c]).rjust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coffee Cupping App performance benchmarks")
+    parser.add_argument('--backend', default=MEMORY_BACKEND, help="Database backend to benchmark against")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    invitations_parser = subparsers.add_parser('user-invitations', help="Invitee lookup latency vs collection size")
+    invitations_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    invitations_parser.add_argument('--repeat', type=int, default=20)
+    
+    startup_parser = subparsers.add_parser('startup', help="Cold start to login page without touching Firestore")
+    startup_parser.add_argument('--runs', type=int, default=5)
+    
+    concurrency_parser = subparsers.add_parser('concurrent-evaluations', help="Parallel responses/evaluations on one invitation")
+    concurrency_parser.add_argument('--participants', type=int, nargs='+', default=[5, 20, 50])
+    
+    fanout_parser = subparsers.add_parser('invitation-fanout', help="Invitation creation latency vs invitee count")
+    fanout_parser.add_argument('--invitees', type=int, nargs='+', default=[1, 5, 15, 50, 300])
+    fanout_parser.add_argument('--repeat', type=int, default=5)
+    
+    logins_parser = subparsers.add_parser('logins', help="Login throughput and p99 latency under concurrency")
+    logins_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    logins_parser.add_argument('--logins', type=int, default=64)
+    logins_parser.add_argument('--rounds', type=int, default=12)
+    
+    filter_parser = subparsers.add_parser('identity-filter', help="Registration Bloom filter memory and false-positive rate")
+    filter_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    filter_parser.add_argument('--fp-rate', type=float, default=0.01)
+    filter_parser.add_argument('--probes', type=int, default=100000)
+    
+    analytics_parser = subparsers.add_parser('cupping-analytics', help="Vectorized cupping analytics vs list-based statistics")
+    analytics_parser.add_argument('--cuppings', type=int, nargs='+', default=[1000, 10000, 100000])
+    analytics_parser.add_argument('--repeat', type=int, default=5)
+    
+    search_parser = subparsers.add_parser('cupping-search', help="Cupping token index build, memory and query latency")
+    search_parser.add_argument('--cuppings', type=int, nargs='+', default=[10000, 100000, 1000000])
+    search_parser.add_argument('--repeat', type=int, default=50)
+    
+    similarity_parser = subparsers.add_parser('cupping-similarity', help="Similar-coffee k-NN build, memory and query latency")
+    similarity_parser.add_argument('--cuppings', type=int, nargs='+', default=[10000, 100000, 500000])
+    similarity_parser.add_argument('--k', type=int, default=10)
+    similarity_parser.add_argument('--repeat', type=int, default=50)
+    
+    recommendations_parser = subparsers.add_parser('recommendations', help="Recommender training, top-N and fold-in cost")
+    recommendations_parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000, 100000])
+    recommendations_parser.add_argument('--ratings-per-user', type=int, default=20)
+    recommendations_parser.add_argument('--coffees', type=int, default=5000)
+    
+    args = parser.parse_args()
+    
+    if args.command == 'startup':
+        _print_table(bench_startup(args.backend, args.runs))
+        return
+    
+    if args.command == 'identity-filter':
+        _print_table(bench_identity_filter(args.sizes, args.fp_rate, args.probes))
+        return
+    
+    if args.command == 'cupping-analytics':
+        _print_table(bench_cupping_analytics(args.cuppings, args.repeat))
+        return
+    
+    if args.command == 'cupping-search':
+        _print_table(bench_cupping_search(args.cuppings, args.repeat))
+        return
+    
+    if args.command == 'cupping-similarity':
+        _print_table(bench_cupping_similarity(args.cuppings, args.k, args.repeat))
+        return
+    
+    if args.command == 'recommendations':
+        _print_table(bench_recommendations(args.users, args.ratings_per_user, args.coffees))
+        return
+    
+    firebase_manager.use_backend(args.backend)
+    db = get_firestore_db()
+    if not db:
+        raise SystemExit("❌ Database connection not available")
+    
+    if args.command == 'user-invitations':
+        _print_table(bench_user_invitations(db, args.sizes, args.repeat))
+    
+    elif args.command == 'invitation-fanout':
+        _print_table(bench_invitation_fanout(db, args.invitees, args.repeat))
+    
+    elif args.command == 'logins':
+        _print_table(bench_logins(db, args.concurrency, args.logins, args.rounds))
+    
+    elif args.command == 'concurrent-evaluations':
+        rows = bench_concurrent_evaluations(db, args.participants)
+        _print_table(rows)
+        if any(row['lost_updates'] for row in rows):
+            raise SystemExit("❌ Concurrent updates were lost")
+
+
+if __name__ == "__main__":
+    main()
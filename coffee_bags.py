@@ -2,17 +2,28 @@
 Coffee Bags tracking CRUD operations for Firestore
 """
 import streamlit as st
-from typing import Dict, List, Optional
-from firebase import get_firestore_db
+from typing import Dict, List, Optional, Tuple
+from firebase import get_firestore_db, run_in_transaction, FirebaseManager
+from user_summaries import get_user_summary_manager
+from quotas import get_quota_manager
 from datetime import datetime, date
 import uuid
 
 
+# Fields returned by list queries; 'card' covers the collapsed list view, None loads whole documents
+COFFEE_BAG_PROJECTIONS = {
+    'card': ['bagId', 'coffeeName', 'rating', 'createdAt'],
+    'full': None
+}
+
+
 class CoffeeBagManager:
     """Manage coffee bag tracking operations in Firestore"""
     
-    def __init__(self):
-        self.db = get_firestore_db()
+    @property
+    def db(self):
+        """Firestore client, resolved on first use"""
+        return get_firestore_db()
     
     def create_coffee_bag(self, bag_data: Dict, user_id: str, user_name: str) -> Optional[str]:
         """Create a new coffee bag record"""
@@ -21,6 +32,12 @@ class CoffeeBagManager:
                 st.error("❌ Database connection not available")
                 return None
             
+            # Refuse before any write once this user has used up their quota
+            quota = get_quota_manager().check(user_id, 'create_coffee_bag')
+            if not quota['allowed']:
+                st.warning(f"⏳ {quota['message']}")
+                return None
+            
             bag_id = str(uuid.uuid4())
             
             # Prepare coffee bag data with metadata
@@ -33,8 +50,11 @@ class CoffeeBagManager:
                 **bag_data  # Merge with provided data
             }
             
-            # Store in Firestore
-            self.db.collection('coffeeBags').document(bag_id).set(bag_record)
+            # Store the record and its owner's summary delta in one atomic batch
+            batch = self.db.batch()
+            batch.set(self.db.collection('coffeeBags').document(bag_id), bag_record)
+            get_user_summary_manager().apply_change(batch, 'coffeeBags', None, bag_record)
+            batch.commit()
             return bag_id
             
         except Exception as e:
@@ -67,9 +87,17 @@ class CoffeeBagManager:
             # Add updated timestamp
             update_data['updatedAt'] = datetime.now()
             
-            # Use merge=True to preserve other fields
             bag_ref = self.db.collection('coffeeBags').document(bag_id)
-            bag_ref.set(update_data, merge=True)
+            
+            def update_with_summary(transaction):
+                snapshot = bag_ref.get(transaction=transaction)
+                before = snapshot.to_dict() if snapshot.exists else None
+                
+                # Use merge=True to preserve other fields
+                transaction.set(bag_ref, update_data, merge=True)
+                get_user_summary_manager().apply_change(transaction, 'coffeeBags', before, {**(before or {}), **update_data})
+            
+            run_in_transaction(update_with_summary)
             return True
             
         except Exception as e:
@@ -83,14 +111,23 @@ class CoffeeBagManager:
                 return False
             
             bag_ref = self.db.collection('coffeeBags').document(bag_id)
-            bag_ref.delete()
+            
+            def delete_with_summary(transaction):
+                snapshot = bag_ref.get(transaction=transaction)
+                if not snapshot.exists:
+                    return
+                
+                transaction.delete(bag_ref)
+                get_user_summary_manager().apply_change(transaction, 'coffeeBags', snapshot.to_dict(), None)
+            
+            run_in_transaction(delete_with_summary)
             return True
             
         except Exception as e:
             st.error(f"Error deleting coffee bag: {e}")
             return False
     
-    def get_user_coffee_bags(self, user_id: str, limit: int = 50) -> List[Dict]:
+    def get_user_coffee_bags(self, user_id: str, limit: int = 50, projection: str = 'full') -> List[Dict]:
         """Get all coffee bags for a specific user"""
         try:
             if not self.db:
@@ -100,6 +137,7 @@ class CoffeeBagManager:
             bags_ref = self.db.collection('coffeeBags')
             query = bags_ref.where('trackedBy', '==', user_id).limit(limit)
             
+            query = FirebaseManager.apply_projection(query, COFFEE_BAG_PROJECTIONS[projection])
             docs = query.stream()
             bags = []
             
@@ -116,7 +154,20 @@ class CoffeeBagManager:
             st.error(f"Error getting user coffee bags: {e}")
             return []
     
-    def get_public_coffee_bags(self, limit: int = 20) -> List[Dict]:
+    def get_user_coffee_bags_page(self, user_id: str, page_size: int = 3, page_token: Optional[str] = None, projection: str = 'full') -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a user's coffee bags, newest first, plus the token for the next page"""
+        try:
+            if not self.db:
+                return [], None
+            
+            query = self.db.collection('coffeeBags').where('trackedBy', '==', user_id)
+            return FirebaseManager.get_page(query, 'createdAt', page_size, page_token, COFFEE_BAG_PROJECTIONS[projection])
+            
+        except Exception as e:
+            st.error(f"Error getting coffee bags: {e}")
+            return [], None
+    
+    def get_public_coffee_bags(self, limit: int = 20, projection: str = 'full') -> List[Dict]:
         """Get public coffee bags from all users"""
         try:
             if not self.db:
@@ -126,6 +177,7 @@ class CoffeeBagManager:
             bags_ref = self.db.collection('coffeeBags')
             query = bags_ref.where('isPublic', '==', True).limit(limit)
             
+            query = FirebaseManager.apply_projection(query, COFFEE_BAG_PROJECTIONS[projection])
             docs = query.stream()
             bags = []
             
@@ -142,7 +194,7 @@ class CoffeeBagManager:
             st.error(f"Error getting public coffee bags: {e}")
             return []
     
-    def search_coffee_bags_by_name(self, coffee_name: str, limit: int = 20) -> List[Dict]:
+    def search_coffee_bags_by_name(self, coffee_name: str, limit: int = 20, projection: str = 'full') -> List[Dict]:
         """Search coffee bags by coffee name"""
         try:
             if not self.db:
@@ -155,6 +207,7 @@ class CoffeeBagManager:
                     .where('isPublic', '==', True)
                     .limit(limit))
             
+            query = FirebaseManager.apply_projection(query, COFFEE_BAG_PROJECTIONS[projection])
             docs = query.stream()
             bags = []
             
@@ -171,9 +224,7 @@ class CoffeeBagManager:
     def get_coffee_stats(self, coffee_name: str) -> Dict:
         """Get statistics for a specific coffee"""
         try:
-            bags = self.search_coffee_bags_by_name(coffee_name, limit=1000)
-            
-            if not bags:
+            if not self.db:
                 return {
                     'total_bags': 0,
                     'average_rating': 0,
@@ -181,19 +232,35 @@ class CoffeeBagManager:
                     'recommendation_rate': 0
                 }
             
-            total_bags = len(bags)
-            ratings = [b.get('rating', 0) for b in bags if b.get('rating')]
-            costs = [b.get('cost', 0) for b in bags if b.get('cost')]
-            recommendations = [b for b in bags if b.get('wouldRecommend', False)]
+            bags_ref = self.db.collection('coffeeBags')
+            query = (bags_ref
+                    .where('coffeeName', '>=', coffee_name)
+                    .where('coffeeName', '<=', coffee_name + '\uf8ff')
+                    .where('isPublic', '==', True))
+            totals = FirebaseManager.aggregate(query, [
+                ('count', None, 'total_bags'),
+                ('avg', 'rating', 'average_rating'),
+                ('avg', 'cost', 'average_cost')
+            ])
+            total_bags = totals['total_bags']
+            
+            if not total_bags:
+                return {
+                    'total_bags': 0,
+                    'average_rating': 0,
+                    'average_cost': 0,
+                    'recommendation_rate': 0
+                }
             
-            avg_rating = sum(ratings) / len(ratings) if ratings else 0
-            avg_cost = sum(costs) / len(costs) if costs else 0
-            recommendation_rate = (len(recommendations) / total_bags * 100) if total_bags > 0 else 0
+            recommendations = FirebaseManager.aggregate(
+                query.where('wouldRecommend', '==', True), [('count', None, 'recommendations')]
+            )['recommendations']
+            recommendation_rate = recommendations / total_bags * 100
             
             return {
                 'total_bags': total_bags,
-                'average_rating': round(avg_rating, 1),
-                'average_cost': round(avg_cost, 2),
+                'average_rating': round(totals['average_rating'], 1),
+                'average_cost': round(totals['average_cost'], 2),
                 'recommendation_rate': round(recommendation_rate, 1)
             }
             
@@ -209,9 +276,7 @@ class CoffeeBagManager:
     def get_user_bag_stats(self, user_id: str) -> Dict:
         """Get coffee bag statistics for a user"""
         try:
-            bags = self.get_user_coffee_bags(user_id, limit=1000)
-            
-            if not bags:
+            if not self.db:
                 return {
                     'total_bags': 0,
                     'average_rating': 0,
@@ -220,25 +285,36 @@ class CoffeeBagManager:
                     'repurchase_rate': 0
                 }
             
-            total_bags = len(bags)
-            ratings = [b.get('rating', 0) for b in bags if b.get('rating')]
-            costs = [b.get('cost', 0) for b in bags if b.get('cost')]
+            query = self.db.collection('coffeeBags').where('trackedBy', '==', user_id)
+            totals = FirebaseManager.aggregate(query, [
+                ('count', None, 'total_bags'),
+                ('avg', 'rating', 'average_rating'),
+                ('sum', 'cost', 'total_spent')
+            ])
+            total_bags = totals['total_bags']
             
-            avg_rating = sum(ratings) / len(ratings) if ratings else 0
-            total_spent = sum(costs) if costs else 0
-            
-            # Most common origin
-            origins = [b.get('origin') for b in bags if b.get('origin')]
-            favorite_origin = max(set(origins), key=origins.count) if origins else 'N/A'
+            if not total_bags:
+                return {
+                    'total_bags': 0,
+                    'average_rating': 0,
+                    'total_spent': 0,
+                    'favorite_origin': 'N/A',
+                    'repurchase_rate': 0
+                }
             
             # Repurchase rate
-            repurchases = [b for b in bags if b.get('wouldBuyAgain', False)]
-            repurchase_rate = (len(repurchases) / total_bags * 100) if total_bags > 0 else 0
+            repurchases = FirebaseManager.aggregate(
+                query.where('wouldBuyAgain', '==', True), [('count', None, 'repurchases')]
+            )['repurchases']
+            repurchase_rate = repurchases / total_bags * 100
+            
+            # Most common origin, from the histogram the user's summary document already keeps
+            favorite_origin = get_user_summary_manager().get_dashboard_stats(user_id)['bag_stats']['favorite_origin']
             
             return {
                 'total_bags': total_bags,
-                'average_rating': round(avg_rating, 1),
-                'total_spent': round(total_spent, 2),
+                'average_rating': round(totals['average_rating'], 1),
+                'total_spent': round(totals['total_spent'], 2),
                 'favorite_origin': favorite_origin,
                 'repurchase_rate': round(repurchase_rate, 1)
             }
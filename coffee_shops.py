@@ -2,17 +2,28 @@
 Coffee Shop Reviews CRUD operations for Firestore
 """
 import streamlit as st
-from typing import Dict, List, Optional
-from firebase import get_firestore_db
+from typing import Dict, List, Optional, Tuple
+from firebase import get_firestore_db, run_in_transaction, FirebaseManager
+from user_summaries import get_user_summary_manager
+from quotas import get_quota_manager
 from datetime import datetime
 import uuid
 
 
+# Fields returned by list queries; 'card' covers the collapsed list view, None loads whole documents
+REVIEW_PROJECTIONS = {
+    'card': ['reviewId', 'shopName', 'coffeeRating', 'createdAt'],
+    'full': None
+}
+
+
 class CoffeeShopReviewManager:
     """Manage coffee shop review operations in Firestore"""
     
-    def __init__(self):
-        self.db = get_firestore_db()
+    @property
+    def db(self):
+        """Firestore client, resolved on first use"""
+        return get_firestore_db()
     
     def create_review(self, review_data: Dict, user_id: str, reviewer_name: str) -> Optional[str]:
         """Create a new coffee shop review"""
@@ -21,6 +32,12 @@ class CoffeeShopReviewManager:
                 st.error("❌ Database connection not available")
                 return None
             
+            # Refuse before any write once this user has used up their quota
+            quota = get_quota_manager().check(user_id, 'create_review')
+            if not quota['allowed']:
+                st.warning(f"⏳ {quota['message']}")
+                return None
+            
             review_id = str(uuid.uuid4())
             
             # Prepare review data with metadata
@@ -33,8 +50,11 @@ class CoffeeShopReviewManager:
                 **review_data  # Merge with provided data
             }
             
-            # Store in Firestore
-            self.db.collection('coffeeShopsReviews').document(review_id).set(review_record)
+            # Store the record and its owner's summary delta in one atomic batch
+            batch = self.db.batch()
+            batch.set(self.db.collection('coffeeShopsReviews').document(review_id), review_record)
+            get_user_summary_manager().apply_change(batch, 'coffeeShopsReviews', None, review_record)
+            batch.commit()
             return review_id
             
         except Exception as e:
@@ -67,9 +87,17 @@ class CoffeeShopReviewManager:
             # Add updated timestamp
             update_data['updatedAt'] = datetime.now()
             
-            # Use merge=True to preserve other fields
             review_ref = self.db.collection('coffeeShopsReviews').document(review_id)
-            review_ref.set(update_data, merge=True)
+            
+            def update_with_summary(transaction):
+                snapshot = review_ref.get(transaction=transaction)
+                before = snapshot.to_dict() if snapshot.exists else None
+                
+                # Use merge=True to preserve other fields
+                transaction.set(review_ref, update_data, merge=True)
+                get_user_summary_manager().apply_change(transaction, 'coffeeShopsReviews', before, {**(before or {}), **update_data})
+            
+            run_in_transaction(update_with_summary)
             return True
             
         except Exception as e:
@@ -83,14 +111,23 @@ class CoffeeShopReviewManager:
                 return False
             
             review_ref = self.db.collection('coffeeShopsReviews').document(review_id)
-            review_ref.delete()
+            
+            def delete_with_summary(transaction):
+                snapshot = review_ref.get(transaction=transaction)
+                if not snapshot.exists:
+                    return
+                
+                transaction.delete(review_ref)
+                get_user_summary_manager().apply_change(transaction, 'coffeeShopsReviews', snapshot.to_dict(), None)
+            
+            run_in_transaction(delete_with_summary)
             return True
             
         except Exception as e:
             st.error(f"Error deleting review: {e}")
             return False
     
-    def get_user_reviews(self, user_id: str, limit: int = 50) -> List[Dict]:
+    def get_user_reviews(self, user_id: str, limit: int = 50, projection: str = 'full') -> List[Dict]:
         """Get all reviews for a specific user"""
         try:
             if not self.db:
@@ -100,6 +137,7 @@ class CoffeeShopReviewManager:
             reviews_ref = self.db.collection('coffeeShopsReviews')
             query = reviews_ref.where('reviewedBy', '==', user_id).limit(limit)
             
+            query = FirebaseManager.apply_projection(query, REVIEW_PROJECTIONS[projection])
             docs = query.stream()
             reviews = []
             
@@ -116,7 +154,20 @@ class CoffeeShopReviewManager:
             st.error(f"Error getting user reviews: {e}")
             return []
     
-    def get_public_reviews(self, limit: int = 20) -> List[Dict]:
+    def get_user_reviews_page(self, user_id: str, page_size: int = 3, page_token: Optional[str] = None, projection: str = 'full') -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a user's reviews, newest first, plus the token for the next page"""
+        try:
+            if not self.db:
+                return [], None
+            
+            query = self.db.collection('coffeeShopsReviews').where('reviewedBy', '==', user_id)
+            return FirebaseManager.get_page(query, 'createdAt', page_size, page_token, REVIEW_PROJECTIONS[projection])
+            
+        except Exception as e:
+            st.error(f"Error getting reviews: {e}")
+            return [], None
+    
+    def get_public_reviews(self, limit: int = 20, projection: str = 'full') -> List[Dict]:
         """Get public reviews from all users"""
         try:
             if not self.db:
@@ -126,6 +177,7 @@ class CoffeeShopReviewManager:
             reviews_ref = self.db.collection('coffeeShopsReviews')
             query = reviews_ref.where('isPublic', '==', True).limit(limit)
             
+            query = FirebaseManager.apply_projection(query, REVIEW_PROJECTIONS[projection])
             docs = query.stream()
             reviews = []
             
@@ -142,7 +194,7 @@ class CoffeeShopReviewManager:
             st.error(f"Error getting public reviews: {e}")
             return []
     
-    def search_reviews_by_shop(self, shop_name: str, limit: int = 20) -> List[Dict]:
+    def search_reviews_by_shop(self, shop_name: str, limit: int = 20, projection: str = 'full') -> List[Dict]:
         """Search reviews by coffee shop name"""
         try:
             if not self.db:
@@ -157,6 +209,7 @@ class CoffeeShopReviewManager:
                     .order_by('createdAt', direction='DESCENDING')
                     .limit(limit))
             
+            query = FirebaseManager.apply_projection(query, REVIEW_PROJECTIONS[projection])
             docs = query.stream()
             reviews = []
             
@@ -173,9 +226,7 @@ class CoffeeShopReviewManager:
     def get_shop_stats(self, shop_name: str) -> Dict:
         """Get statistics for a specific coffee shop"""
         try:
-            reviews = self.search_reviews_by_shop(shop_name, limit=1000)
-            
-            if not reviews:
+            if not self.db:
                 return {
                     'total_reviews': 0,
                     'average_coffee_rating': 0,
@@ -183,22 +234,34 @@ class CoffeeShopReviewManager:
                     'most_common_preparation': 'N/A'
                 }
             
-            total_reviews = len(reviews)
-            coffee_ratings = [r.get('coffeeRating', 0) for r in reviews if r.get('coffeeRating')]
-            latte_art_ratings = [r.get('latteArtRating', 0) for r in reviews if r.get('latteArtRating')]
-            
-            avg_coffee = sum(coffee_ratings) / len(coffee_ratings) if coffee_ratings else 0
-            avg_latte_art = sum(latte_art_ratings) / len(latte_art_ratings) if latte_art_ratings else 0
+            reviews_ref = self.db.collection('coffeeShopsReviews')
+            query = (reviews_ref
+                    .where('shopName', '>=', shop_name)
+                    .where('shopName', '<=', shop_name + '\uf8ff')
+                    .where('isPublic', '==', True))
+            totals = FirebaseManager.aggregate(query, [
+                ('count', None, 'total_reviews'),
+                ('avg', 'coffeeRating', 'average_coffee_rating'),
+                ('avg', 'latteArtRating', 'average_latte_art_rating')
+            ])
+            
+            if not totals['total_reviews']:
+                return {
+                    'total_reviews': 0,
+                    'average_coffee_rating': 0,
+                    'average_latte_art_rating': 0,
+                    'most_common_preparation': 'N/A'
+                }
             
-            # Most common preparation method
-            preparations = [r.get('preparationMethod') for r in reviews if r.get('preparationMethod')]
-            most_common_prep = max(set(preparations), key=preparations.count) if preparations else 'N/A'
+            # Most common preparation method; shops have no summary document, so this streams
+            # the matching reviews' preparationMethod field alone (O(N) reads)
+            counts = FirebaseManager.value_counts(query, ['preparationMethod'])
             
             return {
-                'total_reviews': total_reviews,
-                'average_coffee_rating': round(avg_coffee, 1),
-                'average_latte_art_rating': round(avg_latte_art, 1),
-                'most_common_preparation': most_common_prep
+                'total_reviews': totals['total_reviews'],
+                'average_coffee_rating': round(totals['average_coffee_rating'], 1),
+                'average_latte_art_rating': round(totals['average_latte_art_rating'], 1),
+                'most_common_preparation': FirebaseManager.most_common(counts['preparationMethod'])
             }
             
         except Exception as e:
@@ -213,9 +276,7 @@ class CoffeeShopReviewManager:
     def get_user_review_stats(self, user_id: str) -> Dict:
         """Get review statistics for a user"""
         try:
-            reviews = self.get_user_reviews(user_id, limit=1000)
-            
-            if not reviews:
+            if not self.db:
                 return {
                     'total_reviews': 0,
                     'average_coffee_rating': 0,
@@ -223,23 +284,29 @@ class CoffeeShopReviewManager:
                     'shops_reviewed': 0
                 }
             
-            total_reviews = len(reviews)
-            coffee_ratings = [r.get('coffeeRating', 0) for r in reviews if r.get('coffeeRating')]
-            avg_coffee = sum(coffee_ratings) / len(coffee_ratings) if coffee_ratings else 0
+            query = self.db.collection('coffeeShopsReviews').where('reviewedBy', '==', user_id)
+            totals = FirebaseManager.aggregate(query, [
+                ('count', None, 'total_reviews'),
+                ('avg', 'coffeeRating', 'average_coffee_rating')
+            ])
             
-            # Most used preparation method
-            preparations = [r.get('preparationMethod') for r in reviews if r.get('preparationMethod')]
-            favorite_prep = max(set(preparations), key=preparations.count) if preparations else 'N/A'
+            if not totals['total_reviews']:
+                return {
+                    'total_reviews': 0,
+                    'average_coffee_rating': 0,
+                    'favorite_preparation': 'N/A',
+                    'shops_reviewed': 0
+                }
             
-            # Unique shops reviewed
-            shops = set([r.get('shopName') for r in reviews if r.get('shopName')])
-            shops_reviewed = len(shops)
+            # Most used preparation method and unique shops reviewed, from the histograms
+            # the user's summary document already keeps, instead of streaming every review
+            summary_stats = get_user_summary_manager().get_dashboard_stats(user_id)['review_stats']
             
             return {
-                'total_reviews': total_reviews,
-                'average_coffee_rating': round(avg_coffee, 1),
-                'favorite_preparation': favorite_prep,
-                'shops_reviewed': shops_reviewed
+                'total_reviews': totals['total_reviews'],
+                'average_coffee_rating': round(totals['average_coffee_rating'], 1),
+                'favorite_preparation': summary_stats['favorite_preparation'],
+                'shops_reviewed': summary_stats['shops_reviewed']
             }
             
         except Exception as e:
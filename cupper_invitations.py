@@ -2,8 +2,11 @@
 Cupper Invitation and Collaborative Cupping System
 """
 import streamlit as st
-from typing import Dict, List, Optional
-from firebase import get_firestore_db
+from typing import Dict, List, Optional, Tuple
+from firebase import get_firestore_db, FirebaseManager, FIRESTORE_BATCH_LIMIT, FIRESTORE_IN_QUERY_LIMIT
+from user_summaries import get_user_summary_manager
+from quotas import get_quota_manager
+from write_behind import get_write_behind_queue
 from datetime import datetime, timedelta
 import uuid
 
@@ -11,8 +14,10 @@ import uuid
 class CupperInvitationManager:
     """Manage cupper invitations and collaborative cupping sessions"""
     
-    def __init__(self):
-        self.db = get_firestore_db()
+    @property
+    def db(self):
+        """Firestore client, resolved on first use"""
+        return get_firestore_db()
     
     def create_invitation(self, session_data: Dict, inviter_id: str, inviter_name: str, invitee_usernames: List[str]) -> Optional[str]:
         """Create a cupping session invitation using registered usernames"""
@@ -21,21 +26,21 @@ class CupperInvitationManager:
                 st.error("❌ Database connection not available")
                 return None
             
+            # Refuse before any write once this user has used up their quota
+            quota = get_quota_manager().check(inviter_id, 'create_invitation')
+            if not quota['allowed']:
+                st.warning(f"⏳ {quota['message']}")
+                return None
+            
             invitation_id = str(uuid.uuid4())
             
             # Convert usernames to user IDs and validate they exist
+            requested_usernames = list(dict.fromkeys(u.strip() for u in invitee_usernames if u.strip()))
+            users_by_username = self._get_users_by_username(requested_usernames)
             invitee_user_data = []
-            for username in invitee_usernames:
-                user_ref = self.db.collection('users').where('username', '==', username.strip()).limit(1)
-                user_docs = list(user_ref.stream())
-                
-                if user_docs:
-                    user_data = user_docs[0].to_dict()
-                    invitee_user_data.append({
-                        'userId': user_docs[0].id,
-                        'username': user_data.get('username'),
-                        'email': user_data.get('email')
-                    })
+            for username in requested_usernames:
+                if username in users_by_username:
+                    invitee_user_data.append(users_by_username[username])
                 else:
                     st.warning(f"⚠️ Username '{username}' not found in the app")
             
@@ -49,6 +54,7 @@ class CupperInvitationManager:
                 'inviterId': inviter_id,
                 'inviterName': inviter_name,
                 'inviteeUsers': invitee_user_data,  # Store user data instead of just emails
+                'inviteeIds': [user_data['userId'] for user_data in invitee_user_data],  # Denormalized for array_contains lookups
                 'sessionData': session_data,
                 'status': 'pending',  # pending, accepted, declined, completed
                 'createdAt': datetime.now(),
@@ -57,12 +63,25 @@ class CupperInvitationManager:
                 'participantEvaluations': {}  # Will store cupping evaluations from each participant
             }
             
-            # Store in Firestore
-            self.db.collection('cuppingInvitations').document(invitation_id).set(invitation_record)
+            # Store the invitation, each invitee's pending entry and notification in as few
+            # batches as the Firestore write limit allows
+            batch = self.db.batch()
+            batch.set(self.db.collection('cuppingInvitations').document(invitation_id), invitation_record)
+            pending_writes = 1
+            summary_manager = get_user_summary_manager()
             
-            # Create notifications for each invitee
             for user_data in invitee_user_data:
-                self._create_notification_for_user(invitation_id, user_data, inviter_name, session_data)
+                if pending_writes + 2 > FIRESTORE_BATCH_LIMIT:
+                    batch.commit()
+                    batch = self.db.batch()
+                    pending_writes = 0
+                
+                summary_manager.add_pending_invitation(batch, user_data['userId'], invitation_id, invitation_record['expiresAt'])
+                notification_data = self._build_notification(invitation_id, user_data, inviter_name, session_data)
+                batch.set(self.db.collection('notifications').document(notification_data['notificationId']), notification_data)
+                pending_writes += 2
+            
+            batch.commit()
             
             return invitation_id
             
@@ -70,30 +89,39 @@ class CupperInvitationManager:
             st.error(f"❌ Error creating invitation: {str(e)}")
             return None
     
-    def _create_notification_for_user(self, invitation_id: str, user_data: Dict, inviter_name: str, session_data: Dict):
-        """Create notification for invited registered user"""
-        try:
-            notification_id = str(uuid.uuid4())
-            
-            notification_data = {
-                'notificationId': notification_id,
-                'invitationId': invitation_id,
-                'recipientUserId': user_data.get('userId'),
-                'recipientUsername': user_data.get('username'),
-                'recipientEmail': user_data.get('email'),
-                'inviterName': inviter_name,
-                'coffeeName': session_data.get('coffee_name', 'Unknown Coffee'),
-                'sessionType': session_data.get('session_type', 'Quick Cupping'),
-                'message': f"{inviter_name} has invited you to a cupping session for {session_data.get('coffee_name', 'a coffee')}",
-                'isRead': False,
-                'createdAt': datetime.now(),
-                'type': 'cupping_invitation'
-            }
-            
-            self.db.collection('notifications').document(notification_id).set(notification_data)
-            
-        except Exception as e:
-            st.error(f"Error creating notification: {e}")
+    def _get_users_by_username(self, usernames: List[str]) -> Dict[str, Dict]:
+        """Resolve usernames to user data with chunked 'in' queries"""
+        users_by_username = {}
+        
+        for start in range(0, len(usernames), FIRESTORE_IN_QUERY_LIMIT):
+            chunk = usernames[start:start + FIRESTORE_IN_QUERY_LIMIT]
+            query = self.db.collection('users').where('username', 'in', chunk)
+            for doc in query.stream():
+                user_data = doc.to_dict()
+                users_by_username.setdefault(user_data.get('username'), {
+                    'userId': doc.id,
+                    'username': user_data.get('username'),
+                    'email': user_data.get('email')
+                })
+        
+        return users_by_username
+    
+    def _build_notification(self, invitation_id: str, user_data: Dict, inviter_name: str, session_data: Dict) -> Dict:
+        """Build the notification record for an invited registered user"""
+        return {
+            'notificationId': str(uuid.uuid4()),
+            'invitationId': invitation_id,
+            'recipientUserId': user_data.get('userId'),
+            'recipientUsername': user_data.get('username'),
+            'recipientEmail': user_data.get('email'),
+            'inviterName': inviter_name,
+            'coffeeName': session_data.get('coffee_name', 'Unknown Coffee'),
+            'sessionType': session_data.get('session_type', 'Quick Cupping'),
+            'message': f"{inviter_name} has invited you to a cupping session for {session_data.get('coffee_name', 'a coffee')}",
+            'isRead': False,
+            'createdAt': datetime.now(),
+            'type': 'cupping_invitation'
+        }
     
     def get_user_invitations(self, user_id: str) -> List[Dict]:
         """Get invitations for a user by user ID - these show in THEIR own dashboard"""
@@ -101,25 +129,23 @@ class CupperInvitationManager:
             if not self.db:
                 return []
             
-            # Get all invitations and filter in Python to find ones for this user
+            # Indexed lookup on the denormalized invitee id array
             invitations_ref = self.db.collection('cuppingInvitations')
-            docs = invitations_ref.stream()
+            query = invitations_ref.where('inviteeIds', 'array_contains', user_id)
+            docs = query.stream()
             
             user_invitations = []
+            now = datetime.now()
             
             for doc in docs:
                 invitation = doc.to_dict()
                 
-                # Check if this user is in the inviteeUsers list
-                invitee_users = invitation.get('inviteeUsers', [])
-                for invitee in invitee_users:
-                    if invitee.get('userId') == user_id:
-                        # Only include non-expired invitations
-                        if invitation.get('expiresAt') and invitation['expiresAt'] > datetime.now():
-                            # Add flag to indicate this user should see this invitation in their dashboard
-                            invitation['isForCurrentUser'] = True
-                            user_invitations.append(invitation)
-                        break
+                # Filter expiry in Python to avoid a composite index requirement
+                expires_at = invitation.get('expiresAt')
+                if expires_at and FirebaseManager.firestore_to_datetime(expires_at) > now:
+                    # Add flag to indicate this user should see this invitation in their dashboard
+                    invitation['isForCurrentUser'] = True
+                    user_invitations.append(invitation)
             
             # Sort by creation date
             user_invitations.sort(key=lambda x: x.get('createdAt', datetime.now()), reverse=True)
@@ -130,6 +156,31 @@ class CupperInvitationManager:
             st.error(f"Error getting user invitations: {e}")
             return []
     
+    def get_pending_invitation_count(self, user_id: str) -> int:
+        """Count non-expired invitations for a user without loading full documents"""
+        try:
+            if not self.db:
+                return 0
+            
+            invitations_ref = self.db.collection('cuppingInvitations')
+            query = (invitations_ref
+                    .where('inviteeIds', 'array_contains', user_id)
+                    .select(['expiresAt']))
+            
+            now = datetime.now()
+            pending = 0
+            
+            for doc in query.stream():
+                expires_at = doc.to_dict().get('expiresAt')
+                if expires_at and FirebaseManager.firestore_to_datetime(expires_at) > now:
+                    pending += 1
+            
+            return pending
+            
+        except Exception as e:
+            st.error(f"Error counting pending invitations: {e}")
+            return 0
+    
     def get_user_sent_invitations(self, user_id: str) -> List[Dict]:
         """Get invitations sent by a user"""
         try:
@@ -155,6 +206,19 @@ class CupperInvitationManager:
             st.error(f"Error getting sent invitations: {e}")
             return []
     
+    def get_user_sent_invitations_page(self, user_id: str, page_size: int = 5, page_token: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a user's sent invitations, newest first, plus the token for the next page"""
+        try:
+            if not self.db:
+                return [], None
+            
+            query = self.db.collection('cuppingInvitations').where('inviterId', '==', user_id)
+            return FirebaseManager.get_page(query, 'createdAt', page_size, page_token)
+            
+        except Exception as e:
+            st.error(f"Error getting sent invitations: {e}")
+            return [], None
+    
     def respond_to_invitation(self, invitation_id: str, user_id: str, response: str, user_name: str) -> bool:
         """Respond to a cupping invitation (accept/decline)"""
         try:
@@ -162,28 +226,26 @@ class CupperInvitationManager:
                 return False
             
             invitation_ref = self.db.collection('cuppingInvitations').document(invitation_id)
-            invitation = invitation_ref.get()
-            
-            if not invitation.exists:
-                st.error("Invitation not found")
-                return False
             
-            invitation_data = invitation.to_dict()
-            
-            # Update responses using user_id as key
-            responses = invitation_data.get('responses', {})
-            responses[user_id] = {
-                'response': response,
-                'userName': user_name,
-                'respondedAt': datetime.now()
-            }
-            
-            # Update invitation
-            invitation_ref.set({'responses': responses}, merge=True)
+            # Blind field-path update: only this user's entry is written, so concurrent
+            # responses never overwrite each other and no preliminary read is needed
+            batch = self.db.batch()
+            batch.update(invitation_ref, {
+                FirebaseManager.field_path('responses', user_id): {
+                    'response': response,
+                    'userName': user_name,
+                    'respondedAt': datetime.now()
+                }
+            })
+            get_user_summary_manager().remove_pending_invitation(batch, user_id, invitation_id)
+            batch.commit()
             
             return True
             
         except Exception as e:
+            if FirebaseManager.is_not_found(e):
+                st.error("Invitation not found")
+                return False
             st.error(f"Error responding to invitation: {e}")
             return False
     
@@ -194,28 +256,22 @@ class CupperInvitationManager:
                 return False
             
             invitation_ref = self.db.collection('cuppingInvitations').document(invitation_id)
-            invitation = invitation_ref.get()
-            
-            if not invitation.exists:
-                st.error("Invitation not found")
-                return False
-            
-            invitation_data = invitation.to_dict()
-            
-            # Update participant evaluations using user_id as key
-            evaluations = invitation_data.get('participantEvaluations', {})
-            evaluations[user_id] = {
-                'userName': user_name,
-                'evaluation': evaluation_data,
-                'submittedAt': datetime.now()
-            }
             
-            # Update invitation
-            invitation_ref.set({'participantEvaluations': evaluations}, merge=True)
+            # Write only this participant's evaluation; update() fails if the invitation is gone
+            invitation_ref.update({
+                FirebaseManager.field_path('participantEvaluations', user_id): {
+                    'userName': user_name,
+                    'evaluation': evaluation_data,
+                    'submittedAt': datetime.now()
+                }
+            })
             
             return True
             
         except Exception as e:
+            if FirebaseManager.is_not_found(e):
+                st.error("Invitation not found")
+                return False
             st.error(f"Error submitting evaluation: {e}")
             return False
     
@@ -247,9 +303,12 @@ class CupperInvitationManager:
             
             docs = query.stream()
             notifications = []
+            write_behind = get_write_behind_queue()
             
             for doc in docs:
                 notification = doc.to_dict()
+                # Show read flags that are still waiting in the write-behind queue
+                notification.update(write_behind.pending_fields('notifications', doc.id) or {})
                 notifications.append(notification)
             
             # Sort by creation date
@@ -267,8 +326,8 @@ class CupperInvitationManager:
             if not self.db:
                 return False
             
-            notification_ref = self.db.collection('notifications').document(notification_id)
-            notification_ref.set({'isRead': True}, merge=True)
+            # Flushed in the background; get_user_notifications overlays it until then
+            get_write_behind_queue().enqueue('notifications', notification_id, {'isRead': True})
             
             return True
             
@@ -0,0 +1,222 @@
+"""
+Vectorized cupping analytics over a columnar per-user history
+
+A user's cuppings are loaded once into NumPy arrays (one column per score
+attribute, timestamps, and integer-coded origins/roasters) so means,
+percentiles, rolling trends and distributions are single array operations.
+Histories are cached per user and invalidated by CuppingManager writes.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence
+import numpy as np
+import streamlit as st
+from firebase import get_firestore_db, get_config_value, FirebaseManager
+
+# Score columns and the range each is recorded on
+SCORE_ATTRIBUTES = {
+    'aroma': (0, 10),
+    'flavor': (0, 10),
+    'acidity': (0, 10),
+    'body': (0, 10),
+    'overall_score': (0, 100)
+}
+
+HISTORY_FIELDS = ['created_at', 'origin', 'roaster', *SCORE_ATTRIBUTES]
+
+DEFAULT_PERCENTILES = (25, 50, 75, 90)
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_CACHE_TTL_SECONDS = 300
+
+
+def _encode_categories(values: Sequence[Optional[str]]):
+    """Integer codes for string values (-1 for missing) and the code -> value list"""
+    categories: Dict[str, int] = {}
+    codes = np.fromiter((categories.setdefault(v, len(categories)) if v else -1 for v in values),
+                        dtype=np.int32, count=len(values))
+    return codes, list(categories)
+
+
+class CuppingHistory:
+    """One user's cuppings as NumPy columns, ordered by creation time"""
+    
+    def __init__(self, created_at: np.ndarray, scores: Dict[str, np.ndarray],
+                 origin_codes: np.ndarray, origins: List[str],
+                 roaster_codes: np.ndarray, roasters: List[str]):
+        self.created_at = created_at
+        self.scores = scores
+        self.origin_codes = origin_codes
+        self.origins = origins
+        self.roaster_codes = roaster_codes
+        self.roasters = roasters
+    
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> 'CuppingHistory':
+        """Build the columns from cupping dicts; missing scores become NaN"""
+        records = list(records)
+        
+        def timestamp(record):
+            created_at = FirebaseManager.firestore_to_datetime(record.get('created_at'))
+            return created_at.timestamp() if hasattr(created_at, 'timestamp') else np.nan
+        
+        def score(value):
+            return float(value) if isinstance(value, (int, float)) else np.nan
+        
+        created_at = np.fromiter((timestamp(r) for r in records), dtype=np.float64, count=len(records))
+        order = np.argsort(created_at, kind='stable')
+        
+        scores = {
+            attribute: np.fromiter((score(r.get(attribute)) for r in records), dtype=np.float64, count=len(records))[order]
+            for attribute in SCORE_ATTRIBUTES
+        }
+        origin_codes, origins = _encode_categories([r.get('origin') for r in records])
+        roaster_codes, roasters = _encode_categories([r.get('roaster') for r in records])
+        return cls(created_at[order], scores, origin_codes[order], origins, roaster_codes[order], roasters)
+    
+    def __len__(self) -> int:
+        return len(self.created_at)
+    
+    def means(self) -> Dict[str, float]:
+        """Mean of each score attribute, ignoring missing values"""
+        return {attribute: float(np.nanmean(column)) if self._has_values(column) else 0.0
+                for attribute, column in self.scores.items()}
+    
+    def percentiles(self, q: Sequence[float] = DEFAULT_PERCENTILES) -> Dict[str, Dict[int, float]]:
+        """Requested percentiles of each score attribute"""
+        result = {}
+        for attribute, column in self.scores.items():
+            values = np.nanpercentile(column, q) if self._has_values(column) else np.zeros(len(q))
+            result[attribute] = {int(p): round(float(v), 2) for p, v in zip(q, values)}
+        return result
+    
+    def rolling_trend(self, attribute: str, window: int = 10) -> Dict[str, list]:
+        """Moving average of an attribute over the last `window` scored cuppings, oldest first"""
+        column = self.scores[attribute]
+        scored = ~np.isnan(column)
+        values = column[scored]
+        timestamps = self.created_at[scored]
+        if not len(values):
+            return {'timestamps': [], 'values': []}
+        
+        # Window sums from a running total; the first window-1 points average what exists so far
+        totals = np.cumsum(values)
+        totals[window:] = totals[window:] - totals[:-window]
+        counts = np.minimum(np.arange(1, len(values) + 1), window)
+        return {'timestamps': timestamps.tolist(), 'values': np.round(totals / counts, 2).tolist()}
+    
+    def distribution(self, attribute: str) -> Dict[int, int]:
+        """How many cuppings received each score (integer bins across the attribute's range)"""
+        low, high = SCORE_ATTRIBUTES[attribute]
+        column = self.scores[attribute]
+        values = np.clip(np.rint(column[~np.isnan(column)]), low, high).astype(np.int64) - low
+        counts = np.bincount(values, minlength=high - low + 1)
+        return {low + i: int(count) for i, count in enumerate(counts)}
+    
+    def favorites(self) -> Dict[str, str]:
+        """Most frequent origin and roaster, counted with bincount"""
+        def most_common(codes, categories):
+            present = codes[codes >= 0]
+            return categories[int(np.argmax(np.bincount(present)))] if len(present) else 'N/A'
+        
+        return {
+            'favorite_origin': most_common(self.origin_codes, self.origins),
+            'favorite_roaster': most_common(self.roaster_codes, self.roasters)
+        }
+    
+    def summary(self, trend_window: int = 10) -> Dict:
+        """Everything the analytics view shows, in one call"""
+        return {
+            'total_cuppings': len(self),
+            'means': {attribute: round(value, 2) for attribute, value in self.means().items()},
+            'percentiles': self.percentiles(),
+            'trend': self.rolling_trend('overall_score', trend_window),
+            'distributions': {attribute: self.distribution(attribute) for attribute in SCORE_ATTRIBUTES},
+            **self.favorites()
+        }
+    
+    @staticmethod
+    def _has_values(column: np.ndarray) -> bool:
+        return bool(len(column)) and not np.isnan(column).all()
+
+
+class CuppingAnalytics:
+    """Per-user cache of cupping histories, invalidated when the user's cuppings change"""
+    
+    def __init__(self, max_users: int = DEFAULT_CACHE_SIZE, ttl_seconds: float = DEFAULT_CACHE_TTL_SECONDS):
+        self.max_users = max_users
+        # Writes on other replicas are only picked up when an entry expires
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._histories: OrderedDict = OrderedDict()
+        # Bumped by invalidate() so a load that raced with a write is not cached
+        self._generation = 0
+    
+    @property
+    def db(self):
+        """Firestore client, resolved on first use"""
+        return get_firestore_db()
+    
+    def get_history(self, user_id: str) -> Optional[CuppingHistory]:
+        """A user's columnar history, loading it on a cache miss"""
+        with self._lock:
+            entry = self._histories.get(user_id)
+            if entry and time.monotonic() - entry[1] < self.ttl_seconds:
+                self._histories.move_to_end(user_id)
+                return entry[0]
+            generation = self._generation
+        
+        history = self.load_history(user_id)
+        if history is not None:
+            with self._lock:
+                if generation != self._generation:
+                    return history
+                self._histories[user_id] = (history, time.monotonic())
+                self._histories.move_to_end(user_id)
+                while len(self._histories) > self.max_users:
+                    self._histories.popitem(last=False)
+        return history
+    
+    def load_history(self, user_id: str) -> Optional[CuppingHistory]:
+        """Read a user's cuppings, projected to the analysed fields"""
+        try:
+            if not self.db:
+                return None
+            
+            query = self.db.collection('cuppings').where('user_id', '==', user_id)
+            query = FirebaseManager.apply_projection(query, HISTORY_FIELDS)
+            return CuppingHistory.from_records(doc.to_dict() for doc in query.stream())
+            
+        except Exception as e:
+            st.error(f"Error loading cupping history: {e}")
+            return None
+    
+    def get_summary(self, user_id: str, trend_window: int = 10) -> Optional[Dict]:
+        """Means, percentiles, trend, distributions and favorites for a user"""
+        history = self.get_history(user_id)
+        return history.summary(trend_window) if history is not None else None
+    
+    def invalidate(self, user_id: Optional[str]):
+        """Drop a user's cached history after one of their cuppings changed"""
+        if not user_id:
+            return
+        with self._lock:
+            self._generation += 1
+            self._histories.pop(user_id, None)
+
+
+_cupping_analytics = None
+_cupping_analytics_lock = threading.Lock()
+
+
+def get_cupping_analytics() -> CuppingAnalytics:
+    """Get the process-wide cupping analytics cache"""
+    global _cupping_analytics
+    if _cupping_analytics is None:
+        with _cupping_analytics_lock:
+            if _cupping_analytics is None:
+                _cupping_analytics = CuppingAnalytics(
+                    int(get_config_value('CUPPING_ANALYTICS_CACHE_SIZE', DEFAULT_CACHE_SIZE)),
+                    float(get_config_value('CUPPING_ANALYTICS_TTL_SECONDS', DEFAULT_CACHE_TTL_SECONDS))
+                )
+    return _cupping_analytics
@@ -0,0 +1,248 @@
+"""
+Query planner for multi-filter cupping searches
+
+Firestore can only serve one of a search's predicates well: an equality on
+user_id or is_public ordered by created_at, or keyword matches through the
+in-process token index. The planner estimates how many documents each access
+path would read, picks the cheapest, and applies the remaining predicates
+client-side while streaming, stopping as soon as the limit is met. Every
+executed plan can be explained: the path chosen, the predicates on each side,
+the estimates it was chosen from and the documents actually read.
+"""
+import math
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+from firebase import get_firestore_db, get_config_value, FirebaseManager
+from cupping_search import get_cupping_search_index, query_terms, matches_terms
+from user_summaries import get_user_summary_manager, UserSummaryManager
+
+# Access paths in order of preference when their estimated cost is equal
+ACCESS_PATHS = ['token_index', 'user_id', 'is_public', 'scan']
+
+# Fields client-side predicates need, read alongside whatever projection was asked for
+PREDICATE_FIELDS = ['cupping_id', 'user_id', 'is_public', 'coffee_name', 'origin', 'roaster', 'created_at']
+
+DEFAULT_STATS_TTL_SECONDS = 300
+RECENT_PLAN_COUNT = 20
+
+
+class CuppingQueryPlan:
+    """Chosen access path and predicate split for one search, plus what executing it cost"""
+    
+    def __init__(self, access_path: str, user_id: Optional[str], public_only: bool,
+                 terms: List[Tuple[str, List[str], bool]], limit: int, estimates: Dict[str, int]):
+        self.access_path = access_path
+        self.user_id = user_id
+        self.public_only = public_only
+        self.terms = terms
+        self.limit = limit
+        self.estimates = estimates
+        self.documents_read = 0
+        self.returned = 0
+        self.terminated_early = False
+        self.elapsed_ms = 0.0
+    
+    @property
+    def server_filters(self) -> List[Tuple[str, object]]:
+        """Equality predicates Firestore evaluates"""
+        if self.access_path == 'user_id':
+            return [('user_id', self.user_id)]
+        if self.access_path == 'is_public':
+            return [('is_public', True)]
+        return []
+    
+    @property
+    def client_filters(self) -> List[Tuple[str, object]]:
+        """Equality predicates checked on each streamed document"""
+        if self.access_path == 'token_index':
+            return []
+        filters = [('user_id', self.user_id)] if self.user_id is not None else []
+        if self.public_only:
+            filters.append(('is_public', True))
+        return [f for f in filters if f not in self.server_filters]
+    
+    def matches(self, cupping: Dict) -> bool:
+        """Whether a streamed document passes the predicates not evaluated server-side"""
+        return (all(cupping.get(field) == value for field, value in self.client_filters)
+                and matches_terms(self.terms, cupping))
+    
+    def explain(self) -> Dict:
+        """The plan and its execution cost as a JSON-serializable dict"""
+        def describe_term(term):
+            token, scope, is_prefix = term
+            return f"{'|'.join(scope)} ~ '{token}{'*' if is_prefix else ''}'"
+        
+        index_side = self.access_path == 'token_index'
+        return {
+            'access_path': self.access_path,
+            'server_filters': [f"{field} == {value!r}" for field, value in self.server_filters],
+            'index_filters': [describe_term(term) for term in self.terms] if index_side else [],
+            'client_filters': ([f"{field} == {value!r}" for field, value in self.client_filters]
+                               + ([] if index_side else [describe_term(term) for term in self.terms])),
+            'order_by': 'score desc, created_at desc' if index_side else 'created_at desc',
+            'limit': self.limit,
+            'estimated_reads': self.estimates,
+            'documents_read': self.documents_read,
+            'returned': self.returned,
+            'terminated_early': self.terminated_early,
+            'elapsed_ms': round(self.elapsed_ms, 3)
+        }
+
+
+class CuppingQueryPlanner:
+    """Choose and run the cheapest access path for a cupping search"""
+    
+    def __init__(self, stats_ttl_seconds: float = DEFAULT_STATS_TTL_SECONDS):
+        self.stats_ttl_seconds = stats_ttl_seconds
+        self._lock = threading.Lock()
+        # Cached collection-wide counts: name -> (count, read at)
+        self._counts: Dict[str, Tuple[int, float]] = {}
+        self._recent = deque(maxlen=RECENT_PLAN_COUNT)
+        self._paths = Counter()
+    
+    @property
+    def db(self):
+        """Firestore client, resolved on first use"""
+        return get_firestore_db()
+    
+    def _count(self, name: str, query) -> int:
+        """Collection-wide count from a server-side aggregation, cached for stats_ttl_seconds"""
+        with self._lock:
+            cached = self._counts.get(name)
+            if cached and time.monotonic() - cached[1] < self.stats_ttl_seconds:
+                return cached[0]
+        count = int(FirebaseManager.aggregate(query, [('count', None, 'count')])['count'])
+        with self._lock:
+            self._counts[name] = (count, time.monotonic())
+        return count
+    
+    def _user_count(self, user_id: str, total: int) -> int:
+        """A user's cupping count from their summary document"""
+        summary = get_user_summary_manager().get_summary(user_id)
+        if not UserSummaryManager.is_complete(summary):
+            # No full summary yet: assume the worst rather than spend an aggregation on it
+            return total
+        return int(summary.get('cuppings', {}).get('count', 0))
+    
+    def plan(self, user_id: Optional[str] = None, public_only: bool = False, text: Optional[str] = None,
+             fields: Optional[Dict[str, str]] = None, limit: int = 50) -> CuppingQueryPlan:
+        """Estimate the documents each access path would read and pick the cheapest"""
+        terms = query_terms(text, fields)
+        cuppings = self.db.collection('cuppings')
+        total = self._count('all', cuppings)
+        rows = {'scan': total}
+        if user_id is not None:
+            rows['user_id'] = self._user_count(user_id, total)
+        if public_only:
+            rows['is_public'] = self._count('public', cuppings.where('is_public', '==', True))
+        
+        # Share of documents passing each predicate, assuming they are independent
+        selectivity = {path: count / total if total else 0.0 for path, count in rows.items() if path != 'scan'}
+        index = get_cupping_search_index()
+        if terms and index.loaded:
+            selectivity['terms'] = index.estimate(terms) / total if total else 0.0
+        
+        estimates = {}
+        for path, count in rows.items():
+            if terms and 'terms' not in selectivity:
+                # Keyword selectivity is unknown until the index is loaded: assume the whole path is read
+                estimates[path] = count
+                continue
+            others = [s for name, s in selectivity.items() if name != path]
+            expected_matches = count * min(1.0, math.prod(others))
+            estimates[path] = round(_expected_reads(limit, count, expected_matches))
+        if terms:
+            # A cold index reads the collection once; a warm one reads just the ranked hits
+            estimates['token_index'] = (min(limit, index.estimate(terms)) if index.loaded else total)
+        
+        access_path = min(estimates, key=lambda path: (estimates[path], ACCESS_PATHS.index(path)))
+        return CuppingQueryPlan(access_path, user_id, public_only, terms, limit, estimates)
+    
+    def execute(self, plan: CuppingQueryPlan, projection: Optional[List[str]] = None) -> List[Dict]:
+        """Run a plan and record what it read"""
+        start = time.perf_counter()
+        if plan.access_path == 'token_index':
+            results = self._execute_index(plan, projection)
+        else:
+            results = self._execute_stream(plan, projection)
+        plan.returned = len(results)
+        plan.elapsed_ms = (time.perf_counter() - start) * 1000
+        
+        with self._lock:
+            self._paths[plan.access_path] += 1
+            self._recent.append(plan.explain())
+        return results
+    
+    def _execute_index(self, plan: CuppingQueryPlan, projection: Optional[List[str]]) -> List[Dict]:
+        """Ranked ids from the token index, then one batched read"""
+        index = get_cupping_search_index()
+        fetched: Dict[str, Dict] = {}
+        while True:
+            ids = [cupping_id for cupping_id, _ in index.search_terms(plan.terms, plan.user_id, plan.public_only, plan.limit)]
+            new_ids = [cupping_id for cupping_id in ids if cupping_id not in fetched]
+            plan.documents_read += len(new_ids)
+            for cupping in FirebaseManager.get_documents(self.db, 'cuppings', new_ids, 'cupping_id', projection):
+                fetched[cupping['cupping_id']] = cupping
+            
+            # Cuppings deleted on another replica since the index last refreshed: drop them from
+            # the index and rank again, so the next matches fill their slots up to the limit
+            missing = [cupping_id for cupping_id in new_ids if cupping_id not in fetched]
+            if not missing:
+                return [fetched[cupping_id] for cupping_id in ids]
+            for cupping_id in missing:
+                index.remove(cupping_id)
+    
+    def _execute_stream(self, plan: CuppingQueryPlan, projection: Optional[List[str]]) -> List[Dict]:
+        """Stream the server-side predicate newest first, filtering client-side until the limit is met"""
+        query = self.db.collection('cuppings')
+        for field, value in plan.server_filters:
+            query = query.where(field, '==', value)
+        query = query.order_by('created_at', direction='DESCENDING')
+        filtered = bool(plan.client_filters or plan.terms)
+        if not filtered:
+            query = query.limit(plan.limit)
+        if projection is not None:
+            query = FirebaseManager.apply_projection(query, list(dict.fromkeys(projection + PREDICATE_FIELDS)))
+        
+        results = []
+        for doc in query.stream():
+            plan.documents_read += 1
+            cupping = doc.to_dict()
+            if plan.matches(cupping):
+                results.append(cupping)
+                if len(results) >= plan.limit:
+                    # Leaving the loop closes the stream; nothing further is read
+                    plan.terminated_early = filtered
+                    break
+        return results
+    
+    def stats(self) -> Dict:
+        """Searches per access path and the most recent plans"""
+        with self._lock:
+            return {'access_paths': dict(self._paths), 'recent_plans': list(self._recent)}
+
+
+def _expected_reads(limit: int, count: int, expected_matches: float) -> float:
+    """Documents streamed before `limit` matches turn up, if matches are spread evenly"""
+    if expected_matches <= limit:
+        # Too few matches to stop early: the whole path is read
+        return count
+    return limit * count / expected_matches
+
+
+_cupping_query_planner = None
+_cupping_query_planner_lock = threading.Lock()
+
+
+def get_cupping_query_planner() -> CuppingQueryPlanner:
+    """Get the process-wide cupping query planner (CUPPING_PLANNER_STATS_TTL_SECONDS)"""
+    global _cupping_query_planner
+    if _cupping_query_planner is None:
+        with _cupping_query_planner_lock:
+            if _cupping_query_planner is None:
+                _cupping_query_planner = CuppingQueryPlanner(
+                    float(get_config_value('CUPPING_PLANNER_STATS_TTL_SECONDS', DEFAULT_STATS_TTL_SECONDS))
+                )
+    return _cupping_query_planner
@@ -0,0 +1,358 @@
+"""
+Case-insensitive token search index over cupping names, origins and roasters
+
+Each field is split into normalized tokens (lower-cased, accents folded) and
+every token keeps a posting list of the cuppings that contain it. A query is
+answered by intersecting the posting lists of its tokens, smallest first, and
+ranking the survivors by field weight and token rarity. The index is loaded
+once per process, kept current by CuppingManager writes, and topped up with
+cuppings updated on other replicas on a timer.
+"""
+import bisect
+import math
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from firebase import get_firestore_db, get_config_value, FirebaseManager, EARLIEST_TIMESTAMP
+
+# Searchable fields and how much a match in each one counts towards the rank
+SEARCH_FIELDS = {
+    'coffee_name': 3.0,
+    'roaster': 2.0,
+    'origin': 1.0
+}
+
+INDEX_FIELDS = ['cupping_id', 'user_id', 'is_public', 'created_at', 'updated_at', *SEARCH_FIELDS]
+
+DEFAULT_REFRESH_SECONDS = 60
+DEFAULT_RESULT_LIMIT = 50
+
+# Vocabulary tokens a trailing partial word may expand to
+MAX_PREFIX_EXPANSIONS = 50
+
+# Distinct field values whose token sets are remembered; origins and roasters repeat a lot
+TOKEN_CACHE_SIZE = 65536
+
+# Share of dead entries (deleted or superseded) above which a refresh rebuilds the index
+REBUILD_DEAD_RATIO = 0.25
+
+_TOKEN_SPLIT = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_tokens(text: Optional[str]) -> List[str]:
+    """Lower-cased, accent-folded alphanumeric tokens of a string"""
+    if not text:
+        return []
+    folded = ''.join(c for c in unicodedata.normalize('NFKD', str(text)) if not unicodedata.combining(c))
+    return [token for token in _TOKEN_SPLIT.split(folded.lower()) if token]
+
+
+def query_terms(text: Optional[str] = None, fields: Optional[Dict[str, str]] = None) -> List[Tuple[str, List[str], bool]]:
+    """(token, fields it may match, matches as a prefix) for each word of a search"""
+    # `text` words may match any searchable field, `fields` words only their own field;
+    # the last word of each query also matches as a prefix so partly typed words find results
+    terms = []
+    for query, scope in [(text, list(SEARCH_FIELDS))] + [(value, [field]) for field, value in (fields or {}).items()]:
+        tokens = normalize_tokens(query)
+        terms.extend((token, scope, i == len(tokens) - 1) for i, token in enumerate(tokens))
+    return terms
+
+
+def matches_terms(terms: List[Tuple[str, List[str], bool]], cupping: Dict) -> bool:
+    """Whether a cupping contains every term, as the index would match it"""
+    for token, scope, is_prefix in terms:
+        candidates = [_token_set(cupping[field]) for field in scope if isinstance(cupping.get(field), str)]
+        if not any(token in tokens or (is_prefix and any(t.startswith(token) for t in tokens)) for tokens in candidates):
+            return False
+    return True
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def _token_set(text: str) -> frozenset:
+    return frozenset(normalize_tokens(text))
+
+
+def _members(sorted_ordinals: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """Mask of candidates present in a sorted posting list"""
+    if len(candidates) * 8 < len(sorted_ordinals):
+        # Few candidates: binary-search each one in the long list
+        positions = np.minimum(np.searchsorted(sorted_ordinals, candidates), len(sorted_ordinals) - 1)
+        return sorted_ordinals[positions] == candidates
+    # Comparable sizes: mark the list in a bitmap and look the candidates up
+    marked = np.zeros(int(max(sorted_ordinals[-1], candidates.max())) + 1, dtype=bool)
+    marked[sorted_ordinals] = True
+    return marked[candidates]
+
+
+def _timestamp(value) -> float:
+    value = FirebaseManager.to_utc(value)
+    return value.timestamp() if value else 0.0
+
+
+class CuppingSearchIndex:
+    """Inverted index from normalized tokens to cuppings, per searchable field"""
+    
+    def __init__(self, refresh_seconds: float = DEFAULT_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._clear()
+        self._loaded_through: Optional[datetime] = None
+        self._refreshed_at = 0.0
+        self._counters = {'searches': 0, 'rebuilds': 0}
+    
+    def _clear(self):
+        # field -> token -> ordinals; ordinals only grow, so every posting list stays sorted
+        self._postings: Dict[str, Dict[str, array]] = {field: {} for field in SEARCH_FIELDS}
+        # Every token in any field, sorted, for expanding a partial last word
+        self._vocabulary: List[str] = []
+        # Per-ordinal columns; an update appends a new ordinal and marks the old one dead
+        self._ids: List[str] = []
+        self._ordinal_by_id: Dict[str, int] = {}
+        self._alive = bytearray()
+        self._public = bytearray()
+        self._users = array('i')
+        self._created = array('d')
+        self._updated = array('d')
+        self._user_codes: Dict[str, int] = {}
+    
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_through is not None
+    
+    def add(self, cupping: Dict):
+        """Index a created or updated cupping; ignored until the index has been loaded"""
+        with self._lock:
+            if self.loaded:
+                self._add(cupping)
+    
+    def remove(self, cupping_id: str):
+        """Drop a deleted cupping from results (also when a read finds it deleted elsewhere)"""
+        with self._lock:
+            ordinal = self._ordinal_by_id.pop(cupping_id, None)
+            if ordinal is not None:
+                self._alive[ordinal] = 0
+    
+    def _add(self, cupping: Dict):
+        cupping_id = cupping.get('cupping_id')
+        if not cupping_id:
+            return
+        updated_at = _timestamp(cupping.get('updated_at'))
+        previous = self._ordinal_by_id.get(cupping_id)
+        if previous is not None:
+            if updated_at and updated_at <= self._updated[previous]:
+                # Already indexed at this version (a refresh re-reading this process's own write)
+                return
+            self._alive[previous] = 0
+        
+        ordinal = len(self._ids)
+        self._ids.append(cupping_id)
+        self._ordinal_by_id[cupping_id] = ordinal
+        self._alive.append(1)
+        self._public.append(1 if cupping.get('is_public') else 0)
+        self._users.append(self._user_codes.setdefault(cupping.get('user_id') or '', len(self._user_codes)))
+        self._created.append(_timestamp(cupping.get('created_at')))
+        self._updated.append(updated_at)
+        
+        for field, postings in self._postings.items():
+            value = cupping.get(field)
+            for token in _token_set(value) if isinstance(value, str) else ():
+                posting = postings.get(token)
+                if posting is None:
+                    posting = postings[token] = array('i')
+                    i = bisect.bisect_left(self._vocabulary, token)
+                    if i == len(self._vocabulary) or self._vocabulary[i] != token:
+                        self._vocabulary.insert(i, token)
+                posting.append(ordinal)
+    
+    def search(self, text: Optional[str] = None, fields: Optional[Dict[str, str]] = None, user_id: Optional[str] = None,
+               public_only: bool = False, limit: int = DEFAULT_RESULT_LIMIT) -> List[Tuple[str, float]]:
+        """Cupping ids matching every query token, best first, with their scores"""
+        return self.search_terms(query_terms(text, fields), user_id, public_only, limit)
+    
+    def search_terms(self, terms: List[Tuple[str, List[str], bool]], user_id: Optional[str] = None,
+                     public_only: bool = False, limit: int = DEFAULT_RESULT_LIMIT) -> List[Tuple[str, float]]:
+        """Like search(), for terms already built with query_terms()"""
+        self._ensure_fresh()
+        if not terms:
+            return []
+        
+        with self._lock:
+            self._counters['searches'] += 1
+            return self._search(terms, user_id, public_only, limit)
+    
+    def _search(self, terms, user_id: Optional[str], public_only: bool, limit: int) -> List[Tuple[str, float]]:
+        """Intersect posting lists and rank the matches; called with the lock held"""
+        live = len(self._ordinal_by_id)
+        matches = []
+        for token, scope, is_prefix in terms:
+            expansions = self._expand(token) if is_prefix else [token]
+            per_field = []
+            for field in scope:
+                lists = [self._postings[field][t] for t in expansions if t in self._postings[field]]
+                if lists:
+                    # Copies, so no NumPy view pins a posting list that a later write appends to
+                    ordinals = np.unique(np.concatenate([np.frombuffer(p, dtype=np.int32) for p in lists])) \
+                        if len(lists) > 1 else np.frombuffer(lists[0], dtype=np.int32).copy()
+                    per_field.append((field, ordinals))
+            if not per_field:
+                return []
+            matches.append(per_field)
+        
+        # Candidates match every term in at least one of its fields; start from the rarest term
+        term_sets = [per_field[0][1] if len(per_field) == 1 else np.unique(np.concatenate([o for _, o in per_field]))
+                     for per_field in matches]
+        candidates = None
+        for ordinals in sorted(term_sets, key=len):
+            candidates = ordinals if candidates is None else candidates[_members(ordinals, candidates)]
+            if not len(candidates):
+                return []
+        
+        mask = np.frombuffer(self._alive, dtype=np.uint8)[candidates].astype(bool)
+        if public_only:
+            mask &= np.frombuffer(self._public, dtype=np.uint8)[candidates].astype(bool)
+        if user_id is not None:
+            code = self._user_codes.get(user_id)
+            if code is None:
+                return []
+            mask &= np.frombuffer(self._users, dtype=np.int32)[candidates] == code
+        candidates = candidates[mask]
+        if not len(candidates):
+            return []
+        
+        # Each matching field adds its weight times the rarity (idf) of the matched term
+        scores = np.zeros(len(candidates))
+        for per_field in matches:
+            for field, ordinals in per_field:
+                idf = math.log(1 + live / len(ordinals))
+                scores += SEARCH_FIELDS[field] * idf * _members(ordinals, candidates)
+        
+        # Best score first, newest first among equal scores
+        created = np.frombuffer(self._created, dtype=np.float64)[candidates]
+        top = self._top(scores, created, limit)
+        order = top[np.lexsort((-created[top], -scores[top]))]
+        return [(self._ids[i], round(float(s), 4)) for i, s in zip(candidates[order].tolist(), scores[order].tolist())]
+    
+    @staticmethod
+    def _top(scores: np.ndarray, created: np.ndarray, limit: int) -> np.ndarray:
+        """Positions of the `limit` best results, unordered, without sorting every match"""
+        if len(scores) <= limit:
+            return np.arange(len(scores))
+        threshold = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+        above = np.flatnonzero(scores > threshold)
+        tied = np.flatnonzero(scores == threshold)
+        needed = limit - len(above)
+        if len(tied) > needed:
+            tied = tied[np.argpartition(-created[tied], needed - 1)[:needed]]
+        return np.concatenate([above, tied])
+    
+    def estimate(self, terms: List[Tuple[str, List[str], bool]]) -> int:
+        """Upper bound on matches: the shortest posting list among the terms (live or not)"""
+        with self._lock:
+            sizes = []
+            for token, scope, is_prefix in terms:
+                expansions = self._expand(token) if is_prefix else [token]
+                sizes.append(sum(len(self._postings[field].get(t, ())) for field in scope for t in expansions))
+            return min(sizes, default=len(self._ordinal_by_id))
+    
+    def _expand(self, prefix: str) -> List[str]:
+        """Vocabulary tokens starting with prefix, the exact token first"""
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_left(self._vocabulary, prefix + '\U0010ffff', lo=start)
+        return self._vocabulary[start:min(end, start + MAX_PREFIX_EXPANSIONS)] or [prefix]
+    
+    def _ensure_fresh(self):
+        if time.monotonic() - self._refreshed_at > self.refresh_seconds:
+            try:
+                self.refresh()
+            except Exception:
+                # A stale index still answers; try again at the next interval
+                self._refreshed_at = time.monotonic()
+    
+    def refresh(self) -> int:
+        """Index cuppings updated since the last refresh, rebuilding when too many entries are dead"""
+        db = get_firestore_db()
+        if not db:
+            return 0
+        
+        with self._lock:
+            dead = len(self._ids) - len(self._ordinal_by_id)
+            rebuild = not self.loaded or (len(self._ids) > 0 and dead / len(self._ids) > REBUILD_DEAD_RATIO)
+            loaded_through = self._loaded_through
+        
+        query = db.collection('cuppings')
+        if not rebuild:
+            # Inclusive so cuppings sharing the last timestamp are not skipped; _add() ignores versions it has
+            query = query.where('updated_at', '>=', loaded_through)
+        query = FirebaseManager.apply_projection(query, INDEX_FIELDS)
+        rows = [doc.to_dict() for doc in query.stream()]
+        
+        if rebuild:
+            self.load(rows)
+            return len(rows)
+        
+        with self._lock:
+            for row in rows:
+                self._add(row)
+            self._advance(rows)
+        return len(rows)
+    
+    def load(self, cuppings: Iterable[Dict]):
+        """Replace the index contents with these cuppings"""
+        cuppings = list(cuppings)
+        with self._lock:
+            self._clear()
+            self._loaded_through = EARLIEST_TIMESTAMP
+            self._counters['rebuilds'] += 1
+            for cupping in cuppings:
+                self._add(cupping)
+            self._advance(cuppings)
+    
+    def _advance(self, rows: List[Dict]):
+        """Move the refresh watermark past rows read from the database"""
+        for row in rows:
+            updated_at = FirebaseManager.to_utc(row.get('updated_at'))
+            if updated_at:
+                # Kept in UTC: it goes back to Firestore as the next query's bound
+                self._loaded_through = max(self._loaded_through, updated_at)
+        self._refreshed_at = time.monotonic()
+    
+    def memory_bytes(self) -> int:
+        """Approximate size of the posting lists and per-cupping columns"""
+        with self._lock:
+            postings = sum(p.buffer_info()[1] * p.itemsize for field in self._postings.values() for p in field.values())
+            columns = len(self._alive) + len(self._public) + len(self._users) * 4 + (len(self._created) + len(self._updated)) * 8
+            return postings + columns
+    
+    def stats(self) -> Dict:
+        """Index size, vocabulary, dead entries and counters"""
+        with self._lock:
+            return {
+                'cuppings': len(self._ordinal_by_id),
+                'dead_entries': len(self._ids) - len(self._ordinal_by_id),
+                'vocabulary': len(self._vocabulary),
+                'postings': sum(len(p) for postings in self._postings.values() for p in postings.values()),
+                **self._counters,
+                'seconds_since_refresh': round(time.monotonic() - self._refreshed_at, 1) if self._refreshed_at else None
+            }
+
+
+_cupping_search_index = None
+_cupping_search_lock = threading.Lock()
+
+
+def get_cupping_search_index() -> CuppingSearchIndex:
+    """Get the process-wide cupping search index (CUPPING_SEARCH_REFRESH_SECONDS)"""
+    global _cupping_search_index
+    if _cupping_search_index is None:
+        with _cupping_search_lock:
+            if _cupping_search_index is None:
+                _cupping_search_index = CuppingSearchIndex(
+                    float(get_config_value('CUPPING_SEARCH_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS))
+                )
+    return _cupping_search_index
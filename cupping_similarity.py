@@ -0,0 +1,311 @@
+"""
+Nearest-neighbor search over cupping score vectors for "coffees like this one"
+
+Every public cupping becomes one column of a contiguous float32 matrix: its
+aroma, flavor, acidity, body and overall scores scaled to 0..1, followed by
+a small hashed bag of its flavor-note words. A k-NN query is one
+vector-matrix product (squared distances from precomputed norms) and an
+argpartition. The matrix is loaded once per process, kept current by
+CuppingManager writes, and topped up with cuppings updated elsewhere on a timer.
+"""
+import math
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from firebase import get_firestore_db, get_config_value, FirebaseManager, EARLIEST_TIMESTAMP
+from cupping_analytics import SCORE_ATTRIBUTES
+from cupping_search import normalize_tokens
+
+# Buckets flavor-note words are hashed into
+NOTE_DIMENSIONS = 16
+
+DIMENSIONS = len(SCORE_ATTRIBUTES) + NOTE_DIMENSIONS
+
+# Professional session attributes that line up with the quick cupping scores
+SCA_ATTRIBUTE_MAP = {
+    'aroma': 'Fragrance/Aroma',
+    'flavor': 'Flavor',
+    'acidity': 'Acidity',
+    'body': 'Body'
+}
+
+INDEX_FIELDS = ['cupping_id', 'user_id', 'is_public', 'updated_at', 'flavor_notes', *SCORE_ATTRIBUTES]
+
+DEFAULT_NOTE_WEIGHT = 0.5
+DEFAULT_REFRESH_SECONDS = 300
+DEFAULT_NEIGHBORS = 5
+INITIAL_CAPACITY = 1024
+
+# Share of dead rows above which the matrix is compacted
+COMPACT_DEAD_RATIO = 0.25
+
+
+def score_vector(scores: Dict, flavor_notes: Optional[str], note_weight: float = DEFAULT_NOTE_WEIGHT) -> Optional[np.ndarray]:
+    """Feature vector for a set of scores and flavor notes, or None if no score is present"""
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    present = False
+    for i, (attribute, (low, high)) in enumerate(SCORE_ATTRIBUTES.items()):
+        value = scores.get(attribute)
+        if isinstance(value, (int, float)):
+            vector[i] = min(1.0, max(0.0, (value - low) / (high - low)))
+            present = True
+        else:
+            # A missing score sits mid-range so it neither attracts nor repels
+            vector[i] = 0.5
+    if not present:
+        return None
+    
+    tokens = set(normalize_tokens(flavor_notes))
+    if tokens:
+        notes = vector[len(SCORE_ATTRIBUTES):]
+        for token in tokens:
+            notes[zlib.crc32(token.encode('utf-8')) % NOTE_DIMENSIONS] = 1.0
+        notes *= note_weight / math.sqrt(float(notes.sum()))
+    return vector
+
+
+def cupping_vector(cupping: Dict, note_weight: float = DEFAULT_NOTE_WEIGHT) -> Optional[np.ndarray]:
+    """Feature vector of a quick cupping"""
+    return score_vector(cupping, cupping.get('flavor_notes'), note_weight)
+
+
+def session_vector(session: Dict, note_weight: float = DEFAULT_NOTE_WEIGHT) -> Optional[np.ndarray]:
+    """Feature vector of a professional cupping session, averaged over every cupper and cup"""
+    cups = [cup for cupper in (session.get('evaluations') or {}).values() for cup in cupper.values()]
+    if not cups:
+        return None
+    scores = {}
+    for attribute, sca_attribute in SCA_ATTRIBUTE_MAP.items():
+        values = [cup['scores'][sca_attribute] for cup in cups if sca_attribute in cup.get('scores', {})]
+        if values:
+            scores[attribute] = sum(values) / len(values)
+    finals = [cup['final_score'] for cup in cups if isinstance(cup.get('final_score'), (int, float))]
+    if finals:
+        scores['overall_score'] = sum(finals) / len(finals)
+    return score_vector(scores, ', '.join(session.get('selected_flavors') or []), note_weight)
+
+
+class CuppingSimilarityIndex:
+    """Matrix of public cupping vectors with exact k-nearest-neighbor queries"""
+    
+    def __init__(self, note_weight: float = DEFAULT_NOTE_WEIGHT, refresh_seconds: float = DEFAULT_REFRESH_SECONDS):
+        self.note_weight = note_weight
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._clear()
+        self._loaded_through: Optional[datetime] = None
+        self._refreshed_at = 0.0
+        self._counters = {'queries': 0, 'compactions': 0}
+    
+    def _clear(self, capacity: int = INITIAL_CAPACITY):
+        # One column per cupping: with few features, scanning feature-major rows is
+        # several times faster than a dot product per cupping
+        self._matrix = np.zeros((DIMENSIONS, capacity), dtype=np.float32)
+        # Squared vector norms, so distances need only one vector-matrix product
+        self._norms = np.zeros(capacity, dtype=np.float32)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._owners = np.zeros(capacity, dtype=np.int32)
+        self._size = 0
+        self._ids: List[str] = []
+        self._row_by_id: Dict[str, int] = {}
+        self._user_codes: Dict[str, int] = {}
+    
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_through is not None
+    
+    def add(self, cupping: Dict):
+        """Index a created or updated cupping; ignored until the index has been loaded"""
+        with self._lock:
+            if self.loaded:
+                self._add(cupping)
+    
+    def remove(self, cupping_id: str):
+        """Drop a deleted cupping from results"""
+        with self._lock:
+            self._remove(cupping_id)
+    
+    def _remove(self, cupping_id: str):
+        row = self._row_by_id.pop(cupping_id, None)
+        if row is not None:
+            self._alive[row] = False
+    
+    def _add(self, cupping: Dict):
+        cupping_id = cupping.get('cupping_id')
+        if not cupping_id:
+            return
+        vector = cupping_vector(cupping, self.note_weight) if cupping.get('is_public') else None
+        if vector is None:
+            # Private or unscored cuppings are never suggested
+            self._remove(cupping_id)
+            return
+        
+        row = self._row_by_id.get(cupping_id)
+        if row is None:
+            if self._size == self._matrix.shape[1]:
+                self._grow()
+            row = self._size
+            self._size += 1
+            self._ids.append(cupping_id)
+            self._row_by_id[cupping_id] = row
+        self._matrix[:, row] = vector
+        self._norms[row] = vector @ vector
+        self._alive[row] = True
+        self._owners[row] = self._user_codes.setdefault(cupping.get('user_id') or '', len(self._user_codes))
+    
+    def _grow(self):
+        """Double the capacity, copying into new contiguous arrays"""
+        self._resize(2 * self._matrix.shape[1], np.arange(self._size))
+    
+    def _resize(self, capacity: int, keep: np.ndarray):
+        """Reallocate every per-cupping array at capacity, keeping the given rows in order"""
+        matrix = np.zeros((DIMENSIONS, capacity), dtype=np.float32)
+        matrix[:, :len(keep)] = self._matrix[:, keep]
+        self._matrix = matrix
+        for name in ('_norms', '_alive', '_owners'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(keep)] = old[keep]
+            setattr(self, name, new)
+    
+    def _compact(self):
+        """Drop dead rows once they make up too much of the matrix"""
+        keep = np.flatnonzero(self._alive[:self._size])
+        self._resize(max(INITIAL_CAPACITY, 2 * len(keep)), keep)
+        self._ids = [self._ids[row] for row in keep.tolist()]
+        self._row_by_id = {cupping_id: row for row, cupping_id in enumerate(self._ids)}
+        self._size = len(keep)
+        self._counters['compactions'] += 1
+    
+    def similar(self, cupping: Dict, k: int = DEFAULT_NEIGHBORS,
+                exclude_user_id: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Ids of the k public cuppings closest to a cupping, nearest first, with their distances"""
+        vector = cupping_vector(cupping, self.note_weight)
+        if vector is None:
+            return []
+        return self.nearest(vector, k, exclude_ids=[cupping.get('cupping_id')], exclude_user_id=exclude_user_id)
+    
+    def nearest(self, vector: np.ndarray, k: int = DEFAULT_NEIGHBORS, exclude_ids: Iterable[Optional[str]] = (),
+                exclude_user_id: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Ids of the k public cuppings closest to a feature vector, nearest first, with their distances"""
+        self._ensure_fresh()
+        with self._lock:
+            self._counters['queries'] += 1
+            size = self._size
+            if not size or k <= 0:
+                return []
+            
+            # |x - q|^2 = |x|^2 - 2 x.q + |q|^2; the last term is the same for every cupping
+            distances = vector @ self._matrix[:, :size]
+            distances *= -2
+            distances += self._norms[:size]
+            distances[~self._alive[:size]] = np.inf
+            for cupping_id in exclude_ids:
+                row = self._row_by_id.get(cupping_id)
+                if row is not None:
+                    distances[row] = np.inf
+            if exclude_user_id is not None and exclude_user_id in self._user_codes:
+                distances[self._owners[:size] == self._user_codes[exclude_user_id]] = np.inf
+            
+            k = min(k, size)
+            nearest = np.argpartition(distances, k - 1)[:k]
+            nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+            query_norm = float(vector @ vector)
+            return [(self._ids[row], round(math.sqrt(max(0.0, float(distance) + query_norm)), 4))
+                    for row, distance in zip(nearest.tolist(), distances[nearest].tolist()) if distance != np.inf]
+    
+    def similarity(self, distance: float) -> float:
+        """Distance as a 0-100 match, 100 being identical and 0 the farthest two vectors can be"""
+        farthest = math.sqrt(len(SCORE_ATTRIBUTES) + 2 * self.note_weight ** 2)
+        return round(max(0.0, 1 - distance / farthest) * 100, 1)
+    
+    def _ensure_fresh(self):
+        if time.monotonic() - self._refreshed_at > self.refresh_seconds:
+            try:
+                self.refresh()
+            except Exception:
+                # A stale index still answers; try again at the next interval
+                self._refreshed_at = time.monotonic()
+    
+    def refresh(self) -> int:
+        """Index cuppings updated since the last refresh (every public cupping the first time)"""
+        db = get_firestore_db()
+        if not db:
+            return 0
+        
+        query = db.collection('cuppings')
+        if self.loaded:
+            # All updates, not just public ones, so cuppings made private drop out
+            query = query.where('updated_at', '>=', self._loaded_through)
+        else:
+            query = query.where('is_public', '==', True)
+        query = FirebaseManager.apply_projection(query, INDEX_FIELDS)
+        rows = [doc.to_dict() for doc in query.stream()]
+        
+        if not self.loaded:
+            self.load(rows)
+            return len(rows)
+        
+        with self._lock:
+            for row in rows:
+                self._add(row)
+            self._advance(rows)
+        return len(rows)
+    
+    def load(self, cuppings: Iterable[Dict]):
+        """Replace the index contents with these cuppings"""
+        cuppings = list(cuppings)
+        with self._lock:
+            self._clear(max(INITIAL_CAPACITY, len(cuppings)))
+            self._loaded_through = EARLIEST_TIMESTAMP
+            for cupping in cuppings:
+                self._add(cupping)
+            self._advance(cuppings)
+    
+    def _advance(self, rows: List[Dict]):
+        """Move the refresh watermark past rows read from the database and compact if needed"""
+        for row in rows:
+            updated_at = FirebaseManager.to_utc(row.get('updated_at'))
+            if updated_at:
+                # Kept in UTC: it goes back to Firestore as the next query's bound
+                self._loaded_through = max(self._loaded_through, updated_at)
+        if self._size and (self._size - len(self._row_by_id)) / self._size > COMPACT_DEAD_RATIO:
+            self._compact()
+        self._refreshed_at = time.monotonic()
+    
+    def memory_bytes(self) -> int:
+        """Bytes held by the matrix and its per-row arrays"""
+        with self._lock:
+            return self._matrix.nbytes + self._norms.nbytes + self._alive.nbytes + self._owners.nbytes
+    
+    def stats(self) -> Dict:
+        """Indexed cuppings, dead rows, memory and counters"""
+        with self._lock:
+            return {
+                'cuppings': len(self._row_by_id),
+                'dead_rows': self._size - len(self._row_by_id),
+                'capacity': self._matrix.shape[1],
+                'dimensions': DIMENSIONS,
+                **self._counters,
+                'seconds_since_refresh': round(time.monotonic() - self._refreshed_at, 1) if self._refreshed_at else None
+            }
+
+
+_cupping_similarity_index = None
+_cupping_similarity_lock = threading.Lock()
+
+
+def get_cupping_similarity_index() -> CuppingSimilarityIndex:
+    """Get the process-wide similarity index (CUPPING_SIMILARITY_NOTE_WEIGHT, CUPPING_SIMILARITY_REFRESH_SECONDS)"""
+    global _cupping_similarity_index
+    if _cupping_similarity_index is None:
+        with _cupping_similarity_lock:
+            if _cupping_similarity_index is None:
+                _cupping_similarity_index = CuppingSimilarityIndex(
+                    float(get_config_value('CUPPING_SIMILARITY_NOTE_WEIGHT', DEFAULT_NOTE_WEIGHT)),
+                    float(get_config_value('CUPPING_SIMILARITY_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS))
+                )
+    return _cupping_similarity_index
@@ -2,17 +2,32 @@
 Cupping CRUD operations for Firestore
 """
 import streamlit as st
-from typing import Dict, List, Optional
-from firebase import get_firestore_db
+from typing import Dict, List, Optional, Tuple
+from firebase import get_firestore_db, run_in_transaction, FirebaseManager
+from user_summaries import get_user_summary_manager
+from quotas import get_quota_manager
+from cupping_analytics import get_cupping_analytics
+from cupping_search import get_cupping_search_index
+from cupping_planner import get_cupping_query_planner
+from cupping_similarity import get_cupping_similarity_index
 from datetime import datetime
 import uuid
 
 
+# Fields returned by list queries; 'card' covers the collapsed list view, None loads whole documents
+CUPPING_PROJECTIONS = {
+    'card': ['cupping_id', 'coffee_name', 'origin', 'overall_score', 'created_at'],
+    'full': None
+}
+
+
 class CuppingManager:
     """Manage cupping operations in Firestore"""
     
-    def __init__(self):
-        self.db = get_firestore_db()
+    @property
+    def db(self):
+        """Firestore client, resolved on first use"""
+        return get_firestore_db()
     
     def create_cupping(self, cupping_data: Dict, user_id: str) -> Optional[str]:
         """Create a new cupping record"""
@@ -21,6 +36,12 @@ class CuppingManager:
                 st.error("❌ Database connection not available")
                 return None
             
+            # Refuse before any write once this user has used up their quota
+            quota = get_quota_manager().check(user_id, 'create_cupping')
+            if not quota['allowed']:
+                st.warning(f"⏳ {quota['message']}")
+                return None
+            
             cupping_id = str(uuid.uuid4())
             
             # Prepare cupping data with metadata
@@ -32,8 +53,14 @@ class CuppingManager:
                 **cupping_data  # Merge with provided data
             }
             
-            # Store in Firestore
-            self.db.collection('cuppings').document(cupping_id).set(cupping_record)
+            # Store the record and its owner's summary delta in one atomic batch
+            batch = self.db.batch()
+            batch.set(self.db.collection('cuppings').document(cupping_id), cupping_record)
+            get_user_summary_manager().apply_change(batch, 'cuppings', None, cupping_record)
+            batch.commit()
+            get_cupping_analytics().invalidate(user_id)
+            get_cupping_search_index().add(cupping_record)
+            get_cupping_similarity_index().add(cupping_record)
             return cupping_id
             
         except Exception as e:
@@ -66,9 +93,22 @@ class CuppingManager:
             # Add updated timestamp
             update_data['updated_at'] = datetime.now()
             
-            # Use merge=True to preserve other fields
             cupping_ref = self.db.collection('cuppings').document(cupping_id)
-            cupping_ref.set(update_data, merge=True)
+            
+            def update_with_summary(transaction):
+                snapshot = cupping_ref.get(transaction=transaction)
+                before = snapshot.to_dict() if snapshot.exists else None
+                
+                # Use merge=True to preserve other fields
+                transaction.set(cupping_ref, update_data, merge=True)
+                after = {**(before or {}), **update_data}
+                get_user_summary_manager().apply_change(transaction, 'cuppings', before, after)
+                return after
+            
+            after = {'cupping_id': cupping_id, **run_in_transaction(update_with_summary)}
+            get_cupping_analytics().invalidate(after.get('user_id'))
+            get_cupping_search_index().add(after)
+            get_cupping_similarity_index().add(after)
             return True
             
         except Exception as e:
@@ -82,14 +122,26 @@ class CuppingManager:
                 return False
             
             cupping_ref = self.db.collection('cuppings').document(cupping_id)
-            cupping_ref.delete()
+            
+            def delete_with_summary(transaction):
+                snapshot = cupping_ref.get(transaction=transaction)
+                if not snapshot.exists:
+                    return None
+                
+                transaction.delete(cupping_ref)
+                get_user_summary_manager().apply_change(transaction, 'cuppings', snapshot.to_dict(), None)
+                return snapshot.to_dict().get('user_id')
+            
+            get_cupping_analytics().invalidate(run_in_transaction(delete_with_summary))
+            get_cupping_search_index().remove(cupping_id)
+            get_cupping_similarity_index().remove(cupping_id)
             return True
             
         except Exception as e:
             st.error(f"Error deleting cupping: {e}")
             return False
     
-    def get_user_cuppings(self, user_id: str, limit: int = 50) -> List[Dict]:
+    def get_user_cuppings(self, user_id: str, limit: int = 50, projection: str = 'full') -> List[Dict]:
         """Get all cuppings for a specific user"""
         try:
             if not self.db:
@@ -101,6 +153,7 @@ class CuppingManager:
                     .order_by('created_at', direction='DESCENDING')
                     .limit(limit))
             
+            query = FirebaseManager.apply_projection(query, CUPPING_PROJECTIONS[projection])
             docs = query.stream()
             cuppings = []
             
@@ -114,7 +167,20 @@ class CuppingManager:
             st.error(f"Error getting user cuppings: {e}")
             return []
     
-    def get_public_cuppings(self, limit: int = 20) -> List[Dict]:
+    def get_user_cuppings_page(self, user_id: str, page_size: int = 5, page_token: Optional[str] = None, projection: str = 'full') -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a user's cuppings, newest first, plus the token for the next page"""
+        try:
+            if not self.db:
+                return [], None
+            
+            query = self.db.collection('cuppings').where('user_id', '==', user_id)
+            return FirebaseManager.get_page(query, 'created_at', page_size, page_token, CUPPING_PROJECTIONS[projection])
+            
+        except Exception as e:
+            st.error(f"Error getting cuppings: {e}")
+            return [], None
+    
+    def get_public_cuppings(self, limit: int = 20, projection: str = 'full') -> List[Dict]:
         """Get public cuppings from all users"""
         try:
             if not self.db:
@@ -126,6 +192,7 @@ class CuppingManager:
                     .order_by('created_at', direction='DESCENDING')
                     .limit(limit))
             
+            query = FirebaseManager.apply_projection(query, CUPPING_PROJECTIONS[projection])
             docs = query.stream()
             cuppings = []
             
@@ -140,50 +207,75 @@ class CuppingManager:
             return []
     
     def search_cuppings(self, user_id: str = None, coffee_name: str = None, 
-                       origin: str = None, roaster: str = None, limit: int = 50) -> List[Dict]:
+                       origin: str = None, roaster: str = None, limit: int = 50, projection: str = 'full',
+                       text: str = None, public_only: bool = False) -> List[Dict]:
         """Search cuppings with various filters"""
+        return self._run_search(user_id, coffee_name, origin, roaster, limit, projection, text, public_only)[0]
+    
+    def explain_search(self, user_id: str = None, coffee_name: str = None, 
+                       origin: str = None, roaster: str = None, limit: int = 50, projection: str = 'full',
+                       text: str = None, public_only: bool = False) -> Dict:
+        """Run a search and describe the plan it used and the documents it read"""
+        return self._run_search(user_id, coffee_name, origin, roaster, limit, projection, text, public_only)[1]
+    
+    def _run_search(self, user_id, coffee_name, origin, roaster, limit, projection, text, public_only) -> Tuple[List[Dict], Dict]:
         try:
             if not self.db:
-                return []
-            
-            cuppings_ref = self.db.collection('cuppings')
-            query = cuppings_ref
-            
-            # Apply filters
-            if user_id:
-                query = query.where('user_id', '==', user_id)
-            
-            if coffee_name:
-                query = query.where('coffee_name', '>=', coffee_name).where('coffee_name', '<=', coffee_name + '\uf8ff')
-            
-            if origin:
-                query = query.where('origin', '>=', origin).where('origin', '<=', origin + '\uf8ff')
-            
-            if roaster:
-                query = query.where('roaster', '>=', roaster).where('roaster', '<=', roaster + '\uf8ff')
+                return [], {}
             
-            # Order and limit
-            query = query.order_by('created_at', direction='DESCENDING').limit(limit)
+            # Keywords match any word of their field, ignoring case and accents; the planner picks
+            # between the token index and a Firestore stream filtered client-side
+            fields = {name: value for name, value in
+                      [('coffee_name', coffee_name), ('origin', origin), ('roaster', roaster)] if value}
+            planner = get_cupping_query_planner()
+            plan = planner.plan(user_id, public_only, text, fields, limit)
+            cuppings = planner.execute(plan, CUPPING_PROJECTIONS[projection])
+            return cuppings, plan.explain()
             
-            docs = query.stream()
-            cuppings = []
-            
-            for doc in docs:
-                cupping = doc.to_dict()
-                cuppings.append(cupping)
+        except Exception as e:
+            st.error(f"Error searching cuppings: {e}")
+            return [], {}
+    
+    def get_similar_cuppings(self, cupping: Dict, limit: int = 5, exclude_user_id: Optional[str] = None,
+                             projection: str = 'full') -> List[Dict]:
+        """Public cuppings whose scores and flavor notes are closest to a cupping, most similar first"""
+        try:
+            if not self.db:
+                return []
             
+            index = get_cupping_similarity_index()
+            fields = CUPPING_PROJECTIONS[projection]
+            fetched: Dict[str, Dict] = {}
+            while True:
+                distances = dict(index.similar(cupping, limit, exclude_user_id))
+                new_ids = [cupping_id for cupping_id in distances if cupping_id not in fetched]
+                for similar in FirebaseManager.get_documents(self.db, 'cuppings', new_ids, 'cupping_id',
+                                                             fields + ['is_public'] if fields else None):
+                    fetched[similar['cupping_id']] = similar
+                
+                # Deleted or made private on another replica since the index last refreshed: drop
+                # them from the index and search again, so the next neighbors fill their slots
+                stale = [cupping_id for cupping_id in new_ids if not fetched.get(cupping_id, {}).get('is_public')]
+                if not stale:
+                    break
+                for cupping_id in stale:
+                    fetched.pop(cupping_id, None)
+                    index.remove(cupping_id)
+            
+            cuppings = [fetched[cupping_id] for cupping_id in distances]
+            for similar in cuppings:
+                similar['distance'] = distances[similar['cupping_id']]
+                similar['similarity'] = index.similarity(similar['distance'])
             return cuppings
             
         except Exception as e:
-            st.error(f"Error searching cuppings: {e}")
+            st.error(f"Error finding similar cuppings: {e}")
             return []
     
     def get_cupping_stats(self, user_id: str) -> Dict:
         """Get cupping statistics for a user"""
         try:
-            cuppings = self.get_user_cuppings(user_id, limit=1000)  # Get more for stats
-            
-            if not cuppings:
+            if not self.db:
                 return {
                     'total_cuppings': 0,
                     'average_score': 0,
@@ -191,23 +283,28 @@ class CuppingManager:
                     'favorite_roaster': 'N/A'
                 }
             
-            total_cuppings = len(cuppings)
-            scores = [c.get('overall_score', 0) for c in cuppings if c.get('overall_score')]
-            average_score = sum(scores) / len(scores) if scores else 0
+            query = self.db.collection('cuppings').where('user_id', '==', user_id)
+            totals = FirebaseManager.aggregate(query, [
+                ('count', None, 'total_cuppings'),
+                ('avg', 'overall_score', 'average_score')
+            ])
             
-            # Most common origin
-            origins = [c.get('origin') for c in cuppings if c.get('origin')]
-            favorite_origin = max(set(origins), key=origins.count) if origins else 'N/A'
+            if not totals['total_cuppings']:
+                return {
+                    'total_cuppings': 0,
+                    'average_score': 0,
+                    'favorite_origin': 'N/A',
+                    'favorite_roaster': 'N/A'
+                }
             
-            # Most common roaster
-            roasters = [c.get('roaster') for c in cuppings if c.get('roaster')]
-            favorite_roaster = max(set(roasters), key=roasters.count) if roasters else 'N/A'
+            # Most common origin and roaster, from the histograms the user's summary document already keeps
+            summary_stats = get_user_summary_manager().get_dashboard_stats(user_id)['cupping_stats']
             
             return {
-                'total_cuppings': total_cuppings,
-                'average_score': round(average_score, 1),
-                'favorite_origin': favorite_origin,
-                'favorite_roaster': favorite_roaster
+                'total_cuppings': totals['total_cuppings'],
+                'average_score': round(totals['average_score'], 1),
+                'favorite_origin': summary_stats['favorite_origin'],
+                'favorite_roaster': summary_stats['favorite_roaster']
             }
             
         except Exception as e:
@@ -3,7 +3,7 @@ Legacy database module - now uses modular Firebase structure
 This module provides backward compatibility for existing code
 """
 import streamlit as st
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Tuple
 from firebase import get_firestore_db
 from cuppings import get_cupping_manager
 from coffee_shops import get_coffee_shop_manager
@@ -15,12 +15,16 @@ class UserDatabase:
     """Legacy UserDatabase class for backward compatibility"""
     
     def __init__(self):
-        self.db = get_firestore_db()
         self.cupping_manager = get_cupping_manager()
         self.coffee_shop_manager = get_coffee_shop_manager()
         self.coffee_bag_manager = get_coffee_bag_manager()
         self.invitation_manager = get_cupper_invitation_manager()
     
+    @property
+    def db(self):
+        """Firestore client, resolved on first use"""
+        return get_firestore_db()
+    
     # Legacy user methods - delegate to AuthManager (imported in main apps)
     def create_user(self, email: str, username: str, password_hash: str) -> bool:
         """Legacy method - use AuthManager.create_user instead"""
@@ -58,7 +62,7 @@ class UserDatabase:
         try:
             if not self.db:
                 return None
-                
+            
             user_ref = self.db.collection('users').document(user_id)
             doc = user_ref.get()
             
@@ -84,10 +88,28 @@ class UserDatabase:
         """Get all cuppings for a user"""
         return self.cupping_manager.get_user_cuppings(user_id)
     
+    def get_user_cuppings_page(self, user_id: str, page_size: int = 5, page_token: Optional[str] = None,
+                               projection: str = 'full') -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a user's cuppings and the next page token"""
+        return self.cupping_manager.get_user_cuppings_page(user_id, page_size, page_token, projection)
+    
+    def get_cupping(self, cupping_id: str) -> Optional[Dict]:
+        """Get a single cupping document"""
+        return self.cupping_manager.get_cupping(cupping_id)
+    
     def get_public_cuppings(self, limit: int = 20) -> List[Dict]:
         """Get public cuppings"""
         return self.cupping_manager.get_public_cuppings(limit)
     
+    def search_cuppings(self, user_id: str = None, text: str = None, limit: int = 50, projection: str = 'full') -> List[Dict]:
+        """Keyword search over cupping names, origins and roasters, best matches first"""
+        return self.cupping_manager.search_cuppings(user_id=user_id, text=text, limit=limit, projection=projection)
+    
+    def get_similar_cuppings(self, cupping: Dict, limit: int = 5, exclude_user_id: Optional[str] = None,
+                             projection: str = 'full') -> List[Dict]:
+        """Public cuppings closest to a cupping's scores and flavor notes"""
+        return self.cupping_manager.get_similar_cuppings(cupping, limit, exclude_user_id, projection)
+    
     def update_cupping(self, cupping_id: str, update_data: Dict) -> bool:
         """Update a cupping record"""
         return self.cupping_manager.update_cupping(cupping_id, update_data)
@@ -1,13 +1,55 @@
 """
 Firebase initialization and helper functions
+
+The Firestore client is created on first use rather than at import, so pages
+that never touch the database (e.g. the login form) render without importing
+firebase_admin or opening a channel.
 """
-import firebase_admin
-from firebase_admin import credentials, firestore, storage
 import streamlit as st
-from typing import Optional, Tuple
-from datetime import datetime
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+from collections import Counter
+from datetime import datetime, timezone
+import threading
+import time
 import uuid
 import io
+import os
+import base64
+import json
+from instrumentation import instrument_client, unwrap, run_instrumented_transaction, get_profiler
+
+if TYPE_CHECKING:
+    from firebase_admin import firestore
+
+
+# Maximum number of writes Firestore accepts in a single batch commit
+FIRESTORE_BATCH_LIMIT = 500
+
+# Firestore caps the number of values in an 'in' filter
+FIRESTORE_IN_QUERY_LIMIT = 30
+
+# How long a connectivity probe result is reused before probing again
+HEALTH_CHECK_TTL_SECONDS = 30
+
+# Supported FIRESTORE_BACKEND values
+FIREBASE_BACKEND = 'firebase'
+MEMORY_BACKEND = 'memory'
+
+
+# Starting point of refresh watermarks, before anything has been loaded
+EARLIEST_TIMESTAMP = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def get_config_value(name: str, default=None):
+    """Read a setting from the environment, falling back to st.secrets"""
+    value = os.environ.get(name)
+    if value:
+        return value
+    try:
+        value = st.secrets.get(name)
+    except Exception:
+        value = None
+    return default if value is None else value
 
 
 class FirebaseManager:
@@ -15,18 +57,62 @@ class FirebaseManager:
     
     _instance = None
     _db = None
+    _bucket = None
+    _backend = None
+    _initialized = False
+    _init_lock = threading.Lock()
+    _health = None
+    _health_checked_at = 0.0
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
     
-    def __init__(self):
-        if self._db is None:
-            self._db = self._initialize_firestore()
+    def _ensure_initialized(self):
+        """Create the client on first use; later calls are a flag check"""
+        if self._initialized:
+            return
+        
+        with self._init_lock:
+            if not self._initialized:
+                if self._backend is None:
+                    self._backend = self._configured_backend()
+                self._db = instrument_client(self._initialize_backend())
+                self._initialized = True
+    
+    @staticmethod
+    def _configured_backend() -> str:
+        """Read FIRESTORE_BACKEND from the environment or st.secrets (defaults to firebase)"""
+        return (get_config_value('FIRESTORE_BACKEND') or FIREBASE_BACKEND).lower()
+    
+    def _initialize_backend(self):
+        """Create the database client for the selected backend"""
+        if self._backend == MEMORY_BACKEND:
+            from memory_firestore import MemoryClient, MemoryBucket
+            self._bucket = MemoryBucket()
+            return MemoryClient()
+        
+        if self._backend == FIREBASE_BACKEND:
+            self._bucket = None
+            return self._initialize_firestore()
+        
+        st.error(f"❌ Unknown FIRESTORE_BACKEND '{self._backend}' (expected '{FIREBASE_BACKEND}' or '{MEMORY_BACKEND}')")
+        return None
+    
+    def use_backend(self, backend: str):
+        """Switch to another backend, e.g. the in-memory store for benchmarks"""
+        with self._init_lock:
+            self._backend = backend.lower()
+            self._db = None
+            self._initialized = False
+            self._health = None
     
-    def _initialize_firestore(self) -> Optional[firestore.Client]:
+    def _initialize_firestore(self) -> Optional["firestore.Client"]:
         """Initialize Firestore connection using st.secrets"""
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+        
         if not firebase_admin._apps:
             try:
                 # Use st.secrets for Firebase credentials
@@ -59,15 +145,8 @@ class FirebaseManager:
                 cred = credentials.Certificate(firebase_config)
                 firebase_admin.initialize_app(cred)
                 
-                # Get Firestore client
-                db = firestore.client()
-                
-                # Test connection
-                test_ref = db.collection('_test').document('connection')
-                test_ref.set({'test': True, 'timestamp': firestore.SERVER_TIMESTAMP})
-                test_ref.delete()
-                
-                return db
+                # Get Firestore client (connectivity is probed lazily by check_health)
+                return firestore.client()
                 
             except Exception as e:
                 st.error(f"❌ Firebase initialization failed: {str(e)}")
@@ -76,24 +155,214 @@ class FirebaseManager:
         # If firebase_admin was already initialized, return the client
         return firestore.client()
     
-    def get_db(self) -> Optional[firestore.Client]:
-        """Get Firestore database client"""
+    def get_db(self) -> Optional["firestore.Client"]:
+        """Get Firestore database client, initializing it on first use"""
+        self._ensure_initialized()
         return self._db
     
+    def is_initialized(self) -> bool:
+        """Check whether the client has been created, without creating it"""
+        return self._initialized
+    
+    def check_health(self) -> bool:
+        """Read-only connectivity probe, cached for HEALTH_CHECK_TTL_SECONDS"""
+        now = time.monotonic()
+        if self._health is not None and now - self._health_checked_at < HEALTH_CHECK_TTL_SECONDS:
+            return self._health
+        
+        db = self.get_db()
+        healthy = False
+        if db is not None:
+            try:
+                db.collection('_test').document('connection').get()
+                healthy = True
+            except Exception:
+                healthy = False
+        
+        self._health = healthy
+        self._health_checked_at = now
+        return healthy
+    
     def is_connected(self) -> bool:
         """Check if Firebase is connected"""
-        return self._db is not None
+        return self.check_health()
+    
+    def get_backend(self) -> Optional[str]:
+        """Get the active backend name"""
+        return self._backend
+    
+    def get_bucket(self):
+        """Get the storage bucket for the active backend"""
+        if self.get_db() is None:
+            return None
+        
+        if self._backend == MEMORY_BACKEND:
+            return self._bucket
+        
+        from firebase_admin import storage
+        return storage.bucket()
+    
+    def run_transaction(self, callback, *args):
+        """Run callback(transaction, *args) in a transaction on the active backend"""
+        db = unwrap(self.get_db())
+        
+        def run(instrumented_callback, *run_args):
+            if self._backend == MEMORY_BACKEND:
+                return db.run_transaction(instrumented_callback, *run_args)
+            
+            from firebase_admin import firestore
+            return firestore.transactional(instrumented_callback)(db.transaction(), *run_args)
+        
+        return run_instrumented_transaction(run, callback, *args)
     
     @staticmethod
     def server_timestamp():
         """Get server timestamp"""
+        from firebase_admin import firestore
         return firestore.SERVER_TIMESTAMP
     
+    @staticmethod
+    def increment(amount):
+        """Get a numeric increment transform"""
+        from firebase_admin import firestore
+        return firestore.Increment(amount)
+    
+    @staticmethod
+    def delete_field():
+        """Get the sentinel that deletes a field"""
+        from firebase_admin import firestore
+        return firestore.DELETE_FIELD
+    
+    @staticmethod
+    def field_path(*parts: str) -> str:
+        """Build a dotted field path, quoting segments such as user ids that need it"""
+        from google.cloud.firestore_v1.field_path import FieldPath
+        return FieldPath(*parts).to_api_repr()
+    
+    @staticmethod
+    def is_not_found(error: Exception) -> bool:
+        """Whether an error means the target document does not exist"""
+        from google.api_core.exceptions import NotFound
+        return isinstance(error, NotFound)
+    
+    @staticmethod
+    def aggregate(query, aggregations: List[Tuple[str, Optional[str], str]]) -> Dict:
+        """Run (kind, field, alias) count/sum/avg aggregations server-side in one request"""
+        aggregation_query = query
+        for kind, field, alias in aggregations:
+            if kind == 'count':
+                aggregation_query = aggregation_query.count(alias=alias)
+            else:
+                aggregation_query = getattr(aggregation_query, kind)(field, alias=alias)
+        
+        values = {alias: 0 for _, _, alias in aggregations}
+        for result in aggregation_query.get():
+            for aggregation in result:
+                # avg over no matching documents comes back as None
+                values[aggregation.alias] = aggregation.value or 0
+        return values
+    
+    @staticmethod
+    def value_counts(query, fields: List[str]) -> Dict[str, Counter]:
+        """Count the values of each field, streaming only those fields"""
+        # Firestore has no group-by aggregation, so histograms are built client-side: one billed
+        # read per matching document. Per-user histograms live in userSummaries; use those instead
+        # where they exist
+        counters = {field: Counter() for field in fields}
+        for doc in query.select(fields).stream():
+            data = doc.to_dict()
+            for field in fields:
+                if data.get(field):
+                    counters[field][data[field]] += 1
+        return counters
+    
+    @staticmethod
+    def most_common(counter: Counter) -> str:
+        """Most frequent value in a counter, or 'N/A' when empty"""
+        return counter.most_common(1)[0][0] if counter else 'N/A'
+    
+    @staticmethod
+    def apply_projection(query, fields: Optional[List[str]]):
+        """Restrict a query to the given fields; None keeps whole documents"""
+        return query.select(fields) if fields else query
+    
+    @staticmethod
+    def encode_page_token(cursor: Dict) -> str:
+        """Encode cursor field values as an opaque, URL-safe page token"""
+        def encode_value(value):
+            if isinstance(value, datetime):
+                return {'__datetime__': value.isoformat()}
+            return value
+        
+        payload = json.dumps({key: encode_value(value) for key, value in cursor.items()})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+    
+    @staticmethod
+    def decode_page_token(page_token: str) -> Dict:
+        """Decode a page token produced by encode_page_token"""
+        def decode_value(value):
+            if isinstance(value, dict) and '__datetime__' in value:
+                return datetime.fromisoformat(value['__datetime__'])
+            return value
+        
+        payload = json.loads(base64.urlsafe_b64decode(page_token.encode()))
+        return {key: decode_value(value) for key, value in payload.items()}
+    
+    @staticmethod
+    def get_page(query, order_field: str, page_size: int, page_token: Optional[str] = None,
+                 fields: Optional[List[str]] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Fetch one page ordered newest first; returns (items, token for the next page or None)"""
+        # The cursor is built from the order field, so a projection must include it
+        if fields and order_field not in fields:
+            fields = fields + [order_field]
+        query = FirebaseManager.apply_projection(query, fields)
+        
+        # Document id breaks ties so equal timestamps never skip or repeat items across pages
+        query = (query
+                .order_by(order_field, direction='DESCENDING')
+                .order_by('__name__', direction='DESCENDING'))
+        if page_token:
+            query = query.start_after(FirebaseManager.decode_page_token(page_token))
+        
+        # One extra document tells us whether another page exists
+        docs = list(query.limit(page_size + 1).stream())
+        items = [doc.to_dict() for doc in docs[:page_size]]
+        
+        next_page_token = None
+        if len(docs) > page_size:
+            last = docs[page_size - 1]
+            next_page_token = FirebaseManager.encode_page_token({
+                order_field: last.to_dict().get(order_field),
+                '__name__': last.id
+            })
+        return items, next_page_token
+    
+    @staticmethod
+    def get_documents(db, collection: str, document_ids: List[str], id_field: str,
+                      fields: Optional[List[str]] = None) -> List[Dict]:
+        """Read documents by id in one round trip, in the given order, skipping any that no longer exist"""
+        if not document_ids:
+            return []
+        refs = [db.collection(collection).document(document_id) for document_id in document_ids]
+        docs = {doc.id: doc.to_dict() for doc in db.get_all(refs, field_paths=fields) if doc.exists}
+        return [{id_field: document_id, **docs[document_id]} for document_id in document_ids if document_id in docs]
+    
     @staticmethod
     def datetime_to_firestore(dt: datetime):
         """Convert datetime to Firestore timestamp"""
         return dt
     
+    @staticmethod
+    def to_utc(timestamp) -> Optional[datetime]:
+        """A Firestore timestamp as a UTC-aware datetime, safe to send back as a query bound"""
+        # firestore_to_datetime() gives naive local time, which the client would send as UTC and
+        # shift by the host's offset; naive values are stored as UTC, so they are read that way here
+        if not isinstance(timestamp, datetime):
+            return None
+        if timestamp.tzinfo is None:
+            return timestamp.replace(tzinfo=timezone.utc)
+        return timestamp.astimezone(timezone.utc)
+    
     @staticmethod
     def firestore_to_datetime(timestamp):
         """Convert Firestore timestamp to datetime"""
@@ -104,7 +373,8 @@ class FirebaseManager:
     def upload_image(self, image_file, folder: str = "coffee_shop_photos") -> Tuple[bool, Optional[str]]:
         """Upload image to Firebase Storage and return public URL"""
         try:
-            if not firebase_admin._apps:
+            bucket = self.get_bucket()
+            if bucket is None:
                 st.error("❌ Firebase not initialized")
                 return False, None
             
@@ -112,9 +382,6 @@ class FirebaseManager:
             file_extension = image_file.name.split('.')[-1] if '.' in image_file.name else 'jpg'
             unique_filename = f"{folder}/{uuid.uuid4()}.{file_extension}"
             
-            # Get storage bucket
-            bucket = storage.bucket()
-            
             # Create blob and upload
             blob = bucket.blob(unique_filename)
             
@@ -124,7 +391,8 @@ class FirebaseManager:
             
             # Upload with appropriate content type
             content_type = f"image/{file_extension.lower()}"
-            blob.upload_from_string(image_bytes, content_type=content_type)
+            with get_profiler().timed('upload', 'storage', 1, len(image_bytes)):
+                blob.upload_from_string(image_bytes, content_type=content_type)
             
             # Make blob publicly accessible
             blob.make_public()
@@ -140,7 +408,8 @@ class FirebaseManager:
     def delete_image(self, image_url: str) -> bool:
         """Delete image from Firebase Storage using its URL"""
         try:
-            if not firebase_admin._apps:
+            bucket = self.get_bucket()
+            if bucket is None:
                 return False
             
             # Extract blob name from URL
@@ -151,9 +420,9 @@ class FirebaseManager:
                 if len(parts) >= 4:
                     blob_name = '/'.join(parts[4:])  # Everything after bucket name
                     
-                    bucket = storage.bucket()
                     blob = bucket.blob(blob_name)
-                    blob.delete()
+                    with get_profiler().timed('delete', 'storage', 1):
+                        blob.delete()
                     return True
             
             return False
@@ -167,7 +436,7 @@ class FirebaseManager:
 firebase_manager = FirebaseManager()
 
 
-def get_firestore_db() -> Optional[firestore.Client]:
+def get_firestore_db() -> Optional["firestore.Client"]:
     """Get Firestore database client"""
     return firebase_manager.get_db()
 
@@ -177,6 +446,11 @@ def is_firebase_connected() -> bool:
     return firebase_manager.is_connected()
 
 
+def run_in_transaction(callback, *args):
+    """Run callback(transaction, *args) atomically on the active backend"""
+    return firebase_manager.run_transaction(callback, *args)
+
+
 def upload_image_to_storage(image_file, folder: str = "coffee_shop_photos") -> Tuple[bool, Optional[str]]:
     """Upload image to Firebase Storage and return success status and public URL"""
     return firebase_manager.upload_image(image_file, folder)
@@ -0,0 +1,183 @@
+"""
+Bloom filter of registered usernames and emails for live availability checks
+
+A miss in the filter means the name is definitely not registered (as of the
+last refresh), so the registration form can say "available" without a
+database read. A hit may be a false positive and is confirmed with a lookup.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+from firebase import get_firestore_db, get_config_value, FirebaseManager, EARLIEST_TIMESTAMP
+
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+DEFAULT_REFRESH_SECONDS = 300
+
+# Smallest number of entries a filter is sized for
+MIN_CAPACITY = 10000
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings using double hashing"""
+    
+    def __init__(self, capacity: int, false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.target_rate = false_positive_rate
+        # Optimal bit count and hash count for the target rate at full capacity
+        self.size = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+    
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+    
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+    
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+    
+    def false_positive_rate(self) -> float:
+        """Expected false-positive rate at the current number of entries"""
+        return (1 - math.exp(-self.hash_count * self.count / self.size)) ** self.hash_count
+    
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.bits)
+
+
+class IdentityFilter:
+    """Bloom filter of usernames and lower-cased emails, refreshed from new users"""
+    
+    def __init__(self, false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE,
+                 refresh_seconds: float = DEFAULT_REFRESH_SECONDS):
+        self.false_positive_rate = false_positive_rate
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._filter: Optional[BloomFilter] = None
+        self._loaded_through: Optional[datetime] = None
+        self._refreshed_at = 0.0
+        self._counters = {'checks': 0, 'definitely_available': 0, 'possible_hits': 0, 'false_positives': 0}
+    
+    @staticmethod
+    def _username_key(username: str) -> str:
+        return f"u:{username}"
+    
+    @staticmethod
+    def _email_key(email: str) -> str:
+        return f"e:{email.strip().lower()}"
+    
+    def add_user(self, username: Optional[str], email: Optional[str]):
+        """Record a newly registered user"""
+        with self._lock:
+            if self._filter is None:
+                return
+            if username:
+                self._filter.add(self._username_key(username))
+            if email:
+                self._filter.add(self._email_key(email))
+    
+    def might_have_username(self, username: str) -> bool:
+        """False means the username is definitely not registered"""
+        return self._might_contain(self._username_key(username))
+    
+    def might_have_email(self, email: str) -> bool:
+        """False means the email is definitely not registered"""
+        return self._might_contain(self._email_key(email))
+    
+    def _might_contain(self, key: str) -> bool:
+        self._ensure_fresh()
+        with self._lock:
+            self._counters['checks'] += 1
+            # Without a loaded filter nothing can be ruled out
+            hit = self._filter is None or key in self._filter
+            self._counters['possible_hits' if hit else 'definitely_available'] += 1
+            return hit
+    
+    def record_false_positive(self):
+        """Count a possible hit that the database showed to be free"""
+        with self._lock:
+            self._counters['false_positives'] += 1
+    
+    def _ensure_fresh(self):
+        if time.monotonic() - self._refreshed_at > self.refresh_seconds:
+            try:
+                self.refresh()
+            except Exception:
+                # A stale filter still answers; try again at the next interval
+                self._refreshed_at = time.monotonic()
+    
+    def refresh(self) -> int:
+        """Add users created since the last refresh, rebuilding when the filter is full"""
+        db = get_firestore_db()
+        if not db:
+            return 0
+        
+        rebuild = self._filter is None or self._filter.count >= self._filter.capacity
+        query = db.collection('users')
+        if not rebuild:
+            # Inclusive so users sharing the last timestamp are not skipped
+            query = query.where('created_at', '>=', self._loaded_through)
+        query = FirebaseManager.apply_projection(query, ['username', 'email', 'created_at'])
+        rows = [doc.to_dict() for doc in query.stream()]
+        
+        with self._lock:
+            if rebuild:
+                # Two entries per user, with room for the user base to double
+                capacity = max(MIN_CAPACITY, 4 * len(rows))
+                self._filter = BloomFilter(capacity, self.false_positive_rate)
+                self._loaded_through = EARLIEST_TIMESTAMP
+            for row in rows:
+                if row.get('username'):
+                    self._filter.add(self._username_key(row['username']))
+                if row.get('email'):
+                    self._filter.add(self._email_key(row['email']))
+                created_at = FirebaseManager.to_utc(row.get('created_at'))
+                if created_at:
+                    # Kept in UTC: it goes back to Firestore as the next query's bound
+                    self._loaded_through = max(self._loaded_through, created_at)
+            self._refreshed_at = time.monotonic()
+        return len(rows)
+    
+    def stats(self) -> Dict:
+        """Filter size, memory footprint, expected and observed false-positive rates"""
+        with self._lock:
+            bloom = self._filter
+            # Names shown to be free either way: filter misses plus confirmed false positives
+            free = self._counters['definitely_available'] + self._counters['false_positives']
+            return {
+                'entries': bloom.count if bloom else 0,
+                'capacity': bloom.capacity if bloom else 0,
+                'memory_bytes': bloom.memory_bytes if bloom else 0,
+                'hash_count': bloom.hash_count if bloom else 0,
+                'expected_false_positive_rate': round(bloom.false_positive_rate(), 6) if bloom else 0,
+                **self._counters,
+                'observed_false_positive_rate': round(self._counters['false_positives'] / free, 6) if free else 0
+            }
+
+
+_identity_filter = None
+_identity_filter_lock = threading.Lock()
+
+
+def get_identity_filter() -> IdentityFilter:
+    """Get the process-wide identity filter (IDENTITY_FILTER_FP_RATE, IDENTITY_FILTER_REFRESH_SECONDS)"""
+    global _identity_filter
+    if _identity_filter is None:
+        with _identity_filter_lock:
+            if _identity_filter is None:
+                _identity_filter = IdentityFilter(
+                    float(get_config_value('IDENTITY_FILTER_FP_RATE', DEFAULT_FALSE_POSITIVE_RATE)),
+                    float(get_config_value('IDENTITY_FILTER_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS))
+                )
+    return _identity_filter
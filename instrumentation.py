@@ -0,0 +1,552 @@
+"""
+Firestore instrumentation: per-operation latency, document and byte counters
+
+The client returned by get_firestore_db() is wrapped in thin proxies that time
+every network-bound call (query streams, document reads and writes, batch and
+transaction commits, aggregations). Stats are kept per process and per
+Streamlit rerun, and can be exported as JSON or Prometheus text.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# Latency samples kept per (operation, collection) for percentile estimates
+LATENCY_SAMPLE_SIZE = 1000
+
+# Rerun totals kept per page for per-page budgets
+RERUN_SAMPLE_SIZE = 500
+
+
+def estimate_size(value) -> int:
+    """Approximate Firestore storage size of a value in bytes"""
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 1
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(key).encode('utf-8')) + 1 + estimate_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(item) for item in value)
+    # Transform sentinels, references and geo points
+    return 16
+
+
+def _snapshot_size(snapshot) -> int:
+    """Size of a document snapshot's data without copying it"""
+    data = getattr(snapshot, '_data', None)
+    return estimate_size(data) if data else 0
+
+
+def _percentile(samples, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class OperationStats:
+    """Counters for one (operation, collection) pair"""
+    
+    __slots__ = ('calls', 'errors', 'documents', 'bytes', 'latency_total', 'latencies')
+    
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.documents = 0
+        self.bytes = 0
+        self.latency_total = 0.0
+        self.latencies = deque(maxlen=LATENCY_SAMPLE_SIZE)
+    
+    def add(self, latency: float, documents: int, size: int, error: bool):
+        self.calls += 1
+        self.errors += int(error)
+        self.documents += documents
+        self.bytes += size
+        self.latency_total += latency
+        self.latencies.append(latency)
+    
+    def to_dict(self) -> Dict:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'documents': self.documents,
+            'bytes': self.bytes,
+            'latency_total_ms': round(self.latency_total * 1000, 3),
+            'latency_p50_ms': round(_percentile(self.latencies, 0.5) * 1000, 3),
+            'latency_p95_ms': round(_percentile(self.latencies, 0.95) * 1000, 3),
+        }
+
+
+# Operations that read documents, for read-cost totals
+READ_OPERATIONS = {'get', 'stream', 'aggregate', 'transaction_get'}
+
+
+class FirestoreProfiler:
+    """Collect Firestore call stats per process and per Streamlit rerun"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._process: Dict[Tuple[str, str], OperationStats] = {}
+        self._pages: Dict[str, Dict[str, deque]] = {}
+        # Streamlit runs each session's script in its own thread
+        self._local = threading.local()
+    
+    def record(self, operation: str, collection: str, latency: float, documents: int = 0,
+               size: int = 0, error: bool = False):
+        """Record one Firestore call"""
+        key = (operation, collection)
+        with self._lock:
+            self._process.setdefault(key, OperationStats()).add(latency, documents, size, error)
+        
+        rerun = getattr(self._local, 'rerun', None)
+        if rerun is not None:
+            rerun.setdefault(key, OperationStats()).add(latency, documents, size, error)
+    
+    @contextmanager
+    def timed(self, operation: str, collection: str, documents: int = 0, size: int = 0):
+        """Time a block as one call"""
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.record(operation, collection, time.perf_counter() - start, documents, size, error)
+    
+    def start_rerun(self):
+        """Begin collecting stats for the current rerun on this thread"""
+        self._local.rerun = {}
+    
+    def finish_rerun(self, page: str):
+        """Fold the current rerun's totals into the per-page history"""
+        rerun = getattr(self._local, 'rerun', None)
+        if rerun is None:
+            return
+        
+        totals = self._totals(rerun)
+        with self._lock:
+            history = self._pages.setdefault(page, {
+                'reads': deque(maxlen=RERUN_SAMPLE_SIZE),
+                'writes': deque(maxlen=RERUN_SAMPLE_SIZE),
+                'latency': deque(maxlen=RERUN_SAMPLE_SIZE)
+            })
+            history['reads'].append(totals['reads'])
+            history['writes'].append(totals['writes'])
+            history['latency'].append(totals['latency_ms'])
+        self._local.rerun = None
+    
+    @staticmethod
+    def _totals(stats: Dict[Tuple[str, str], OperationStats]) -> Dict:
+        reads = sum(s.documents for (op, _), s in stats.items() if op in READ_OPERATIONS)
+        writes = sum(s.documents for (op, _), s in stats.items() if op not in READ_OPERATIONS)
+        return {
+            'calls': sum(s.calls for s in stats.values()),
+            'reads': reads,
+            'writes': writes,
+            'bytes': sum(s.bytes for s in stats.values()),
+            'latency_ms': round(sum(s.latency_total for s in stats.values()) * 1000, 3)
+        }
+    
+    @staticmethod
+    def _operations(stats: Dict[Tuple[str, str], OperationStats]) -> List[Dict]:
+        return [
+            {'operation': op, 'collection': collection, **s.to_dict()}
+            for (op, collection), s in sorted(stats.items())
+        ]
+    
+    def rerun_stats(self) -> Dict:
+        """Stats for the rerun in progress on this thread"""
+        rerun = dict(getattr(self._local, 'rerun', None) or {})
+        return {'totals': self._totals(rerun), 'operations': self._operations(rerun)}
+    
+    def process_stats(self) -> Dict:
+        """Stats accumulated since process start or the last reset"""
+        with self._lock:
+            process = dict(self._process)
+            pages = {
+                page: {
+                    'reruns': len(history['reads']),
+                    'reads_p95': _percentile(history['reads'], 0.95),
+                    'writes_p95': _percentile(history['writes'], 0.95),
+                    'latency_p95_ms': _percentile(history['latency'], 0.95)
+                }
+                for page, history in self._pages.items()
+            }
+            return {'totals': self._totals(process), 'operations': self._operations(process), 'pages': pages}
+    
+    def reset(self):
+        """Clear process-wide stats"""
+        with self._lock:
+            self._process.clear()
+            self._pages.clear()
+    
+    def to_json(self) -> Dict:
+        """Process and current-rerun stats as a JSON-serializable dict"""
+        return {'process': self.process_stats(), 'rerun': self.rerun_stats()}
+    
+    def to_prometheus(self) -> str:
+        """Process stats in the Prometheus text exposition format"""
+        with self._lock:
+            process = sorted(self._process.items())
+            pages = {page: {name: list(samples) for name, samples in history.items()}
+                     for page, history in self._pages.items()}
+        
+        lines = []
+        
+        def metric(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+        
+        def labels(operation: str, collection: str, **extra) -> str:
+            pairs = {'operation': operation, 'collection': collection, **extra}
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs.items()) + '}'
+        
+        metric('firestore_operations_total', 'counter', 'Firestore calls')
+        for (op, collection), s in process:
+            lines.append(f"firestore_operations_total{labels(op, collection)} {s.calls}")
+        
+        metric('firestore_operation_errors_total', 'counter', 'Firestore calls that raised')
+        for (op, collection), s in process:
+            lines.append(f"firestore_operation_errors_total{labels(op, collection)} {s.errors}")
+        
+        metric('firestore_documents_total', 'counter', 'Documents read or written')
+        for (op, collection), s in process:
+            lines.append(f"firestore_documents_total{labels(op, collection)} {s.documents}")
+        
+        metric('firestore_bytes_total', 'counter', 'Approximate document bytes read or written')
+        for (op, collection), s in process:
+            lines.append(f"firestore_bytes_total{labels(op, collection)} {s.bytes}")
+        
+        metric('firestore_operation_latency_seconds', 'summary', 'Firestore call latency')
+        for (op, collection), s in process:
+            for quantile in (0.5, 0.95, 0.99):
+                value = _percentile(s.latencies, quantile)
+                lines.append(f"firestore_operation_latency_seconds{labels(op, collection, quantile=quantile)} {value:.6f}")
+            lines.append(f"firestore_operation_latency_seconds_sum{labels(op, collection)} {s.latency_total:.6f}")
+            lines.append(f"firestore_operation_latency_seconds_count{labels(op, collection)} {s.calls}")
+        
+        metric('firestore_page_reads_per_rerun', 'gauge', 'p95 documents read per rerun of a page')
+        for page, history in sorted(pages.items()):
+            lines.append(f'firestore_page_reads_per_rerun{{page="{page}",quantile="0.95"}} {_percentile(history["reads"], 0.95)}')
+        
+        metric('firestore_page_latency_seconds_per_rerun', 'gauge', 'p95 Firestore time per rerun of a page')
+        for page, history in sorted(pages.items()):
+            value = _percentile(history['latency'], 0.95) / 1000
+            lines.append(f'firestore_page_latency_seconds_per_rerun{{page="{page}",quantile="0.95"}} {value:.6f}')
+        
+        return '\n'.join(lines) + '\n'
+
+
+# Global profiler instance
+profiler = FirestoreProfiler()
+
+
+def get_profiler() -> FirestoreProfiler:
+    """Get the global Firestore profiler"""
+    return profiler
+
+
+def unwrap(value):
+    """The underlying client object behind an instrumentation proxy"""
+    return value._target if isinstance(value, _Proxy) else value
+
+
+def _unwrap_kwargs(kwargs: Dict) -> Dict:
+    """Pass the real transaction through when one is given as a keyword argument"""
+    if 'transaction' in kwargs:
+        kwargs['transaction'] = unwrap(kwargs['transaction'])
+    return kwargs
+
+
+class _Proxy:
+    """Forward everything to the wrapped object; subclasses time the calls that hit the network"""
+    
+    def __init__(self, target, collection: str):
+        self._target = target
+        self._collection = collection
+    
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+    
+    def __eq__(self, other):
+        return self._target == unwrap(other)
+    
+    def __hash__(self):
+        return hash(self._target)
+    
+    def __repr__(self):
+        return f"Instrumented({self._target!r})"
+
+
+class InstrumentedQuery(_Proxy):
+    """Query or collection whose reads are recorded"""
+    
+    def _wrap(self, query) -> 'InstrumentedQuery':
+        return InstrumentedQuery(query, self._collection)
+    
+    def where(self, *args, **kwargs):
+        return self._wrap(self._target.where(*args, **kwargs))
+    
+    def order_by(self, *args, **kwargs):
+        return self._wrap(self._target.order_by(*args, **kwargs))
+    
+    def limit(self, *args, **kwargs):
+        return self._wrap(self._target.limit(*args, **kwargs))
+    
+    def limit_to_last(self, *args, **kwargs):
+        return self._wrap(self._target.limit_to_last(*args, **kwargs))
+    
+    def offset(self, *args, **kwargs):
+        return self._wrap(self._target.offset(*args, **kwargs))
+    
+    def select(self, *args, **kwargs):
+        return self._wrap(self._target.select(*args, **kwargs))
+    
+    def start_at(self, cursor):
+        return self._wrap(self._target.start_at(unwrap(cursor)))
+    
+    def start_after(self, cursor):
+        return self._wrap(self._target.start_after(unwrap(cursor)))
+    
+    def end_at(self, cursor):
+        return self._wrap(self._target.end_at(unwrap(cursor)))
+    
+    def end_before(self, cursor):
+        return self._wrap(self._target.end_before(unwrap(cursor)))
+    
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._target.document(*args, **kwargs), self._collection)
+    
+    def count(self, *args, **kwargs):
+        return InstrumentedAggregation(self._target.count(*args, **kwargs), self._collection)
+    
+    def sum(self, *args, **kwargs):
+        return InstrumentedAggregation(self._target.sum(*args, **kwargs), self._collection)
+    
+    def avg(self, *args, **kwargs):
+        return InstrumentedAggregation(self._target.avg(*args, **kwargs), self._collection)
+    
+    def stream(self, *args, **kwargs):
+        """Stream results, timing only the time spent fetching them"""
+        iterator = iter(self._target.stream(*args, **_unwrap_kwargs(kwargs)))
+        elapsed = 0.0
+        documents = 0
+        size = 0
+        error = False
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    snapshot = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - start
+                documents += 1
+                size += _snapshot_size(snapshot)
+                yield snapshot
+        except Exception:
+            error = True
+            raise
+        finally:
+            profiler.record('stream', self._collection, elapsed, documents, size, error)
+    
+    def get(self, *args, **kwargs):
+        return list(self.stream(*args, **kwargs))
+
+
+class InstrumentedDocument(_Proxy):
+    """Document reference whose reads and writes are recorded"""
+    
+    def collection(self, collection_id: str):
+        return InstrumentedQuery(self._target.collection(collection_id), collection_id)
+    
+    def get(self, *args, **kwargs):
+        start = time.perf_counter()
+        error = False
+        snapshot = None
+        try:
+            snapshot = self._target.get(*args, **_unwrap_kwargs(kwargs))
+            return snapshot
+        except Exception:
+            error = True
+            raise
+        finally:
+            profiler.record('get', self._collection, time.perf_counter() - start, 1,
+                            _snapshot_size(snapshot) if snapshot is not None else 0, error)
+    
+    def _write(self, operation: str, method: str, payload, *args, **kwargs):
+        with profiler.timed(operation, self._collection, 1, estimate_size(payload)):
+            return getattr(self._target, method)(payload, *args, **kwargs)
+    
+    def set(self, document_data, *args, **kwargs):
+        return self._write('set', 'set', document_data, *args, **kwargs)
+    
+    def create(self, document_data, *args, **kwargs):
+        return self._write('create', 'create', document_data, *args, **kwargs)
+    
+    def update(self, field_updates, *args, **kwargs):
+        return self._write('update', 'update', field_updates, *args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with profiler.timed('delete', self._collection, 1):
+            return self._target.delete(*args, **kwargs)
+
+
+class InstrumentedAggregation(_Proxy):
+    """Aggregation query whose execution is recorded"""
+    
+    def count(self, *args, **kwargs):
+        return InstrumentedAggregation(self._target.count(*args, **kwargs), self._collection)
+    
+    def sum(self, *args, **kwargs):
+        return InstrumentedAggregation(self._target.sum(*args, **kwargs), self._collection)
+    
+    def avg(self, *args, **kwargs):
+        return InstrumentedAggregation(self._target.avg(*args, **kwargs), self._collection)
+    
+    def get(self, *args, **kwargs):
+        # Firestore bills an aggregation as one read per batch of up to 1000 index entries
+        with profiler.timed('aggregate', self._collection, 1):
+            return self._target.get(*args, **_unwrap_kwargs(kwargs))
+    
+    def stream(self, *args, **kwargs):
+        return iter(self.get(*args, **kwargs))
+
+
+def _collection_of(reference) -> str:
+    return reference._collection if isinstance(reference, _Proxy) else getattr(getattr(reference, 'parent', None), 'id', '?')
+
+
+class _StagedWrites(_Proxy):
+    """Shared bookkeeping for batches and transactions: staged writes per collection"""
+    
+    def __init__(self, target, collection: str = ''):
+        super().__init__(target, collection)
+        self._staged: Dict[str, int] = {}
+        self._staged_bytes = 0
+    
+    def _stage(self, method: str, reference, *args, **kwargs):
+        collection = _collection_of(reference)
+        self._staged[collection] = self._staged.get(collection, 0) + 1
+        if args:
+            self._staged_bytes += estimate_size(args[0])
+        getattr(self._target, method)(unwrap(reference), *args, **kwargs)
+        return self
+    
+    def set(self, reference, *args, **kwargs):
+        return self._stage('set', reference, *args, **kwargs)
+    
+    def create(self, reference, *args, **kwargs):
+        return self._stage('create', reference, *args, **kwargs)
+    
+    def update(self, reference, *args, **kwargs):
+        return self._stage('update', reference, *args, **kwargs)
+    
+    def delete(self, reference, *args, **kwargs):
+        return self._stage('delete', reference, *args, **kwargs)
+    
+    def _label(self) -> str:
+        return '+'.join(sorted(self._staged)) or '-'
+
+
+class InstrumentedBatch(_StagedWrites):
+    """Write batch whose commit is recorded with its staged writes"""
+    
+    def commit(self, *args, **kwargs):
+        with profiler.timed('commit', self._label(), sum(self._staged.values()), self._staged_bytes):
+            return self._target.commit(*args, **kwargs)
+
+
+class InstrumentedTransaction(_StagedWrites):
+    """Transaction whose reads are recorded; its commit is timed by run_transaction"""
+    
+    def get(self, reference, *args, **kwargs):
+        start = time.perf_counter()
+        error = False
+        result = None
+        try:
+            result = self._target.get(unwrap(reference), *args, **kwargs)
+            return result
+        except Exception:
+            error = True
+            raise
+        finally:
+            # Transactional query gets return a generator; only single-document reads are sized
+            size = _snapshot_size(result) if result is not None and hasattr(result, 'exists') else 0
+            profiler.record('transaction_get', _collection_of(reference), time.perf_counter() - start, 1, size, error)
+    
+    def staged(self) -> Tuple[str, int, int]:
+        """(collections label, staged write count, staged bytes)"""
+        return self._label(), sum(self._staged.values()), self._staged_bytes
+
+
+class InstrumentedClient(_Proxy):
+    """Firestore client whose collections, batches and transactions are instrumented"""
+    
+    def __init__(self, target):
+        super().__init__(target, '')
+    
+    def collection(self, collection_path: str):
+        return InstrumentedQuery(self._target.collection(collection_path), collection_path.split('/')[-1])
+    
+    def document(self, document_path: str):
+        collection = document_path.split('/')[-2] if '/' in document_path else '?'
+        return InstrumentedDocument(self._target.document(document_path), collection)
+    
+    def batch(self):
+        return InstrumentedBatch(self._target.batch())
+    
+    def get_all(self, references, *args, **kwargs):
+        """Read several documents in one round trip, recorded as one get per collection"""
+        references = list(references)
+        collection = getattr(references[0], '_collection', '?') if references else '?'
+        start = time.perf_counter()
+        error = False
+        snapshots = []
+        try:
+            snapshots = list(self._target.get_all([unwrap(ref) for ref in references], *args, **_unwrap_kwargs(kwargs)))
+            return snapshots
+        except Exception:
+            error = True
+            raise
+        finally:
+            profiler.record('get', collection, time.perf_counter() - start, len(snapshots),
+                            sum(_snapshot_size(snapshot) for snapshot in snapshots), error)
+
+
+def instrument_client(client):
+    """Wrap a Firestore (or in-memory) client so its calls are recorded"""
+    if client is None or isinstance(client, InstrumentedClient):
+        return client
+    return InstrumentedClient(client)
+
+
+def run_instrumented_transaction(run, callback, *args):
+    """Call run(wrapped_callback, *args), recording the whole transaction as one commit"""
+    attempts = []
+    
+    def instrumented_callback(transaction, *callback_args):
+        wrapped = InstrumentedTransaction(transaction)
+        attempts.append(wrapped)
+        return callback(wrapped, *callback_args)
+    
+    start = time.perf_counter()
+    error = False
+    try:
+        return run(instrumented_callback, *args)
+    except Exception:
+        error = True
+        raise
+    finally:
+        label, writes, size = attempts[-1].staged() if attempts else ('-', 0, 0)
+        profiler.record('transaction', label, time.perf_counter() - start, writes, size, error)
@@ -3,8 +3,19 @@ from auth import AuthManager
 from coffee_shops import get_coffee_shop_manager
 from coffee_bags import get_coffee_bag_manager
 from cupper_invitations import get_cupper_invitation_manager
-from firebase import upload_image_to_storage
+from user_summaries import get_user_summary_manager
+from firebase import upload_image_to_storage, get_config_value
+from instrumentation import get_profiler
+from rate_limiter import get_login_limiter
+from write_behind import get_write_behind_queue
+from username_index import get_username_index
+from identity_filter import get_identity_filter
+from quotas import get_quota_manager
+from cupping_analytics import get_cupping_analytics, SCORE_ATTRIBUTES
+from cupping_planner import get_cupping_query_planner
+from recommendations import get_recommendation_manager
 import datetime
+import json
 
 # Page configuration
 st.set_page_config(
@@ -149,8 +160,11 @@ def initialize_auth():
             st.stop()
 
 def main():
+    # Firestore calls made during this rerun are tallied for the profiling panel
+    get_profiler().start_rerun()
     initialize_auth()
     auth_manager = st.session_state.auth_manager
+    auth_manager.sync_session_cookie()
     
     # Main app header
     st.markdown("""
@@ -165,9 +179,81 @@ def main():
     """, unsafe_allow_html=True)
     
     if not auth_manager.is_authenticated():
+        page = 'login'
         show_auth_page(auth_manager)
     else:
+        page = 'app'
         show_main_app(auth_manager)
+    
+    if is_developer_mode():
+        show_profiling_panel()
+    
+    # Reruns interrupted by st.rerun() are not folded into the page history
+    get_profiler().finish_rerun(page)
+
+def is_developer_mode() -> bool:
+    """Whether DEVELOPER_MODE is enabled in the environment or st.secrets"""
+    return str(get_config_value('DEVELOPER_MODE', '')).lower() in ('1', 'true', 'yes')
+
+def show_profiling_panel():
+    """Show Firestore cost of this rerun and the process in the sidebar (developers only)"""
+    profiler = get_profiler()
+    
+    with st.sidebar:
+        with st.expander("🛠️ Firestore Profiling"):
+            rerun = profiler.rerun_stats()
+            totals = rerun['totals']
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Reads (this rerun)", totals['reads'])
+            with col2:
+                st.metric("Writes (this rerun)", totals['writes'])
+            st.caption(f"{totals['calls']} calls • {totals['latency_ms']:.1f} ms • ~{totals['bytes']:,} bytes")
+            
+            if rerun['operations']:
+                st.dataframe(rerun['operations'], use_container_width=True, hide_index=True)
+            
+            process = profiler.process_stats()
+            if process['pages']:
+                st.markdown("**Per page, p95 per rerun**")
+                st.dataframe([{'page': page, **stats} for page, stats in process['pages'].items()],
+                             use_container_width=True, hide_index=True)
+            
+            limiter = get_login_limiter()
+            logins = limiter.stats()
+            st.caption(f"Logins: {logins['allowed']} allowed • "
+                       f"{logins['rejected']['account']} throttled per account • "
+                       f"{logins['rejected']['client']} throttled per client")
+            
+            identity = get_identity_filter().stats()
+            st.caption(f"Identity filter: {identity['entries']:,} entries • {identity['memory_bytes'] / 1024:.1f} KiB • "
+                       f"expected FP {identity['expected_false_positive_rate']:.2%} • "
+                       f"observed FP {identity['observed_false_positive_rate']:.2%}")
+            
+            quotas = get_quota_manager().stats()
+            throttled = {operation: counts['throttled'] for operation, counts in quotas['operations'].items() if counts['throttled']}
+            st.caption("Write quotas: " + (", ".join(f"{operation} throttled {count}×" for operation, count in throttled.items())
+                                           if throttled else "nothing throttled"))
+            
+            write_behind = get_write_behind_queue()
+            queued = write_behind.stats()
+            st.caption(f"Write-behind: {queued['depth']} pending • {queued['written']} written • "
+                       f"{queued['coalesced']} coalesced • p95 flush {queued['p95_flush_ms']:.1f} ms")
+            
+            searches = get_cupping_query_planner().stats()
+            if searches['recent_plans']:
+                last_plan = searches['recent_plans'][-1]
+                st.caption(f"Last cupping search: {last_plan['access_path']} • {last_plan['documents_read']} read • "
+                           f"{last_plan['returned']} returned" + (" • stopped early" if last_plan['terminated_early'] else ""))
+            
+            export = {**profiler.to_json(), 'logins': logins, 'identity_filter': identity,
+                      'quotas': quotas, 'write_behind': queued, 'search_plans': searches}
+            st.download_button("📥 Export JSON", json.dumps(export, indent=2, default=str),
+                               file_name="firestore_profile.json", mime="application/json", use_container_width=True)
+            st.download_button("📥 Export Prometheus",
+                               profiler.to_prometheus() + limiter.to_prometheus() + write_behind.to_prometheus(),
+                               file_name="firestore_metrics.prom", mime="text/plain", use_container_width=True)
 
 def show_auth_page(auth_manager):
     """Show authentication page (login/register)"""
@@ -222,19 +308,30 @@ def show_register_form(auth_manager):
     st.markdown("### Join the Coffee Community!")
     st.markdown("Create your account to start cupping")
     
+    if st.session_state.pop('clear_register_fields', False):
+        for key in ("register_email", "register_username"):
+            st.session_state.pop(key, None)
+    
+    # Email and username sit outside the form so availability is checked as they are entered
+    email = st.text_input(
+        "Email Address",
+        placeholder="your@email.com",
+        help="We'll use this for account recovery",
+        key="register_email"
+    )
+    show_availability(email, auth_manager.is_valid_email, auth_manager.is_email_available,
+                      "Invalid email format", "Email already registered")
+    
+    username = st.text_input(
+        "Username",
+        placeholder="coffeeexpert",
+        help="3-20 characters, letters, numbers, and underscore only",
+        key="register_username"
+    )
+    show_availability(username, auth_manager.is_valid_username, auth_manager.is_username_available,
+                      "3-20 characters, letters, numbers, and underscore only", "Username already taken")
+    
     with st.form("register_form", clear_on_submit=True):
-        email = st.text_input(
-            "Email Address",
-            placeholder="your@email.com",
-            help="We'll use this for account recovery"
-        )
-        
-        username = st.text_input(
-            "Username",
-            placeholder="coffeeexpert",
-            help="3-20 characters, letters, numbers, and underscore only"
-        )
-        
         password = st.text_input(
             "Password",
             type="password",
@@ -261,6 +358,8 @@ def show_register_form(auth_manager):
                     success, message = auth_manager.register(email, username, password)
                 
                 if success:
+                    # Cleared at the start of the next run, before the inputs are drawn again
+                    st.session_state.clear_register_fields = True
                     st.success(f"🎉 {message}")
                     st.balloons()
                     st.info("👆 Now you can switch to the Login tab to sign in!")
@@ -270,6 +369,19 @@ def show_register_form(auth_manager):
                 else:
                     st.error(f"❌ {message}")
 
+def show_availability(value: str, is_valid, is_available, invalid_message: str, taken_message: str):
+    """Show whether a registration field is well-formed and still free"""
+    value = value.strip()
+    if not value:
+        return
+    
+    if not is_valid(value):
+        st.caption(f"⚠️ {invalid_message}")
+    elif is_available(value):
+        st.caption("✅ Available")
+    else:
+        st.caption(f"❌ {taken_message}")
+
 def show_main_app(auth_manager):
     """Show main application after authentication"""
     
@@ -325,6 +437,30 @@ def show_user_sidebar(auth_manager):
         auth_manager.logout()
         st.rerun()
 
+def get_loaded_pages(state_key: str, fetch_page) -> dict:
+    """Items loaded so far for a paged list, fetching the first page on first render"""
+    # Kept in session state so reruns re-read nothing until "load more" is clicked
+    if state_key not in st.session_state:
+        items, page_token = fetch_page(None)
+        st.session_state[state_key] = {'items': items, 'page_token': page_token}
+    return st.session_state[state_key]
+
+def show_load_more_button(state_key: str, fetch_page):
+    """Show a button that appends the next page to a paged list"""
+    loaded = st.session_state[state_key]
+    if loaded['page_token'] and st.button("⬇️ Load more", key=f"{state_key}_load_more"):
+        items, page_token = fetch_page(loaded['page_token'])
+        loaded['items'].extend(items)
+        loaded['page_token'] = page_token
+        st.rerun()
+
+def get_item_details(state_key: str, item_id: str, fetch_item) -> dict:
+    """Full document for an opened card, read once and kept with the loaded pages"""
+    details = st.session_state[state_key].setdefault('details', {})
+    if item_id not in details:
+        details[item_id] = fetch_item(item_id)
+    return details[item_id]
+
 def show_dashboard(auth_manager):
     """Show main dashboard"""
     st.markdown("### 📊 Dashboard")
@@ -334,23 +470,17 @@ def show_dashboard(auth_manager):
         user_id = current_user['user_id']
         user_email = current_user['email']
         
-        # Check for pending invitations first
-        invitation_manager = get_cupper_invitation_manager()
-        pending_invitations = invitation_manager.get_user_invitations(user_id)
+        # All dashboard numbers come from a single summary document read
+        dashboard_stats = get_user_summary_manager().get_dashboard_stats(user_id)
+        pending_invitations = dashboard_stats['pending_invitations']
         
         # Show invitation alert if there are pending invitations
         if pending_invitations:
-            st.warning(f"🔔 You have {len(pending_invitations)} pending cupping invitation(s)! Check the 'Collaborative' tab to respond.")
-        
-        cupping_stats = st.session_state.db_manager.get_cupping_stats(user_id)
-        
-        # Get coffee shop review stats
-        coffee_shop_manager = get_coffee_shop_manager()
-        review_stats = coffee_shop_manager.get_user_review_stats(user_id)
+            st.warning(f"🔔 You have {pending_invitations} pending cupping invitation(s)! Check the 'Collaborative' tab to respond.")
         
-        # Get coffee bag stats
-        coffee_bag_manager = get_coffee_bag_manager()
-        bag_stats = coffee_bag_manager.get_user_bag_stats(user_id)
+        cupping_stats = dashboard_stats['cupping_stats']
+        review_stats = dashboard_stats['review_stats']
+        bag_stats = dashboard_stats['bag_stats']
         
         # Display metrics in two rows
         st.markdown("#### ☕ Coffee Cupping Stats")
@@ -393,6 +523,16 @@ def show_dashboard(auth_manager):
             total_spent = bag_stats['total_spent']
             st.metric("Total Spent", f"${total_spent}" if total_spent > 0 else "$0")
         
+        # Recommendations are precomputed offline and stored in one document per user
+        recommendations = get_recommendation_manager().get_recommendations(user_id)
+        if recommendations and recommendations.get('items'):
+            st.markdown("#### ✨ Recommended for You")
+            st.caption("Coffees liked by cuppers who rate like you")
+            for item in recommendations['items']:
+                where = f" · {item['detail']}" if item.get('detail') else ''
+                icon = '🏪' if item.get('kind') == 'shop' else '☕'
+                st.write(f"{icon} **{item['name']}**{where}")
+        
         # Show encouraging messages
         total_activities = cupping_stats['total_cuppings'] + review_stats['total_reviews'] + bag_stats['total_bags']
         if total_activities == 0:
@@ -410,13 +550,31 @@ def show_my_cuppings(auth_manager):
     if current_user:
         user_id = current_user['user_id']
         
-        # Show existing cuppings
-        cuppings = st.session_state.db_manager.get_user_cuppings(user_id)
+        # Show existing cuppings, one page at a time
+        state_key = f"my_cuppings_{user_id}"
+        fetch_page = lambda page_token: st.session_state.db_manager.get_user_cuppings_page(user_id, page_token=page_token, projection='card')
+        cuppings = get_loaded_pages(state_key, fetch_page)['items']
         
         if cuppings:
-            st.markdown(f"#### Your Recent Cuppings ({len(cuppings)})")
-            for cupping in cuppings[:5]:  # Show last 5 cuppings
-                with st.expander(f"☕ {cupping.get('coffee_name', 'Unknown')} - {cupping.get('origin', 'Unknown Origin')}"):
+            total_cuppings = get_user_summary_manager().get_dashboard_stats(user_id)['cupping_stats']['total_cuppings']
+            st.markdown(f"#### Your Recent Cuppings ({total_cuppings})")
+            
+            # Matches any word of name, origin or roaster, ignoring case and accents
+            search = st.text_input("🔎 Search your cuppings", placeholder="Coffee, origin or roaster, e.g. narino gesha",
+                                   key=f"my_cuppings_search_{user_id}").strip()
+            if search:
+                cuppings = st.session_state.db_manager.search_cuppings(user_id=user_id, text=search, projection='card')
+                if not cuppings:
+                    st.info("No cuppings match your search.")
+            
+            for cupping in cuppings:
+                # Cards are listed from a projection; the full cupping is read when one is opened
+                card = st.expander(f"☕ {cupping.get('coffee_name', 'Unknown')} - {cupping.get('origin', 'Unknown Origin')}",
+                                   key=f"cupping_card_{cupping['cupping_id']}", on_change="rerun")
+                if not card.open:
+                    continue
+                cupping = get_item_details(state_key, cupping['cupping_id'], st.session_state.db_manager.get_cupping) or cupping
+                with card:
                     col1, col2 = st.columns(2)
                     with col1:
                         st.write(f"**Roaster:** {cupping.get('roaster', 'N/A')}")
@@ -436,6 +594,18 @@ def show_my_cuppings(auth_manager):
                     created_at = cupping.get('created_at')
                     if created_at:
                         st.caption(f"Created: {created_at.strftime('%Y-%m-%d %H:%M') if hasattr(created_at, 'strftime') else str(created_at)}")
+                    
+                    if st.toggle("🔍 Coffees like this one", key=f"similar_{cupping['cupping_id']}"):
+                        show_similar_cuppings(cupping, user_id)
+            
+            if not search:
+                show_load_more_button(state_key, fetch_page)
+            
+            # Analytics load the whole history, so only when the section is opened
+            analytics = st.expander("📈 Cupping Analytics", key=f"cupping_analytics_{user_id}", on_change="rerun")
+            if analytics.open:
+                with analytics:
+                    show_cupping_analytics(user_id)
         
         st.markdown("#### Add New Cupping")
     
@@ -490,6 +660,7 @@ def show_my_cuppings(auth_manager):
                     current_user = auth_manager.get_current_user()
                     user_id = current_user['user_id'] if current_user else None
                     if user_id and st.session_state.db_manager.add_cupping(cupping_data, user_id):
+                        st.session_state.pop(f"my_cuppings_{user_id}", None)
                         st.success("🎉 Cupping saved successfully!")
                         st.balloons()
                     else:
@@ -497,6 +668,46 @@ def show_my_cuppings(auth_manager):
             else:
                 st.error("❌ Please fill in required fields")
 
+def show_similar_cuppings(cupping: dict, user_id: str):
+    """Show other cuppers' public cuppings with the closest scores and flavor notes"""
+    similar = st.session_state.db_manager.get_similar_cuppings(cupping, exclude_user_id=user_id, projection='card')
+    if not similar:
+        st.info("No similar public cuppings from other cuppers yet.")
+        return
+    for match in similar:
+        st.write(f"☕ **{match.get('coffee_name', 'Unknown')}** - {match.get('origin', 'Unknown Origin')} • "
+                 f"{match.get('overall_score', 0)}/100 • {match['similarity']:.0f}% match")
+
+def show_cupping_analytics(user_id: str):
+    """Show score averages, percentiles, trend and distributions for a user's cuppings"""
+    summary = get_cupping_analytics().get_summary(user_id)
+    if not summary or not summary['total_cuppings']:
+        st.info("Record a few cuppings to see your analytics")
+        return
+    
+    labels = {attribute: attribute.replace('_', ' ').title() for attribute in SCORE_ATTRIBUTES}
+    columns = st.columns(len(SCORE_ATTRIBUTES))
+    for column, (attribute, mean) in zip(columns, summary['means'].items()):
+        with column:
+            st.metric(f"Avg {labels[attribute]}", f"{mean:.1f}")
+    st.caption(f"{summary['total_cuppings']} cuppings • favorite origin: {summary['favorite_origin']} • "
+               f"favorite roaster: {summary['favorite_roaster']}")
+    
+    st.markdown("**Percentiles**")
+    st.dataframe([{'attribute': labels[attribute], **{f"p{p}": value for p, value in values.items()}}
+                  for attribute, values in summary['percentiles'].items()],
+                 use_container_width=True, hide_index=True)
+    
+    trend = summary['trend']
+    if len(trend['values']) > 1:
+        st.markdown("**Overall score, rolling average of 10**")
+        st.line_chart({'Overall score': trend['values']})
+    
+    attribute = st.selectbox("Score distribution", list(SCORE_ATTRIBUTES), format_func=labels.get,
+                             key=f"cupping_distribution_{user_id}")
+    distribution = summary['distributions'][attribute]
+    st.bar_chart({'Cuppings': list(distribution.values())})
+
 def show_collaborative_cupping(auth_manager):
     """Show collaborative cupping section"""
     st.markdown("### 👥 Collaborative Cupping")
@@ -739,6 +950,17 @@ def show_send_invitation(invitation_manager, user_id: str, user_name: str):
     st.info("💡 Invited cuppers will see the invitation in THEIR own dashboard when they log in to the app. Each person evaluates from their own device/account.")
     st.markdown("Invite other coffee enthusiasts to join your cupping session!")
     
+    # Outside the form so suggestions update as the user types
+    username_index = get_username_index()
+    username_search = st.text_input("🔎 Find cuppers", placeholder="Start typing a username...",
+                                    key="invitee_username_search")
+    if len(username_search.strip()) >= 2:
+        matches = username_index.suggest(username_search)
+        if matches:
+            st.caption("Matching usernames: " + ", ".join(matches))
+        else:
+            st.caption("No usernames start with that")
+    
     with st.form("send_invitation_form"):
         # Session type selection
         st.markdown("##### Session Type")
@@ -882,6 +1104,14 @@ def show_send_invitation(invitation_manager, user_id: str, user_name: str):
                     st.error("❌ Please enter at least one valid username")
                     return
                 
+                # Suggest fixes for likely typos; the local index may lag other replicas, so
+                # create_invitation's lookup decides who actually exists
+                _, unknown_usernames = username_index.partition(username_list)
+                for username in unknown_usernames:
+                    suggestions = username_index.did_you_mean(username)
+                    if suggestions:
+                        st.info(f"💡 '{username}' is not a username we know yet. Did you mean: {', '.join(suggestions)}?")
+                
                 with st.spinner("Sending invitations..."):
                     invitation_id = invitation_manager.create_invitation(session_data, user_id, user_name, username_list)
                     
@@ -906,11 +1136,12 @@ def show_collaborative_sessions(invitation_manager, user_id: str, user_id_param:
     st.markdown("#### 📊 My Collaborative Sessions")
     
     # Show sent invitations and their status
-    sent_invitations = invitation_manager.get_user_sent_invitations(user_id)
+    # Only the five most recent are shown, so only those are read
+    sent_invitations, _ = invitation_manager.get_user_sent_invitations_page(user_id, page_size=5)
     
     if sent_invitations:
         st.markdown("##### Sessions You Created")
-        for invitation in sent_invitations[:5]:  # Show last 5
+        for invitation in sent_invitations:
             session_data = invitation.get('sessionData', {})
             responses = invitation.get('responses', {})
             evaluations = invitation.get('participantEvaluations', {})
@@ -1008,8 +1239,7 @@ def show_settings(auth_manager):
     """Show user settings"""
     st.markdown("### ⚙️ Account Settings")
     
-    current_user = auth_manager.get_current_user()
-    preferences = current_user.get('preferences', {})
+    preferences = auth_manager.get_preferences()
     
     with st.form("preferences_form"):
         st.markdown("#### Display Preferences")
@@ -1042,9 +1272,10 @@ def show_settings(auth_manager):
                 'theme': theme
             }
             
-            success = auth_manager.update_preferences(new_preferences)
-            
-            if success:
+            # Only changed fields are written; the sidebar only needs a redraw when something changed
+            if not auth_manager.diff_preferences(new_preferences):
+                st.info("No changes to save")
+            elif auth_manager.update_preferences(new_preferences):
                 st.success("Settings saved successfully!")
                 st.rerun()
             else:
@@ -1062,13 +1293,22 @@ def show_coffee_shops(auth_manager):
     user_id = current_user['user_id']
     coffee_shop_manager = get_coffee_shop_manager()
     
-    # Show existing reviews first
-    user_reviews = coffee_shop_manager.get_user_reviews(user_id)
+    # Show existing reviews first, one page at a time
+    state_key = f"my_reviews_{user_id}"
+    fetch_page = lambda page_token: coffee_shop_manager.get_user_reviews_page(user_id, page_token=page_token, projection='card')
+    user_reviews = get_loaded_pages(state_key, fetch_page)['items']
     
     if user_reviews:
-        st.markdown(f"#### Your Coffee Shop Reviews ({len(user_reviews)})")
-        for review in user_reviews[:3]:  # Show last 3 reviews
-            with st.expander(f"🏪 {review.get('shopName', 'Unknown Shop')} - {review.get('coffeeRating', 0)}⭐"):
+        total_reviews = get_user_summary_manager().get_dashboard_stats(user_id)['review_stats']['total_reviews']
+        st.markdown(f"#### Your Coffee Shop Reviews ({total_reviews})")
+        for review in user_reviews:
+            # Cards are listed from a projection; the full review is read when one is opened
+            card = st.expander(f"🏪 {review.get('shopName', 'Unknown Shop')} - {review.get('coffeeRating', 0)}⭐",
+                               key=f"review_card_{review['reviewId']}", on_change="rerun")
+            if not card.open:
+                continue
+            review = get_item_details(state_key, review['reviewId'], coffee_shop_manager.get_review) or review
+            with card:
                 col1, col2 = st.columns(2)
                 with col1:
                     st.write(f"**Coffee Rating:** {review.get('coffeeRating', 0)}/5 ⭐")
@@ -1089,6 +1329,8 @@ def show_coffee_shops(auth_manager):
                 created_at = review.get('createdAt')
                 if created_at:
                     st.caption(f"Reviewed: {created_at.strftime('%Y-%m-%d %H:%M') if hasattr(created_at, 'strftime') else str(created_at)}")
+        
+        show_load_more_button(state_key, fetch_page)
     
     st.markdown("#### Add New Coffee Shop Review")
     
@@ -1223,6 +1465,7 @@ def show_coffee_shops(auth_manager):
                     review_id = coffee_shop_manager.create_review(review_data, user_id, reviewer_name)
                     
                     if review_id:
+                        st.session_state.pop(f"my_reviews_{user_id}", None)
                         st.success("🎉 Coffee shop review saved successfully!")
                         st.balloons()
                         st.info("Your review has been added to your collection and will help other coffee lovers!")
@@ -1270,13 +1513,22 @@ def show_coffee_bags(auth_manager):
     user_id = current_user['user_id']
     coffee_bag_manager = get_coffee_bag_manager()
     
-    # Show existing coffee bags first
-    user_bags = coffee_bag_manager.get_user_coffee_bags(user_id)
+    # Show existing coffee bags first, one page at a time
+    state_key = f"my_coffee_bags_{user_id}"
+    fetch_page = lambda page_token: coffee_bag_manager.get_user_coffee_bags_page(user_id, page_token=page_token, projection='card')
+    user_bags = get_loaded_pages(state_key, fetch_page)['items']
     
     if user_bags:
-        st.markdown(f"#### Your Coffee Collection ({len(user_bags)})")
-        for bag in user_bags[:3]:  # Show last 3 bags
-            with st.expander(f"📦 {bag.get('coffeeName', 'Unknown Coffee')} - {bag.get('rating', 0)}⭐"):
+        total_bags = get_user_summary_manager().get_dashboard_stats(user_id)['bag_stats']['total_bags']
+        st.markdown(f"#### Your Coffee Collection ({total_bags})")
+        for bag in user_bags:
+            # Cards are listed from a projection; the full bag is read when one is opened
+            card = st.expander(f"📦 {bag.get('coffeeName', 'Unknown Coffee')} - {bag.get('rating', 0)}⭐",
+                               key=f"bag_card_{bag['bagId']}", on_change="rerun")
+            if not card.open:
+                continue
+            bag = get_item_details(state_key, bag['bagId'], coffee_bag_manager.get_coffee_bag) or bag
+            with card:
                 col1, col2 = st.columns(2)
                 with col1:
                     st.write(f"**Origin:** {bag.get('origin', 'N/A')}")
@@ -1303,6 +1555,8 @@ def show_coffee_bags(auth_manager):
                 created_at = bag.get('createdAt')
                 if created_at:
                     st.caption(f"Added: {created_at.strftime('%Y-%m-%d %H:%M') if hasattr(created_at, 'strftime') else str(created_at)}")
+        
+        show_load_more_button(state_key, fetch_page)
     
     st.markdown("#### Add New Coffee Bag")
     
@@ -1409,6 +1663,7 @@ def show_coffee_bags(auth_manager):
                     bag_id = coffee_bag_manager.create_coffee_bag(bag_data, user_id, user_name)
                     
                     if bag_id:
+                        st.session_state.pop(f"my_coffee_bags_{user_id}", None)
                         st.success("🎉 Coffee bag saved successfully!")
                         st.balloons()
                         st.info("Your coffee has been added to your collection!")
@@ -0,0 +1,191 @@
+"""
+Maintenance commands for Firestore data migrations
+
+Usage:
+    python maintenance.py backfill-invitee-ids [--dry-run]
+    python maintenance.py reconcile-summaries [--user-id USER_ID] [--dry-run]
+    python maintenance.py backfill-identity-keys [--dry-run]
+    python maintenance.py train-recommendations [--full] [--dry-run]
+"""
+import argparse
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from firebase import get_firestore_db, FIRESTORE_BATCH_LIMIT
+from user_summaries import get_user_summary_manager, UserSummaryManager
+from auth import AuthManager, IDENTITY_KEYS_MARKER
+from recommendations import get_recommendation_manager
+
+
+def backfill_invitee_ids(db, dry_run: bool = False) -> int:
+    """Add the denormalized inviteeIds/status/expiresAt fields to existing invitations"""
+    invitations_ref = db.collection('cuppingInvitations')
+    batch = db.batch()
+    pending_writes = 0
+    updated = 0
+    
+    for doc in invitations_ref.stream():
+        invitation = doc.to_dict()
+        updates = {}
+        
+        invitee_ids = [u.get('userId') for u in invitation.get('inviteeUsers', []) if u.get('userId')]
+        if invitation.get('inviteeIds') != invitee_ids:
+            updates['inviteeIds'] = invitee_ids
+        
+        if 'status' not in invitation:
+            updates['status'] = 'pending'
+        
+        if 'expiresAt' not in invitation:
+            created_at = invitation.get('createdAt') or datetime.now()
+            updates['expiresAt'] = created_at + timedelta(days=7)
+        
+        if not updates:
+            continue
+        
+        updated += 1
+        if dry_run:
+            continue
+        
+        batch.update(doc.reference, updates)
+        pending_writes += 1
+        
+        # Commit before hitting the per-batch write limit
+        if pending_writes >= FIRESTORE_BATCH_LIMIT:
+            batch.commit()
+            batch = db.batch()
+            pending_writes = 0
+    
+    if pending_writes:
+        batch.commit()
+    
+    return updated
+
+
+def reconcile_summaries(db, user_id: Optional[str] = None, dry_run: bool = False) -> Tuple[int, int]:
+    """Rebuild userSummaries documents from raw data; returns (users checked, summaries changed)"""
+    summary_manager = get_user_summary_manager()
+    
+    if user_id:
+        user_ids = [user_id]
+    else:
+        user_ids = [doc.id for doc in db.collection('users').select(['user_id']).stream()]
+    
+    changed = 0
+    for uid in user_ids:
+        current = summary_manager.get_summary(uid) or {}
+        rebuilt = summary_manager.build_summary(uid)
+        
+        if UserSummaryManager.summary_to_stats(current) != UserSummaryManager.summary_to_stats(rebuilt):
+            changed += 1
+        
+        # Written only if no delta landed while the raw records were read; otherwise rebuilt again
+        if not dry_run and not summary_manager.store_rebuilt(uid, rebuilt, current.get('version', 0)):
+            summary_manager.rebuild_summary(uid)
+    
+    return len(user_ids), changed
+
+
+def backfill_identity_keys(db, dry_run: bool = False) -> Tuple[int, List[str]]:
+    """Create usernames/{name} and emails/{email} key documents for existing users; returns (created, conflicts)"""
+    existing = {
+        'usernames': {doc.id: doc.to_dict().get('userId') for doc in db.collection('usernames').stream()},
+        'emails': {doc.id: doc.to_dict().get('userId') for doc in db.collection('emails').stream()}
+    }
+    
+    users = [doc.to_dict() for doc in db.collection('users').select(['user_id', 'username', 'email', 'created_at']).stream()]
+    # The oldest account keeps a duplicated username or email
+    users.sort(key=lambda user: str(user.get('created_at') or ''))
+    
+    batch = db.batch()
+    pending_writes = 0
+    created = 0
+    conflicts = []
+    
+    for user in users:
+        user_id = user.get('user_id')
+        keys = [('usernames', user.get('username')), ('emails', AuthManager._email_key(user['email']) if user.get('email') else None)]
+        
+        for collection, key in keys:
+            if not key:
+                continue
+            
+            owner = existing[collection].get(key)
+            if owner == user_id:
+                continue
+            if owner is not None:
+                conflicts.append(f"{collection}/{key} belongs to {owner}, not {user_id}")
+                continue
+            
+            existing[collection][key] = user_id
+            created += 1
+            if dry_run:
+                continue
+            
+            batch.set(db.collection(collection).document(key), {'userId': user_id, 'createdAt': user.get('created_at') or datetime.now()})
+            pending_writes += 1
+            
+            if pending_writes >= FIRESTORE_BATCH_LIMIT:
+                batch.commit()
+                batch = db.batch()
+                pending_writes = 0
+    
+    if pending_writes:
+        batch.commit()
+    
+    if not dry_run:
+        # Tells AuthManager every account now has key documents, so it stops querying users by field
+        collection, document = IDENTITY_KEYS_MARKER
+        db.collection(collection).document(document).set({'backfilledAt': datetime.now(), 'conflicts': len(conflicts)})
+    
+    return created, conflicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coffee Cupping App maintenance commands")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    backfill_parser = subparsers.add_parser('backfill-invitee-ids', help="Add inviteeIds to existing invitations")
+    backfill_parser.add_argument('--dry-run', action='store_true', help="Report changes without writing")
+    
+    reconcile_parser = subparsers.add_parser('reconcile-summaries', help="Rebuild per-user dashboard summaries from raw data")
+    reconcile_parser.add_argument('--user-id', help="Only reconcile this user")
+    reconcile_parser.add_argument('--dry-run', action='store_true', help="Report drift without writing")
+    
+    identity_parser = subparsers.add_parser('backfill-identity-keys', help="Reserve usernames/emails key documents for existing users")
+    identity_parser.add_argument('--dry-run', action='store_true', help="Report what would be created without writing")
+    
+    recommendations_parser = subparsers.add_parser('train-recommendations', help="Retrain the coffee recommender and rewrite users' lists")
+    recommendations_parser.add_argument('--full', action='store_true', help="Retrain from scratch instead of folding in changed users")
+    recommendations_parser.add_argument('--dry-run', action='store_true', help="Train without writing lists or the model file")
+    
+    args = parser.parse_args()
+    
+    db = get_firestore_db()
+    if not db:
+        raise SystemExit("❌ Database connection not available")
+    
+    if args.command == 'backfill-invitee-ids':
+        updated = backfill_invitee_ids(db, dry_run=args.dry_run)
+        action = "would be updated" if args.dry_run else "updated"
+        print(f"✅ {updated} invitation(s) {action}")
+        
+    elif args.command == 'reconcile-summaries':
+        checked, changed = reconcile_summaries(db, user_id=args.user_id, dry_run=args.dry_run)
+        print(f"✅ Checked {checked} user(s), {changed} summary(ies) out of sync")
+    
+    elif args.command == 'backfill-identity-keys':
+        created, conflicts = backfill_identity_keys(db, dry_run=args.dry_run)
+        action = "would be created" if args.dry_run else "created"
+        print(f"✅ {created} key document(s) {action}")
+        for conflict in conflicts:
+            print(f"⚠️ Duplicate identity left unreserved: {conflict}")
+    
+    elif args.command == 'train-recommendations':
+        result = get_recommendation_manager().train(full=args.full, dry_run=args.dry_run)
+        action = "would be written" if args.dry_run else "written"
+        print(f"✅ {result['mode'].capitalize()} training on {result['ratings']} rating(s) from "
+              f"{result['users']} user(s) and {result['coffees']} coffee(s) in {result['seconds']}s; "
+              f"{result['lists']} list(s) {action}")
+
+
+if __name__ == "__main__":
+    main()
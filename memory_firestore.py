@@ -0,0 +1,938 @@
+"""
+In-process Firestore stand-in for offline runs, demos and benchmarks
+
+Implements the subset of the google-cloud-firestore client API used by the
+managers (collections, documents, where/order_by/limit/cursors, select
+projections, batches, transactions, array_contains, count/sum/avg
+aggregations) plus a storage-bucket stand-in. Single-field indexes are built
+lazily for equality-style filters, mirroring Firestore's automatic indexes, so
+query cost tracks result size rather than collection size.
+"""
+import heapq
+import random
+import string
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from google.cloud.firestore_v1 import transforms as _transforms
+except ImportError:  # pragma: no cover - google-cloud-firestore ships with firebase-admin
+    _transforms = None
+
+try:
+    from google.api_core.exceptions import AlreadyExists, NotFound
+except ImportError:  # pragma: no cover
+    class NotFound(Exception):
+        """Raised when updating a document that does not exist"""
+    
+    class AlreadyExists(Exception):
+        """Raised when creating a document that already exists"""
+
+
+_MISSING = object()
+_AUTO_ID_CHARS = string.ascii_letters + string.digits
+
+# Firestore's cross-type ordering: null < bool < number < timestamp < string < bytes < reference < array < map
+_TYPE_NULL, _TYPE_BOOL, _TYPE_NUMBER, _TYPE_TIMESTAMP, _TYPE_STRING, _TYPE_BYTES, _TYPE_REFERENCE, _TYPE_ARRAY, _TYPE_MAP = range(9)
+
+_EQUALITY_OPS = {'==', 'in', 'array_contains', 'array-contains', 'array_contains_any', 'array-contains-any'}
+_INEQUALITY_OPS = {'<', '<=', '>', '>=', '!=', 'not-in', 'not_in'}
+
+
+def _auto_id() -> str:
+    """Generate a 20-character document id like the Firestore client does"""
+    return ''.join(random.choice(_AUTO_ID_CHARS) for _ in range(20))
+
+
+def parse_field_path(field_path) -> Tuple[str, ...]:
+    """Split a dotted field path (with optional `backtick` quoting) into its parts"""
+    if hasattr(field_path, 'parts'):
+        return tuple(field_path.parts)
+    
+    parts = []
+    current = []
+    quoted = False
+    escaped = False
+    for char in field_path:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == '\\' and quoted:
+            escaped = True
+        elif char == '`':
+            quoted = not quoted
+        elif char == '.' and not quoted:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append(''.join(current))
+    return tuple(parts)
+
+
+def _copy_value(value):
+    """Copy nested maps/arrays so callers never share mutable state with the store"""
+    if isinstance(value, dict):
+        return {key: _copy_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy_value(item) for item in value]
+    return value
+
+
+def _get_path(data: Dict, parts: Tuple[str, ...]):
+    """Read a nested value, returning _MISSING when any segment is absent"""
+    current = data
+    for part in parts:
+        if not isinstance(current, dict) or part not in current:
+            return _MISSING
+        current = current[part]
+    return current
+
+
+def _order_value(value):
+    """Key that reproduces Firestore value ordering and cross-type equality"""
+    if value is None:
+        return (_TYPE_NULL, 0)
+    if isinstance(value, bool):
+        return (_TYPE_BOOL, value)
+    if isinstance(value, (int, float)):
+        return (_TYPE_NUMBER, value)
+    if isinstance(value, datetime):
+        # The Firestore client stores naive datetimes as UTC, not local time
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return (_TYPE_TIMESTAMP, value.timestamp())
+    if isinstance(value, str):
+        return (_TYPE_STRING, value)
+    if isinstance(value, bytes):
+        return (_TYPE_BYTES, value)
+    if isinstance(value, MemoryDocumentReference):
+        return (_TYPE_REFERENCE, value.path)
+    if isinstance(value, (list, tuple)):
+        return (_TYPE_ARRAY, tuple(_order_value(item) for item in value))
+    if isinstance(value, dict):
+        return (_TYPE_MAP, tuple(sorted((key, _order_value(item)) for key, item in value.items())))
+    return (_TYPE_MAP, repr(value))
+
+
+def _index_key(value):
+    """Hashable index key for scalar values, None for values that cannot be indexed"""
+    if isinstance(value, (list, tuple, dict)):
+        return None
+    return _order_value(value)
+
+
+class _SortKey:
+    """Composite ordering key honouring per-field sort direction"""
+    
+    __slots__ = ('values', 'descending')
+    
+    def __init__(self, values: Tuple, descending: Tuple[bool, ...]):
+        self.values = values
+        self.descending = descending
+    
+    def _compare(self, other) -> int:
+        for mine, theirs, descending in zip(self.values, other.values, self.descending):
+            if mine == theirs:
+                continue
+            result = -1 if mine < theirs else 1
+            return -result if descending else result
+        return 0
+    
+    def __lt__(self, other):
+        return self._compare(other) < 0
+    
+    def __eq__(self, other):
+        return self._compare(other) == 0
+
+
+class _FieldIndex:
+    """Single-field index: value -> document ids, plus array-element postings"""
+    
+    __slots__ = ('parts', 'values', 'elements', 'unindexed')
+    
+    def __init__(self, parts: Tuple[str, ...]):
+        self.parts = parts
+        self.values: Dict[Any, set] = {}
+        self.elements: Dict[Any, set] = {}
+        self.unindexed: set = set()
+    
+    def add(self, doc_id: str, data: Dict):
+        value = _get_path(data, self.parts)
+        if value is _MISSING:
+            return
+        if isinstance(value, list):
+            for item in value:
+                key = _index_key(item)
+                if key is None:
+                    self.unindexed.add(doc_id)
+                else:
+                    self.elements.setdefault(key, set()).add(doc_id)
+            return
+        key = _index_key(value)
+        if key is None:
+            self.unindexed.add(doc_id)
+        else:
+            self.values.setdefault(key, set()).add(doc_id)
+    
+    def remove(self, doc_id: str, data: Dict):
+        value = _get_path(data, self.parts)
+        if value is _MISSING:
+            return
+        self.unindexed.discard(doc_id)
+        items = value if isinstance(value, list) else [value]
+        postings = self.elements if isinstance(value, list) else self.values
+        for item in items:
+            key = _index_key(item)
+            if key is not None and key in postings:
+                postings[key].discard(doc_id)
+                if not postings[key]:
+                    del postings[key]
+    
+    def lookup(self, op: str, value) -> Optional[set]:
+        """Candidate document ids for an equality-style filter"""
+        if op == '==':
+            keys, postings = [value], self.values
+        elif op == 'in':
+            keys, postings = list(value), self.values
+        elif op in ('array_contains', 'array-contains'):
+            keys, postings = [value], self.elements
+        else:
+            keys, postings = list(value), self.elements
+        
+        candidates = set(self.unindexed)
+        for item in keys:
+            key = _index_key(item)
+            if key is None:
+                return None
+            candidates |= postings.get(key, set())
+        return candidates
+
+
+class _StoredDocument:
+    """A document as held by the store"""
+    
+    __slots__ = ('data', 'create_time', 'update_time')
+    
+    def __init__(self, data: Dict, create_time: datetime, update_time: datetime):
+        self.data = data
+        self.create_time = create_time
+        self.update_time = update_time
+
+
+class MemoryDocumentSnapshot:
+    """Read-only view of a document at a point in time"""
+    
+    def __init__(self, reference, data: Optional[Dict], create_time=None, update_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = datetime.now()
+    
+    @property
+    def id(self) -> str:
+        return self.reference.id
+    
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+    
+    def to_dict(self) -> Optional[Dict]:
+        return _copy_value(self._data) if self._data is not None else None
+    
+    def get(self, field_path):
+        if self._data is None:
+            return None
+        value = _get_path(self._data, parse_field_path(field_path))
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return _copy_value(value)
+
+
+class MemoryWriteResult:
+    """Result of an individual write"""
+    
+    def __init__(self, update_time: datetime):
+        self.update_time = update_time
+
+
+class MemoryAggregationResult:
+    """Single aggregation value, matching google.cloud.firestore AggregationResult"""
+    
+    def __init__(self, alias: str, value, read_time=None):
+        self.alias = alias
+        self.value = value
+        self.read_time = read_time
+
+
+class MemoryDocumentReference:
+    """Reference to a document in the in-memory store"""
+    
+    def __init__(self, client, collection_path: str, document_id: str):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = document_id
+    
+    @property
+    def path(self) -> str:
+        return f"{self._collection_path}/{self.id}"
+    
+    @property
+    def parent(self):
+        return MemoryCollectionReference(self._client, self._collection_path)
+    
+    def __eq__(self, other):
+        return isinstance(other, MemoryDocumentReference) and other.path == self.path
+    
+    def __hash__(self):
+        return hash(self.path)
+    
+    def __repr__(self):
+        return f"<MemoryDocumentReference {self.path}>"
+    
+    def collection(self, collection_id: str):
+        return MemoryCollectionReference(self._client, f"{self.path}/{collection_id}")
+    
+    def get(self, field_paths: Optional[Iterable[str]] = None, transaction=None, **kwargs) -> MemoryDocumentSnapshot:
+        return self._client._get_document(self, field_paths)
+    
+    def set(self, document_data: Dict, merge=False, **kwargs) -> MemoryWriteResult:
+        return self._client._commit([('set', self, document_data, merge)])[0]
+    
+    def create(self, document_data: Dict, **kwargs) -> MemoryWriteResult:
+        return self._client._commit([('create', self, document_data, False)])[0]
+    
+    def update(self, field_updates: Dict, **kwargs) -> MemoryWriteResult:
+        return self._client._commit([('update', self, field_updates, False)])[0]
+    
+    def delete(self, **kwargs) -> MemoryWriteResult:
+        return self._client._commit([('delete', self, None, False)])[0]
+
+
+class MemoryQuery:
+    """Immutable query over one collection"""
+    
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+    
+    def __init__(self, client, collection_path: str, filters: Tuple = (), orders: Tuple = (),
+                 limit: Optional[int] = None, offset: int = 0, start: Optional[Tuple] = None,
+                 end: Optional[Tuple] = None, projection: Optional[Tuple] = None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = filters
+        self._orders = orders
+        self._limit = limit
+        self._offset = offset
+        self._start = start
+        self._end = end
+        self._projection = projection
+    
+    def _copy(self, **changes) -> 'MemoryQuery':
+        state = {
+            'filters': self._filters,
+            'orders': self._orders,
+            'limit': self._limit,
+            'offset': self._offset,
+            'start': self._start,
+            'end': self._end,
+            'projection': self._projection,
+        }
+        state.update(changes)
+        return MemoryQuery(self._client, self._collection_path, **state)
+    
+    def where(self, field_path: Optional[str] = None, op_string: Optional[str] = None, value=None, *, filter=None) -> 'MemoryQuery':
+        if filter is not None:
+            if not hasattr(filter, 'op_string'):
+                raise NotImplementedError("Composite filters are not supported by the memory backend")
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((parse_field_path(field_path), op_string, value),))
+    
+    def order_by(self, field_path: str, direction: str = ASCENDING) -> 'MemoryQuery':
+        return self._copy(orders=self._orders + ((parse_field_path(field_path), direction == self.DESCENDING),))
+    
+    def limit(self, count: int) -> 'MemoryQuery':
+        return self._copy(limit=count)
+    
+    def offset(self, num_to_skip: int) -> 'MemoryQuery':
+        return self._copy(offset=num_to_skip)
+    
+    def select(self, field_paths: Iterable[str]) -> 'MemoryQuery':
+        return self._copy(projection=tuple(parse_field_path(path) for path in field_paths))
+    
+    def start_at(self, document_fields_or_snapshot) -> 'MemoryQuery':
+        return self._copy(start=(document_fields_or_snapshot, True))
+    
+    def start_after(self, document_fields_or_snapshot) -> 'MemoryQuery':
+        return self._copy(start=(document_fields_or_snapshot, False))
+    
+    def end_at(self, document_fields_or_snapshot) -> 'MemoryQuery':
+        return self._copy(end=(document_fields_or_snapshot, True))
+    
+    def end_before(self, document_fields_or_snapshot) -> 'MemoryQuery':
+        return self._copy(end=(document_fields_or_snapshot, False))
+    
+    def stream(self, transaction=None, **kwargs):
+        snapshots, _ = self._client._run_query(self)
+        return iter(snapshots)
+    
+    def get(self, transaction=None, **kwargs) -> List[MemoryDocumentSnapshot]:
+        snapshots, _ = self._client._run_query(self)
+        return snapshots
+    
+    def explain(self) -> Dict:
+        """Describe how the memory backend would execute this query"""
+        _, plan = self._client._run_query(self, count_reads=False)
+        return plan
+    
+    def count(self, alias: Optional[str] = None) -> 'MemoryAggregationQuery':
+        return MemoryAggregationQuery(self).count(alias)
+    
+    def sum(self, field_ref, alias: Optional[str] = None) -> 'MemoryAggregationQuery':
+        return MemoryAggregationQuery(self).sum(field_ref, alias)
+    
+    def avg(self, field_ref, alias: Optional[str] = None) -> 'MemoryAggregationQuery':
+        return MemoryAggregationQuery(self).avg(field_ref, alias)
+
+
+class MemoryCollectionReference(MemoryQuery):
+    """Reference to a collection; also the root query over it"""
+    
+    def __init__(self, client, collection_path: str):
+        super().__init__(client, collection_path)
+    
+    @property
+    def id(self) -> str:
+        return self._collection_path.rsplit('/', 1)[-1]
+    
+    def document(self, document_id: Optional[str] = None) -> MemoryDocumentReference:
+        return MemoryDocumentReference(self._client, self._collection_path, document_id or _auto_id())
+    
+    def add(self, document_data: Dict, document_id: Optional[str] = None) -> Tuple[datetime, MemoryDocumentReference]:
+        reference = self.document(document_id)
+        result = reference.create(document_data)
+        return result.update_time, reference
+    
+    def list_documents(self) -> List[MemoryDocumentReference]:
+        return [self.document(doc_id) for doc_id in self._client._document_ids(self._collection_path)]
+
+
+class MemoryAggregationQuery:
+    """count/sum/avg aggregations evaluated over a query's matches"""
+    
+    def __init__(self, query: MemoryQuery):
+        self._query = query
+        self._aggregations: List[Tuple[str, str, Optional[Tuple[str, ...]]]] = []
+    
+    def _alias(self, alias: Optional[str]) -> str:
+        return alias or f"field_{len(self._aggregations) + 1}"
+    
+    def count(self, alias: Optional[str] = None) -> 'MemoryAggregationQuery':
+        self._aggregations.append(('count', self._alias(alias), None))
+        return self
+    
+    def sum(self, field_ref, alias: Optional[str] = None) -> 'MemoryAggregationQuery':
+        self._aggregations.append(('sum', self._alias(alias), parse_field_path(field_ref)))
+        return self
+    
+    def avg(self, field_ref, alias: Optional[str] = None) -> 'MemoryAggregationQuery':
+        self._aggregations.append(('avg', self._alias(alias), parse_field_path(field_ref)))
+        return self
+    
+    def get(self, transaction=None, **kwargs) -> List[List[MemoryAggregationResult]]:
+        return [self._client_results()]
+    
+    def stream(self, transaction=None, **kwargs):
+        return iter(self.get())
+    
+    def _client_results(self) -> List[MemoryAggregationResult]:
+        matches = self._query._client._aggregate_matches(self._query)
+        read_time = datetime.now()
+        results = []
+        for kind, alias, parts in self._aggregations:
+            if kind == 'count':
+                results.append(MemoryAggregationResult(alias, len(matches), read_time))
+                continue
+            
+            numbers = []
+            for data in matches:
+                value = _get_path(data, parts)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    numbers.append(value)
+            
+            if kind == 'sum':
+                results.append(MemoryAggregationResult(alias, sum(numbers), read_time))
+            else:
+                average = sum(numbers) / len(numbers) if numbers else None
+                results.append(MemoryAggregationResult(alias, average, read_time))
+        return results
+
+
+class MemoryWriteBatch:
+    """Write batch applied atomically on commit"""
+    
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+    
+    def __len__(self):
+        return len(self._writes)
+    
+    def set(self, reference, document_data: Dict, merge=False) -> 'MemoryWriteBatch':
+        self._writes.append(('set', reference, document_data, merge))
+        return self
+    
+    def create(self, reference, document_data: Dict) -> 'MemoryWriteBatch':
+        self._writes.append(('create', reference, document_data, False))
+        return self
+    
+    def update(self, reference, field_updates: Dict, **kwargs) -> 'MemoryWriteBatch':
+        self._writes.append(('update', reference, field_updates, False))
+        return self
+    
+    def delete(self, reference, **kwargs) -> 'MemoryWriteBatch':
+        self._writes.append(('delete', reference, None, False))
+        return self
+    
+    def commit(self, **kwargs) -> List[MemoryWriteResult]:
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+
+class MemoryTransaction(MemoryWriteBatch):
+    """Transaction whose writes are buffered until the callback returns"""
+    
+    def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, MemoryDocumentReference):
+            return iter([ref_or_query.get()])
+        return ref_or_query.stream()
+
+
+class MemoryClient:
+    """Thread-safe, in-process stand-in for google.cloud.firestore.Client"""
+    
+    def __init__(self, project: str = 'memory'):
+        self.project = project
+        self._lock = threading.RLock()
+        self._collections: Dict[str, Dict[str, _StoredDocument]] = {}
+        self._indexes: Dict[str, Dict[Tuple[str, ...], _FieldIndex]] = {}
+        self._stats = {'queries': 0, 'document_reads': 0, 'documents_scanned': 0, 'writes': 0, 'commits': 0}
+    
+    # Public client API
+    
+    def collection(self, collection_path: str) -> MemoryCollectionReference:
+        return MemoryCollectionReference(self, collection_path)
+    
+    def document(self, document_path: str) -> MemoryDocumentReference:
+        collection_path, document_id = document_path.rsplit('/', 1)
+        return MemoryDocumentReference(self, collection_path, document_id)
+    
+    def collections(self) -> List[MemoryCollectionReference]:
+        with self._lock:
+            return [self.collection(path) for path in self._collections if '/' not in path and self._collections[path]]
+    
+    def batch(self) -> MemoryWriteBatch:
+        return MemoryWriteBatch(self)
+    
+    def transaction(self, **kwargs) -> MemoryTransaction:
+        return MemoryTransaction(self)
+    
+    def run_transaction(self, callback, *args, **kwargs):
+        """Run callback(transaction, ...) serialized against all other writes"""
+        with self._lock:
+            transaction = MemoryTransaction(self)
+            result = callback(transaction, *args, **kwargs)
+            transaction.commit()
+            return result
+    
+    def get_all(self, references: Iterable[MemoryDocumentReference], field_paths: Optional[Iterable[str]] = None, transaction=None, **kwargs):
+        for reference in references:
+            yield self._get_document(reference, field_paths)
+    
+    def stats(self) -> Dict:
+        """Read/write counters accumulated since creation or the last reset"""
+        with self._lock:
+            return dict(self._stats)
+    
+    def reset_stats(self):
+        with self._lock:
+            for key in self._stats:
+                self._stats[key] = 0
+    
+    def clear(self):
+        """Drop all data and indexes"""
+        with self._lock:
+            self._collections.clear()
+            self._indexes.clear()
+    
+    # Reads
+    
+    def _document_ids(self, collection_path: str) -> List[str]:
+        with self._lock:
+            return list(self._collections.get(collection_path, {}))
+    
+    def _get_document(self, reference: MemoryDocumentReference, field_paths=None) -> MemoryDocumentSnapshot:
+        with self._lock:
+            self._stats['document_reads'] += 1
+            stored = self._collections.get(reference._collection_path, {}).get(reference.id)
+            if stored is None:
+                return MemoryDocumentSnapshot(reference, None)
+            data = stored.data
+            if field_paths is not None:
+                data = self._project(data, tuple(parse_field_path(path) for path in field_paths))
+            return MemoryDocumentSnapshot(reference, _copy_value(data), stored.create_time, stored.update_time)
+    
+    def _field_index(self, collection_path: str, parts: Tuple[str, ...]) -> _FieldIndex:
+        """Return the single-field index, building it on first use"""
+        indexes = self._indexes.setdefault(collection_path, {})
+        index = indexes.get(parts)
+        if index is None:
+            index = _FieldIndex(parts)
+            for doc_id, stored in self._collections.get(collection_path, {}).items():
+                index.add(doc_id, stored.data)
+            indexes[parts] = index
+        return index
+    
+    @staticmethod
+    def _field_value(doc_id: str, data: Dict, parts: Tuple[str, ...]):
+        if parts == ('__name__',):
+            return doc_id
+        return _get_path(data, parts)
+    
+    @staticmethod
+    def _matches(value, op: str, target) -> bool:
+        if isinstance(target, MemoryDocumentReference):
+            target = target.id
+        if op == '==':
+            return value is not _MISSING and _order_value(value) == _order_value(target)
+        if value is _MISSING:
+            return False
+        if op in ('array_contains', 'array-contains'):
+            return isinstance(value, list) and _order_value(target) in {_order_value(item) for item in value}
+        if op in ('array_contains_any', 'array-contains-any'):
+            wanted = {_order_value(item) for item in target}
+            return isinstance(value, list) and any(_order_value(item) in wanted for item in value)
+        if op == 'in':
+            return _order_value(value) in {_order_value(item) for item in target}
+        if op in ('not-in', 'not_in'):
+            return value is not None and _order_value(value) not in {_order_value(item) for item in target}
+        if op == '!=':
+            return _order_value(value) != _order_value(target)
+        
+        mine, theirs = _order_value(value), _order_value(target)
+        if mine[0] != theirs[0]:
+            return False
+        if op == '<':
+            return mine < theirs
+        if op == '<=':
+            return mine <= theirs
+        if op == '>':
+            return mine > theirs
+        if op == '>=':
+            return mine >= theirs
+        raise ValueError(f"Unsupported operator: {op}")
+    
+    @staticmethod
+    def _project(data: Dict, projection: Tuple[Tuple[str, ...], ...]) -> Dict:
+        projected: Dict = {}
+        for parts in projection:
+            value = _get_path(data, parts)
+            if value is _MISSING:
+                continue
+            target = projected
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+        return projected
+    
+    def _order_fields(self, query: MemoryQuery) -> List[Tuple[Tuple[str, ...], bool]]:
+        """Explicit orders, then implicit inequality/name ordering as Firestore applies it"""
+        orders = list(query._orders)
+        ordered = {parts for parts, _ in orders}
+        for parts, op, _ in query._filters:
+            if op in _INEQUALITY_OPS and parts not in ordered:
+                orders.append((parts, False))
+                ordered.add(parts)
+        if ('__name__',) not in ordered:
+            orders.append((('__name__',), orders[-1][1] if orders else False))
+        return orders
+    
+    def _cursor_key(self, cursor, orders) -> Tuple:
+        if isinstance(cursor, MemoryDocumentSnapshot):
+            data = cursor._data or {}
+            return tuple(_order_value(self._field_value(cursor.id, data, parts)) for parts, _ in orders)
+        if isinstance(cursor, dict):
+            values = []
+            for parts, _ in orders:
+                value = _get_path(cursor, parts)
+                if value is _MISSING:
+                    break
+                values.append(_order_value(value))
+            return tuple(values)
+        return tuple(_order_value(value) for value in cursor)
+    
+    def _select_candidates(self, query: MemoryQuery, documents: Dict[str, _StoredDocument]) -> Tuple[Iterable[str], str]:
+        """Choose the smallest index-backed candidate set, falling back to a scan"""
+        best = None
+        best_label = 'full_scan'
+        for parts, op, value in query._filters:
+            if op not in _EQUALITY_OPS or parts == ('__name__',):
+                continue
+            candidates = self._field_index(query._collection_path, parts).lookup(op, value)
+            if candidates is not None and (best is None or len(candidates) < len(best)):
+                best = candidates
+                best_label = f"index:{'.'.join(parts)} {op}"
+        if best is None:
+            return list(documents), best_label
+        return list(best), best_label
+    
+    def _matching_documents(self, query: MemoryQuery) -> Tuple[List[Tuple[str, Dict]], Dict]:
+        """Filter, order and apply cursors; returns (doc_id, data) pairs and the plan"""
+        documents = self._collections.get(query._collection_path, {})
+        candidate_ids, index_label = self._select_candidates(query, documents)
+        
+        orders = self._order_fields(query)
+        matches = []
+        scanned = 0
+        for doc_id in candidate_ids:
+            stored = documents.get(doc_id)
+            if stored is None:
+                continue
+            scanned += 1
+            data = stored.data
+            if not all(self._matches(self._field_value(doc_id, data, parts), op, value)
+                       for parts, op, value in query._filters):
+                continue
+            order_values = []
+            for parts, _ in orders:
+                value = self._field_value(doc_id, data, parts)
+                if value is _MISSING:
+                    break
+                order_values.append(_order_value(value))
+            else:
+                matches.append((tuple(order_values), doc_id, data))
+        
+        descending = tuple(direction for _, direction in orders)
+        
+        def in_range(order_values: Tuple) -> bool:
+            for bound, is_start in ((query._start, True), (query._end, False)):
+                if bound is None:
+                    continue
+                cursor, inclusive = bound
+                cursor_key = self._cursor_key(cursor, orders)
+                position = _SortKey(order_values[:len(cursor_key)], descending)._compare(_SortKey(cursor_key, descending))
+                if is_start and (position < 0 or (position == 0 and not inclusive)):
+                    return False
+                if not is_start and (position > 0 or (position == 0 and not inclusive)):
+                    return False
+            return True
+        
+        if query._start is not None or query._end is not None:
+            matches = [match for match in matches if in_range(match[0])]
+        
+        wanted = None if query._limit is None else query._offset + query._limit
+        sort_key = lambda match: _SortKey(match[0], descending)
+        if wanted is not None and wanted < len(matches):
+            ordered = heapq.nsmallest(wanted, matches, key=sort_key)
+        else:
+            ordered = sorted(matches, key=sort_key)
+        ordered = ordered[query._offset:wanted]
+        
+        plan = {
+            'collection': query._collection_path,
+            'index': index_label,
+            'filters': [('.'.join(parts), op) for parts, op, _ in query._filters],
+            'order_by': [('.'.join(parts), 'DESCENDING' if direction else 'ASCENDING') for parts, direction in orders],
+            'documents_scanned': scanned,
+            'documents_matched': len(matches),
+            'documents_returned': len(ordered),
+        }
+        return [(doc_id, data) for _, doc_id, data in ordered], plan
+    
+    def _run_query(self, query: MemoryQuery, count_reads: bool = True) -> Tuple[List[MemoryDocumentSnapshot], Dict]:
+        with self._lock:
+            results, plan = self._matching_documents(query)
+            if count_reads:
+                self._stats['queries'] += 1
+                self._stats['documents_scanned'] += plan['documents_scanned']
+                # Firestore bills at least one read per query
+                self._stats['document_reads'] += max(1, len(results))
+            
+            documents = self._collections.get(query._collection_path, {})
+            snapshots = []
+            for doc_id, data in results:
+                stored = documents[doc_id]
+                if query._projection is not None:
+                    data = self._project(data, query._projection)
+                reference = MemoryDocumentReference(self, query._collection_path, doc_id)
+                snapshots.append(MemoryDocumentSnapshot(reference, _copy_value(data), stored.create_time, stored.update_time))
+            return snapshots, plan
+    
+    def _aggregate_matches(self, query: MemoryQuery) -> List[Dict]:
+        with self._lock:
+            results, plan = self._matching_documents(query)
+            self._stats['queries'] += 1
+            self._stats['documents_scanned'] += plan['documents_scanned']
+            # Aggregations bill one read per batch of up to 1000 index entries
+            self._stats['document_reads'] += 1 + len(results) // 1000
+            return [_copy_value(data) for _, data in results]
+    
+    # Writes
+    
+    def _resolve(self, value, current=_MISSING):
+        """Apply Firestore sentinels/transforms against the current field value"""
+        if _transforms is not None:
+            if value is _transforms.SERVER_TIMESTAMP:
+                return datetime.now()
+            if isinstance(value, _transforms.Increment):
+                base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+                return base + value.value
+            if isinstance(value, _transforms.Maximum):
+                if isinstance(current, (int, float)) and not isinstance(current, bool):
+                    return max(current, value.value)
+                return value.value
+            if isinstance(value, _transforms.Minimum):
+                if isinstance(current, (int, float)) and not isinstance(current, bool):
+                    return min(current, value.value)
+                return value.value
+            if isinstance(value, _transforms.ArrayUnion):
+                result = list(current) if isinstance(current, list) else []
+                existing = {_order_value(item) for item in result}
+                for item in value.values:
+                    if _order_value(item) not in existing:
+                        result.append(_copy_value(item))
+                        existing.add(_order_value(item))
+                return result
+            if isinstance(value, _transforms.ArrayRemove):
+                removed = {_order_value(item) for item in value.values}
+                return [item for item in (current if isinstance(current, list) else []) if _order_value(item) not in removed]
+        if isinstance(value, dict):
+            base = current if isinstance(current, dict) else {}
+            return {key: self._resolve(item, base.get(key, _MISSING)) for key, item in value.items()
+                    if not self._is_delete(item)}
+        return _copy_value(value)
+    
+    @staticmethod
+    def _is_delete(value) -> bool:
+        return _transforms is not None and value is _transforms.DELETE_FIELD
+    
+    def _set_path(self, data: Dict, parts: Tuple[str, ...], value):
+        target = data
+        for part in parts[:-1]:
+            child = target.get(part)
+            if not isinstance(child, dict):
+                child = {}
+                target[part] = child
+            target = child
+        if self._is_delete(value):
+            target.pop(parts[-1], None)
+        else:
+            target[parts[-1]] = self._resolve(value, target.get(parts[-1], _MISSING))
+    
+    def _merge(self, data: Dict, updates: Dict):
+        """Deep-merge nested maps, as set(..., merge=True) does"""
+        for key, value in updates.items():
+            if isinstance(value, dict) and value and not self._is_delete(value):
+                child = data.get(key)
+                if not isinstance(child, dict):
+                    child = {}
+                    data[key] = child
+                self._merge(child, value)
+            else:
+                self._set_path(data, (key,), value)
+    
+    def _commit(self, writes: List[Tuple]) -> List[MemoryWriteResult]:
+        """Validate then apply writes atomically, keeping indexes in sync"""
+        with self._lock:
+            for kind, reference, _, _ in writes:
+                exists = reference.id in self._collections.get(reference._collection_path, {})
+                if kind == 'update' and not exists:
+                    raise NotFound(f"No document to update: {reference.path}")
+                if kind == 'create' and exists:
+                    raise AlreadyExists(f"Document already exists: {reference.path}")
+            
+            now = datetime.now()
+            results = []
+            for kind, reference, payload, merge in writes:
+                documents = self._collections.setdefault(reference._collection_path, {})
+                indexes = self._indexes.get(reference._collection_path, {}).values()
+                stored = documents.get(reference.id)
+                
+                if stored is not None:
+                    for index in indexes:
+                        index.remove(reference.id, stored.data)
+                
+                if kind == 'delete':
+                    documents.pop(reference.id, None)
+                    results.append(MemoryWriteResult(now))
+                    self._stats['writes'] += 1
+                    continue
+                
+                if kind == 'update':
+                    data = _copy_value(stored.data)
+                    for field_path, value in payload.items():
+                        self._set_path(data, parse_field_path(field_path), value)
+                elif kind == 'set' and merge and stored is not None:
+                    data = _copy_value(stored.data)
+                    self._merge(data, payload)
+                else:
+                    data = self._resolve(payload)
+                
+                create_time = stored.create_time if stored is not None else now
+                documents[reference.id] = _StoredDocument(data, create_time, now)
+                for index in indexes:
+                    index.add(reference.id, data)
+                results.append(MemoryWriteResult(now))
+                self._stats['writes'] += 1
+            
+            self._stats['commits'] += 1
+            return results
+
+
+class MemoryBlob:
+    """Storage blob stand-in"""
+    
+    def __init__(self, bucket, name: str):
+        self.bucket = bucket
+        self.name = name
+    
+    @property
+    def public_url(self) -> str:
+        return f"https://storage.googleapis.com/{self.bucket.name}/{self.name}"
+    
+    def upload_from_string(self, data, content_type: Optional[str] = None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.bucket._blobs[self.name] = (bytes(data), content_type)
+    
+    def download_as_bytes(self) -> bytes:
+        if self.name not in self.bucket._blobs:
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        return self.bucket._blobs[self.name][0]
+    
+    def exists(self) -> bool:
+        return self.name in self.bucket._blobs
+    
+    def make_public(self):
+        if self.name not in self.bucket._blobs:
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+    
+    def delete(self):
+        if self.bucket._blobs.pop(self.name, None) is None:
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+
+
+class MemoryBucket:
+    """Storage bucket stand-in holding blobs in memory"""
+    
+    def __init__(self, name: str = 'memory-bucket'):
+        self.name = name
+        self._blobs: Dict[str, Tuple[bytes, Optional[str]]] = {}
+    
+    def blob(self, blob_name: str) -> MemoryBlob:
+        return MemoryBlob(self, blob_name)
+    
+    def list_blobs(self, prefix: str = '') -> List[MemoryBlob]:
+        return [MemoryBlob(self, name) for name in sorted(self._blobs) if name.startswith(prefix)]
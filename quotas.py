@@ -0,0 +1,199 @@
+"""
+Per-user write quotas shared by the data managers
+
+Each create operation is checked against a per-user sliding window before any
+write. By default windows are kept in process memory (exact sliding log);
+with QUOTA_BACKEND=firestore they are kept in `quotaCounters` documents so
+every replica enforces the same budget (two-window sliding estimate).
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, Tuple
+from firebase import get_firestore_db, get_config_value, run_in_transaction
+from rate_limiter import format_retry_after
+
+# operation -> (writes allowed, window in seconds); override with e.g. QUOTA_CREATE_CUPPING=30/3600
+DEFAULT_QUOTAS = {
+    'create_cupping': (30, 3600),
+    'create_review': (30, 3600),
+    'create_coffee_bag': (30, 3600),
+    'create_invitation': (20, 3600)
+}
+
+# How each operation is named in throttle messages
+OPERATION_LABELS = {
+    'create_cupping': 'new cuppings',
+    'create_review': 'new coffee shop reviews',
+    'create_coffee_bag': 'new coffee bags',
+    'create_invitation': 'new invitations'
+}
+
+# Users tracked per operation by the in-memory store before the least recently active are dropped
+DEFAULT_MAX_TRACKED_USERS = 10000
+
+
+class MemoryQuotaStore:
+    """Sliding log of recent write times per key, bounded to max_keys keys"""
+    
+    def __init__(self, max_keys: int = DEFAULT_MAX_TRACKED_USERS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._logs: OrderedDict = OrderedDict()
+    
+    def hit(self, key: str, limit: int, window: float) -> Tuple[bool, int, float]:
+        """Record a write if under the limit; returns (allowed, remaining, retry_after)"""
+        now = time.monotonic()
+        with self._lock:
+            log = self._logs.get(key)
+            if log is None:
+                # A full log never needs more than limit timestamps
+                log = self._logs[key] = deque(maxlen=limit)
+            self._logs.move_to_end(key)
+            
+            while log and log[0] <= now - window:
+                log.popleft()
+            
+            if len(log) >= limit:
+                return False, 0, log[0] + window - now
+            
+            log.append(now)
+            while len(self._logs) > self.max_keys:
+                self._logs.popitem(last=False)
+            return True, limit - len(log), 0.0
+    
+    def tracked(self) -> int:
+        return len(self._logs)
+
+
+class FirestoreQuotaStore:
+    """Per-key counters in Firestore, shared by every replica"""
+    
+    def hit(self, key: str, limit: int, window: float) -> Tuple[bool, int, float]:
+        """Record a write if under the limit; returns (allowed, remaining, retry_after)"""
+        db = get_firestore_db()
+        if not db:
+            # Never block writes because the quota store is unavailable
+            return True, limit, 0.0
+        
+        counter_ref = db.collection('quotaCounters').document(key)
+        
+        def check_and_count(transaction):
+            now = time.time()
+            window_start = math.floor(now / window) * window
+            data = counter_ref.get(transaction=transaction).to_dict() or {}
+            
+            # Counts for the current and previous fixed windows
+            if data.get('windowStart') == window_start:
+                current, previous = data.get('count', 0), data.get('previousCount', 0)
+            elif data.get('windowStart') == window_start - window:
+                current, previous = 0, data.get('count', 0)
+            else:
+                current, previous = 0, 0
+            
+            # The previous window counts in proportion to how much of it the sliding window still covers
+            weight = 1 - (now - window_start) / window
+            estimate = previous * weight + current
+            if estimate + 1 > limit:
+                if current + 1 > limit:
+                    # Wait until this window, carried over as the previous one, has faded enough
+                    retry_after = window_start + window + (1 - (limit - 1) / current) * window - now
+                else:
+                    retry_after = (weight - (limit - 1 - current) / previous) * window
+                return False, 0, max(0.0, retry_after)
+            
+            transaction.set(counter_ref, {
+                'key': key,
+                'windowStart': window_start,
+                'count': current + 1,
+                'previousCount': previous,
+                'updatedAt': datetime.now()
+            })
+            return True, max(0, int(limit - estimate - 1)), 0.0
+        
+        return run_in_transaction(check_and_count)
+    
+    def tracked(self) -> int:
+        return 0
+
+
+def _parse_quota(value: str, default: Tuple[int, int]) -> Tuple[int, float]:
+    """Parse a 'count/seconds' quota setting"""
+    try:
+        count, seconds = str(value).split('/')
+        return int(count), float(seconds)
+    except (TypeError, ValueError):
+        return default
+
+
+class QuotaManager:
+    """Check per-user, per-operation write quotas"""
+    
+    def __init__(self, store=None, quotas: Dict[str, Tuple[int, float]] = None):
+        self.store = store or MemoryQuotaStore()
+        self.quotas = dict(quotas or DEFAULT_QUOTAS)
+        self._lock = threading.Lock()
+        self._counters = {operation: {'allowed': 0, 'throttled': 0} for operation in self.quotas}
+    
+    @classmethod
+    def from_config(cls) -> 'QuotaManager':
+        """Build a quota manager from QUOTA_BACKEND and QUOTA_<OPERATION> settings"""
+        quotas = {
+            operation: _parse_quota(get_config_value(f'QUOTA_{operation.upper()}', None), default)
+            for operation, default in DEFAULT_QUOTAS.items()
+        }
+        if str(get_config_value('QUOTA_BACKEND', 'memory')).lower() == 'firestore':
+            store = FirestoreQuotaStore()
+        else:
+            store = MemoryQuotaStore(int(get_config_value('QUOTA_MAX_TRACKED_USERS', DEFAULT_MAX_TRACKED_USERS)))
+        return cls(store, quotas)
+    
+    def check(self, user_id: str, operation: str) -> Dict:
+        """Spend one write of a user's quota; the result says whether it was allowed and why not"""
+        limit, window = self.quotas[operation]
+        try:
+            allowed, remaining, retry_after = self.store.hit(f"{user_id}_{operation}", limit, window)
+        except Exception:
+            # A failing quota store must not take writes down with it
+            allowed, remaining, retry_after = True, limit, 0.0
+        
+        with self._lock:
+            self._counters[operation]['allowed' if allowed else 'throttled'] += 1
+        
+        result = {
+            'allowed': allowed,
+            'operation': operation,
+            'limit': limit,
+            'window_seconds': window,
+            'remaining': remaining,
+            'retry_after': round(retry_after, 1)
+        }
+        if not allowed:
+            label = OPERATION_LABELS.get(operation, operation)
+            result['message'] = (f"You've reached the limit of {limit} {label} per {format_retry_after(window)}. "
+                                 f"Try again in {format_retry_after(retry_after)}.")
+        return result
+    
+    def stats(self) -> Dict:
+        """Allowed and throttled counts per operation"""
+        with self._lock:
+            return {
+                'operations': {operation: dict(counts) for operation, counts in self._counters.items()},
+                'tracked': self.store.tracked()
+            }
+
+
+_quota_manager = None
+_quota_manager_lock = threading.Lock()
+
+
+def get_quota_manager() -> QuotaManager:
+    """Get the process-wide quota manager"""
+    global _quota_manager
+    if _quota_manager is None:
+        with _quota_manager_lock:
+            if _quota_manager is None:
+                _quota_manager = QuotaManager.from_config()
+    return _quota_manager
@@ -0,0 +1,187 @@
+"""
+Token-bucket throttling for login attempts
+
+Each login is checked against two buckets before any user lookup or bcrypt
+work: one per account identifier (email/username) and one per client address.
+Buckets live in a bounded store, so memory stays flat under credential
+stuffing from many identifiers. A bucket that has refilled is equivalent to
+one that was never created, so those are evicted first; then the least
+recently used bucket that still has tokens. A drained bucket, the one that is
+actually throttling someone, is dropped only when every bucket is drained.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from firebase import get_config_value
+
+# Attempts allowed per identifier, refilled evenly across the window
+DEFAULT_ACCOUNT_LIMIT = 5
+DEFAULT_ACCOUNT_WINDOW_SECONDS = 300
+
+# Attempts allowed per client address, refilled evenly across the window
+DEFAULT_CLIENT_LIMIT = 20
+DEFAULT_CLIENT_WINDOW_SECONDS = 60
+
+# Buckets kept per scope before refilled, then least recently used, ones are dropped
+DEFAULT_MAX_KEYS = 10000
+
+
+class TokenBucketStore:
+    """Token buckets keyed by identifier, bounded to max_keys entries"""
+    
+    def __init__(self, capacity: int, window_seconds: float, max_keys: int = DEFAULT_MAX_KEYS):
+        self.capacity = capacity
+        self.refill_rate = capacity / window_seconds
+        self.max_keys = max_keys
+        # key -> (tokens, last refill time); ordered from least to most recently used
+        self._buckets: OrderedDict = OrderedDict()
+        # A sweep for refilled buckets scans the whole store, so it runs at most once per token refilled
+        self._next_sweep = 0.0
+    
+    def available(self, key: str, now: float) -> float:
+        """Tokens currently in a key's bucket"""
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.refill_rate)
+    
+    def retry_after(self, key: str, now: float) -> float:
+        """Seconds until a key's bucket holds a whole token"""
+        missing = 1 - self.available(key, now)
+        return max(0.0, missing / self.refill_rate)
+    
+    def take(self, key: str, now: float):
+        """Remove one token from a key's bucket"""
+        self._buckets[key] = (self.available(key, now) - 1, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_keys:
+            self._evict(key, now)
+    
+    def _evict(self, keep: str, now: float):
+        """Shrink to max_keys, dropping refilled buckets, then ones with tokens left, then drained ones"""
+        if now >= self._next_sweep:
+            self._next_sweep = now + 1 / self.refill_rate
+            for key in [key for key in self._buckets if key != keep and self.available(key, now) >= self.capacity]:
+                del self._buckets[key]
+        
+        while len(self._buckets) > self.max_keys:
+            # Least recently used first; a flood of new identifiers leaves each with tokens to spare,
+            # so it evicts its own buckets before those of accounts it has throttled
+            victim = next((key for key in self._buckets if key != keep and self.available(key, now) >= 1), None)
+            if victim is None:
+                victim = next(key for key in self._buckets if key != keep)
+            del self._buckets[victim]
+    
+    def reset(self, key: str):
+        """Refill a key's bucket"""
+        self._buckets.pop(key, None)
+    
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class LoginRateLimiter:
+    """Per-identifier and per-client login throttle with rejection counters"""
+    
+    def __init__(self, account_limit: int = DEFAULT_ACCOUNT_LIMIT,
+                 account_window: float = DEFAULT_ACCOUNT_WINDOW_SECONDS,
+                 client_limit: int = DEFAULT_CLIENT_LIMIT,
+                 client_window: float = DEFAULT_CLIENT_WINDOW_SECONDS,
+                 max_keys: int = DEFAULT_MAX_KEYS):
+        self._lock = threading.Lock()
+        self._scopes = {
+            'account': TokenBucketStore(account_limit, account_window, max_keys),
+            'client': TokenBucketStore(client_limit, client_window, max_keys)
+        }
+        self._allowed = 0
+        self._rejected = {scope: 0 for scope in self._scopes}
+    
+    @classmethod
+    def from_config(cls) -> 'LoginRateLimiter':
+        """Build a limiter from the LOGIN_* settings"""
+        return cls(
+            account_limit=int(get_config_value('LOGIN_ACCOUNT_LIMIT', DEFAULT_ACCOUNT_LIMIT)),
+            account_window=float(get_config_value('LOGIN_ACCOUNT_WINDOW_SECONDS', DEFAULT_ACCOUNT_WINDOW_SECONDS)),
+            client_limit=int(get_config_value('LOGIN_CLIENT_LIMIT', DEFAULT_CLIENT_LIMIT)),
+            client_window=float(get_config_value('LOGIN_CLIENT_WINDOW_SECONDS', DEFAULT_CLIENT_WINDOW_SECONDS)),
+            max_keys=int(get_config_value('LOGIN_LIMITER_MAX_KEYS', DEFAULT_MAX_KEYS))
+        )
+    
+    def check(self, identifier: str, client: Optional[str]) -> Tuple[bool, float]:
+        """Spend one attempt from both buckets, or return the seconds to wait if either is empty"""
+        keys = {'account': identifier.strip().lower(), 'client': client}
+        now = time.monotonic()
+        
+        with self._lock:
+            waits = {scope: self._scopes[scope].retry_after(key, now)
+                     for scope, key in keys.items() if key}
+            blocked = [scope for scope, wait in waits.items() if wait > 0]
+            
+            # Nothing is spent on a rejected attempt, so the wait does not keep growing
+            if blocked:
+                for scope in blocked:
+                    self._rejected[scope] += 1
+                return False, max(waits[scope] for scope in blocked)
+            
+            for scope, key in keys.items():
+                if key:
+                    self._scopes[scope].take(key, now)
+            self._allowed += 1
+            return True, 0.0
+    
+    def record_success(self, identifier: str):
+        """Refill an identifier's bucket after a successful login so typos are forgiven"""
+        with self._lock:
+            self._scopes['account'].reset(identifier.strip().lower())
+    
+    def stats(self) -> Dict:
+        """Attempt counters and bucket counts"""
+        with self._lock:
+            return {
+                'allowed': self._allowed,
+                'rejected': dict(self._rejected),
+                'tracked': {scope: len(store) for scope, store in self._scopes.items()}
+            }
+    
+    def to_prometheus(self) -> str:
+        """Counters in the Prometheus text exposition format"""
+        stats = self.stats()
+        lines = [
+            "# HELP login_attempts_allowed_total Login attempts let through to the password check",
+            "# TYPE login_attempts_allowed_total counter",
+            f"login_attempts_allowed_total {stats['allowed']}",
+            "# HELP login_attempts_rejected_total Login attempts rejected by the rate limiter",
+            "# TYPE login_attempts_rejected_total counter"
+        ]
+        for scope, count in stats['rejected'].items():
+            lines.append(f'login_attempts_rejected_total{{scope="{scope}"}} {count}')
+        lines += [
+            "# HELP login_limiter_tracked_keys Token buckets currently held in memory",
+            "# TYPE login_limiter_tracked_keys gauge"
+        ]
+        for scope, count in stats['tracked'].items():
+            lines.append(f'login_limiter_tracked_keys{{scope="{scope}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+_login_limiter = None
+_login_limiter_lock = threading.Lock()
+
+
+def get_login_limiter() -> LoginRateLimiter:
+    """Get the process-wide login limiter, shared by every session"""
+    global _login_limiter
+    if _login_limiter is None:
+        with _login_limiter_lock:
+            if _login_limiter is None:
+                _login_limiter = LoginRateLimiter.from_config()
+    return _login_limiter
+
+
+def format_retry_after(seconds: float) -> str:
+    """Human-readable wait such as '45 seconds' or '3 minutes'"""
+    seconds = math.ceil(seconds)
+    if seconds < 60:
+        return f"{seconds} second{'s' if seconds != 1 else ''}"
+    minutes = math.ceil(seconds / 60)
+    return f"{minutes} minute{'s' if minutes != 1 else ''}"
@@ -0,0 +1,464 @@
+"""
+Collaborative-filtering coffee recommendations
+
+Ratings from cuppings (overall_score), coffee bags (rating and wouldBuyAgain)
+and coffee shop reviews (coffeeRating) are scaled to 0..1 and collected into
+a sparse user x coffee matrix, kept as coordinate arrays. An offline job
+factorizes it with implicit-feedback alternating least squares: liked coffees
+are positive preferences, disliked ones negative, and the strength of the
+rating is the confidence. Each user's top-N unrated public coffees are written
+to one userRecommendations document, so the dashboard serves them with a
+single read. Between full retrains, the job folds in only users with new or
+changed ratings against the saved coffee factors and rewrites just their lists.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import streamlit as st
+from firebase import get_firestore_db, get_config_value, FirebaseManager, FIRESTORE_BATCH_LIMIT
+from cupping_search import normalize_tokens
+
+DEFAULT_FACTORS = 32
+DEFAULT_ITERATIONS = 12
+DEFAULT_TOP_N = 10
+DEFAULT_MODEL_PATH = 'recommender_model.npz'
+
+# Regularization of the factor solves, and how much a strong rating outweighs an unrated coffee
+REGULARIZATION = 5.0
+CONFIDENCE_ALPHA = 10.0
+
+# Ratings above this are liked; at exactly neutral a rating only marks the coffee as tried
+NEUTRAL_RATING = 0.5
+
+# A fold-in re-reads each changed user's ratings; past this share of users a full retrain is cheaper
+MAX_INCREMENTAL_SHARE = 0.2
+
+# Conjugate-gradient steps per half-step of a full fit, warm-started from the previous factors;
+# a fold-in starts cold for new users and coffees, so it runs as many steps as there are factors
+CG_STEPS = 3
+
+
+def _stars(value) -> Optional[float]:
+    """A 1-5 star rating scaled to 0..1, with 3 stars neutral"""
+    if not isinstance(value, (int, float)):
+        return None
+    return min(1.0, max(0.0, (value - 1) / 4))
+
+
+def _cupping_rating(cupping: Dict) -> Optional[float]:
+    # 80/100, the form's default, is neutral; 100 is the top of the scale and 60 the bottom
+    score = cupping.get('overall_score')
+    if not isinstance(score, (int, float)):
+        return None
+    return min(1.0, max(0.0, (score - 60) / 40))
+
+
+def _bag_rating(bag: Dict) -> Optional[float]:
+    # Would-buy-again is as strong a signal as the stars, so the two are averaged
+    signals = [_stars(bag.get('rating'))]
+    if isinstance(bag.get('wouldBuyAgain'), bool):
+        signals.append(1.0 if bag['wouldBuyAgain'] else 0.0)
+    signals = [s for s in signals if s is not None]
+    return sum(signals) / len(signals) if signals else None
+
+
+# Collection -> where its ratings come from: owner, public flag, last-change fields,
+# coffee name and detail fields, how the coffee is described, and the 0..1 rating
+RATING_SOURCES = {
+    'cuppings': {
+        'owner': 'user_id', 'public': 'is_public', 'updated': 'updated_at',
+        'name': 'coffee_name', 'detail': 'origin', 'kind': 'beans',
+        'fields': ['overall_score'], 'rating': _cupping_rating
+    },
+    'coffeeBags': {
+        'owner': 'trackedBy', 'public': 'isPublic', 'updated': 'updatedAt',
+        'name': 'coffeeName', 'detail': 'origin', 'kind': 'beans',
+        'fields': ['rating', 'wouldBuyAgain'], 'rating': _bag_rating
+    },
+    'coffeeShopsReviews': {
+        'owner': 'reviewedBy', 'public': 'isPublic', 'updated': 'updatedAt',
+        'name': 'coffeeType', 'detail': 'shopName', 'kind': 'shop',
+        'fields': ['coffeeRating'], 'rating': lambda review: _stars(review.get('coffeeRating'))
+    }
+}
+
+
+def _source_fields(source: Dict) -> List[str]:
+    return [source['owner'], source['public'], source['updated'], source['name'], source['detail'], *source['fields']]
+
+
+def item_key(kind: str, name: Optional[str], detail: Optional[str]) -> Optional[str]:
+    """Identity of a coffee across records: normalized name and origin (beans) or shop (drinks)"""
+    name_tokens = normalize_tokens(name)
+    detail_tokens = normalize_tokens(detail)
+    if kind == 'shop':
+        # A review without a coffee type still rates the shop's coffee
+        name_tokens = name_tokens or ['coffee']
+        if not detail_tokens:
+            return None
+    if not name_tokens:
+        return None
+    return f"{kind}:{' '.join(name_tokens)}|{' '.join(detail_tokens)}"
+
+
+def rating_event(collection: str, record: Dict) -> Optional[Tuple]:
+    """(user_id, item key, name, detail, kind, rating 0..1, public) for one record, or None if it rates nothing"""
+    source = RATING_SOURCES[collection]
+    user_id = record.get(source['owner'])
+    rating = source['rating'](record)
+    key = item_key(source['kind'], record.get(source['name']), record.get(source['detail']))
+    if not user_id or rating is None or key is None:
+        return None
+    name = record.get(source['name']) or 'Coffee'
+    return user_id, key, name, record.get(source['detail']) or '', source['kind'], rating, bool(record.get(source['public']))
+
+
+def _confidence(ratings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Preference (liked or not) and confidence of each rating"""
+    preference = (ratings > NEUTRAL_RATING).astype(np.float64)
+    confidence = 1.0 + CONFIDENCE_ALPHA * np.abs(2 * ratings - 1)
+    return preference, confidence
+
+
+def _solve(fixed: np.ndarray, rows: np.ndarray, cols: np.ndarray, ratings: np.ndarray, n_rows: int,
+           solve_rows: Optional[np.ndarray] = None, initial: Optional[np.ndarray] = None,
+           steps: int = CG_STEPS) -> np.ndarray:
+    """One half-step of implicit ALS: factors for n_rows given the fixed factors of the other side"""
+    # Each row solves (F'F + F_r'(C_r - I)F_r + reg I) x = F_r' C_r p_r by conjugate gradient, all rows
+    # at once: a step costs one dot product per observation instead of an f x f outer product each
+    factors = fixed.shape[1]
+    result = np.zeros((n_rows, factors), dtype=np.float32) if initial is None else initial.copy()
+    if solve_rows is not None:
+        keep = np.isin(rows, solve_rows)
+        rows, cols, ratings = rows[keep], cols[keep], ratings[keep]
+    if not len(rows):
+        return result
+    
+    order = np.argsort(rows, kind='stable')
+    rows, cols, ratings = rows[order], cols[order], ratings[order]
+    preference, confidence = _confidence(ratings)
+    present, starts, counts = np.unique(rows, return_index=True, return_counts=True)
+    position = np.repeat(np.arange(len(present)), counts)
+    
+    # Float32 throughout halves the memory traffic of the per-observation arrays
+    gram = (fixed.T.astype(np.float64) @ fixed + REGULARIZATION * np.eye(factors)).astype(np.float32)
+    observed = fixed[cols]
+    weight = (confidence - 1.0).astype(np.float32)
+    
+    def apply(x):
+        dots = np.einsum('ij,ij->i', observed, x[position])
+        return x @ gram + np.add.reduceat((weight * dots)[:, None] * observed, starts, axis=0)
+    
+    x = result[present]
+    residual = np.add.reduceat((confidence * preference).astype(np.float32)[:, None] * observed, starts, axis=0) - apply(x)
+    direction = residual.copy()
+    residual_norm = np.einsum('ij,ij->i', residual, residual)
+    for _ in range(steps):
+        product = apply(direction)
+        curvature = np.einsum('ij,ij->i', direction, product)
+        # Rows that have already converged stop moving
+        alpha = np.divide(residual_norm, curvature, out=np.zeros_like(curvature), where=curvature > 1e-9)
+        x += alpha[:, None] * direction
+        residual -= alpha[:, None] * product
+        new_norm = np.einsum('ij,ij->i', residual, residual)
+        beta = np.divide(new_norm, residual_norm, out=np.zeros_like(new_norm), where=residual_norm > 1e-9)
+        direction = residual + beta[:, None] * direction
+        residual_norm = new_norm
+    result[present] = x
+    return result
+
+
+class RecommendationModel:
+    """Coffee and user factors of one trained model, plus what is needed to extend it"""
+    
+    def __init__(self, factors: int = DEFAULT_FACTORS):
+        self.factors = factors
+        self.item_keys: List[str] = []
+        self.item_names: List[str] = []
+        self.item_details: List[str] = []
+        self.item_kinds: List[str] = []
+        self.item_public: List[bool] = []
+        self.item_factors = np.zeros((0, factors), dtype=np.float32)
+        self.user_ids: List[str] = []
+        self.user_factors = np.zeros((0, factors), dtype=np.float32)
+        self.trained_through: Optional[datetime] = None
+        self.full_trained_at: Optional[datetime] = None
+        self._item_index: Dict[str, int] = {}
+        self._user_index: Dict[str, int] = {}
+    
+    def _reindex(self):
+        self._item_index = {key: i for i, key in enumerate(self.item_keys)}
+        self._user_index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+    
+    def item_code(self, key: str, name: str, detail: str, kind: str, public: bool) -> int:
+        """Index of a coffee, appending it (with zero factors) if the model has not seen it"""
+        code = self._item_index.get(key)
+        if code is None:
+            code = self._item_index[key] = len(self.item_keys)
+            self.item_keys.append(key)
+            self.item_names.append(name)
+            self.item_details.append(detail)
+            self.item_kinds.append(kind)
+            self.item_public.append(False)
+        if public:
+            # Recommendations show how a coffee was described publicly, never in a private record
+            self.item_public[code] = True
+            self.item_names[code], self.item_details[code] = name, detail
+        return code
+    
+    def user_code(self, user_id: str) -> int:
+        """Index of a user, appending them if the model has not seen them"""
+        code = self._user_index.get(user_id)
+        if code is None:
+            code = self._user_index[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+        return code
+    
+    def observations(self, events: Iterable[Tuple]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(user codes, item codes, mean rating) per rated pair, registering new users and coffees"""
+        users, items, ratings = [], [], []
+        for user_id, key, name, detail, kind, rating, public in events:
+            users.append(self.user_code(user_id))
+            items.append(self.item_code(key, name, detail, kind, public))
+            ratings.append(rating)
+        if not users:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        
+        # A coffee rated several times by one user (a cupping and a bag, say) counts once, at the mean
+        pairs = np.array(users, dtype=np.int64) * len(self.item_keys) + np.array(items, dtype=np.int64)
+        unique_pairs, inverse = np.unique(pairs, return_inverse=True)
+        means = np.bincount(inverse, weights=ratings) / np.bincount(inverse)
+        return unique_pairs // len(self.item_keys), unique_pairs % len(self.item_keys), means
+    
+    def _pad(self):
+        """Give users and coffees registered since the last solve a row of factors"""
+        if len(self.item_factors) < len(self.item_keys):
+            self.item_factors = np.vstack([self.item_factors, np.zeros((len(self.item_keys) - len(self.item_factors), self.factors), dtype=np.float32)])
+        if len(self.user_factors) < len(self.user_ids):
+            self.user_factors = np.vstack([self.user_factors, np.zeros((len(self.user_ids) - len(self.user_factors), self.factors), dtype=np.float32)])
+    
+    def fit(self, users: np.ndarray, items: np.ndarray, ratings: np.ndarray, iterations: int = DEFAULT_ITERATIONS):
+        """Factorize the whole matrix from scratch"""
+        rng = np.random.default_rng(0)
+        self.item_factors = (rng.standard_normal((len(self.item_keys), self.factors)) * 0.01).astype(np.float32)
+        self.user_factors = np.zeros((len(self.user_ids), self.factors), dtype=np.float32)
+        for _ in range(iterations):
+            self.user_factors = _solve(self.item_factors, users, items, ratings, len(self.user_ids), initial=self.user_factors)
+            self.item_factors = _solve(self.user_factors, items, users, ratings, len(self.item_keys), initial=self.item_factors)
+    
+    def fold_in(self, users: np.ndarray, items: np.ndarray, ratings: np.ndarray):
+        """Re-solve the given users' factors, and those of coffees only they have rated, keeping the rest fixed"""
+        known_items = len(self.item_factors)
+        self._pad()
+        changed = np.unique(users)
+        
+        known = items < known_items
+        solved = _solve(self.item_factors, users[known], items[known], ratings[known], len(self.user_ids), changed, steps=self.factors)
+        self.user_factors[changed] = solved[changed]
+        
+        new_items = np.arange(known_items, len(self.item_keys))
+        if len(new_items):
+            solved = _solve(self.user_factors, items, users, ratings, len(self.item_keys), new_items, steps=self.factors)
+            self.item_factors[new_items] = solved[new_items]
+            # Now that the new coffees have factors, account for them in their raters' factors too
+            solved = _solve(self.item_factors, users, items, ratings, len(self.user_ids), changed, steps=self.factors)
+            self.user_factors[changed] = solved[changed]
+    
+    def recommend(self, users: np.ndarray, items: np.ndarray, top_n: int) -> Dict[str, List[Dict]]:
+        """Top-N unrated public coffees for every user appearing in the observations"""
+        order = np.argsort(users, kind='stable')
+        rated_users, starts = np.unique(users[order], return_index=True)
+        rated_items = np.split(items[order], starts[1:])
+        
+        recommendations = {}
+        candidates = np.array(self.item_public, dtype=bool)
+        if not candidates.any():
+            return {self.user_ids[u]: [] for u in rated_users}
+        # Score users in blocks so the block x coffees score matrix stays around 16M floats
+        per_block = max(1, 2**24 // max(1, len(self.item_keys)))
+        for first in range(0, len(rated_users), per_block):
+            block = rated_users[first:first + per_block]
+            scores = self.user_factors[block] @ self.item_factors.T
+            scores[:, ~candidates] = -np.inf
+            for row, seen in enumerate(rated_items[first:first + per_block]):
+                scores[row, seen] = -np.inf
+            
+            n = min(top_n, scores.shape[1])
+            top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            ranked = np.argsort(-top_scores, axis=1, kind='stable')
+            for row, user in enumerate(block.tolist()):
+                recommendations[self.user_ids[user]] = [
+                    {'name': self.item_names[i], 'detail': self.item_details[i], 'kind': self.item_kinds[i], 'score': round(float(s), 3)}
+                    for i, s in zip(top[row, ranked[row]].tolist(), top_scores[row, ranked[row]].tolist())
+                    # Only coffees the model expects the user to like
+                    if s > 0
+                ]
+        return recommendations
+    
+    def save(self, path: str):
+        """Write the model to a compressed .npz file"""
+        metadata = {
+            'factors': self.factors,
+            'item_keys': self.item_keys,
+            'item_names': self.item_names,
+            'item_details': self.item_details,
+            'item_kinds': self.item_kinds,
+            'user_ids': self.user_ids,
+            'trained_through': self.trained_through.isoformat() if self.trained_through else None,
+            'full_trained_at': self.full_trained_at.isoformat() if self.full_trained_at else None
+        }
+        temporary = f"{path}.tmp.npz"
+        np.savez_compressed(temporary, item_factors=self.item_factors, user_factors=self.user_factors,
+                            item_public=np.array(self.item_public, dtype=bool), metadata=np.array(json.dumps(metadata)))
+        # Replace atomically so a crashed job never leaves a half-written model behind
+        os.replace(temporary, path)
+    
+    @classmethod
+    def load(cls, path: str) -> Optional['RecommendationModel']:
+        """Read a model written by save(), or None if there is none"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            metadata = json.loads(str(data['metadata']))
+            model = cls(metadata['factors'])
+            model.item_factors = data['item_factors']
+            model.user_factors = data['user_factors']
+            model.item_public = data['item_public'].tolist()
+        for name in ('item_keys', 'item_names', 'item_details', 'item_kinds', 'user_ids'):
+            setattr(model, name, metadata[name])
+        for name in ('trained_through', 'full_trained_at'):
+            setattr(model, name, datetime.fromisoformat(metadata[name]) if metadata[name] else None)
+        model.trained_through = FirebaseManager.to_utc(model.trained_through)
+        model._reindex()
+        return model
+
+
+class RecommendationManager:
+    """Train the recommender offline and serve each user's stored recommendations"""
+    
+    def __init__(self, factors: int = DEFAULT_FACTORS, iterations: int = DEFAULT_ITERATIONS,
+                 top_n: int = DEFAULT_TOP_N, model_path: str = DEFAULT_MODEL_PATH):
+        self.factors = factors
+        self.iterations = iterations
+        self.top_n = top_n
+        self.model_path = model_path
+    
+    @property
+    def db(self):
+        """Firestore client, resolved on first use"""
+        return get_firestore_db()
+    
+    def get_recommendations(self, user_id: str) -> Optional[Dict]:
+        """A user's stored recommendation list, from a single document read"""
+        try:
+            if not self.db:
+                return None
+            doc = self.db.collection('userRecommendations').document(user_id).get()
+            return doc.to_dict() if doc.exists else None
+        except Exception as e:
+            st.error(f"Error getting recommendations: {e}")
+            return None
+    
+    def _read_events(self, since: Optional[datetime] = None, user_ids: Optional[Iterable[str]] = None) -> Tuple[List[Tuple], Optional[datetime]]:
+        """Rating events from every source, optionally only changed since a time or only for some users"""
+        events = []
+        latest = None
+        for collection, source in RATING_SOURCES.items():
+            queries = [self.db.collection(collection)]
+            if user_ids is not None:
+                queries = [self.db.collection(collection).where(source['owner'], '==', user_id) for user_id in user_ids]
+            elif since is not None:
+                # Inclusive, so records sharing the watermark's timestamp are not missed; folding in twice is harmless
+                queries = [queries[0].where(source['updated'], '>=', since)]
+            for query in queries:
+                for doc in FirebaseManager.apply_projection(query, _source_fields(source)).stream():
+                    record = doc.to_dict()
+                    # Kept in UTC: it goes back to Firestore as the next run's bound
+                    updated = FirebaseManager.to_utc(record.get(source['updated']))
+                    if updated:
+                        latest = max(latest, updated) if latest else updated
+                    event = rating_event(collection, record)
+                    if event:
+                        events.append(event)
+        return events, latest
+    
+    def train(self, full: bool = False, dry_run: bool = False) -> Dict:
+        """Retrain and rewrite recommendation lists; incremental unless forced full or there is no model"""
+        started = datetime.now()
+        model = None if full else RecommendationModel.load(self.model_path)
+        if model is not None and model.factors != self.factors:
+            model = None
+        
+        if model is not None:
+            changes, latest = self._read_events(since=model.trained_through)
+            changed_users = sorted({event[0] for event in changes})
+            if len(changed_users) > MAX_INCREMENTAL_SHARE * max(1, len(model.user_ids)):
+                model = None
+        
+        if model is None:
+            mode = 'full'
+            model = RecommendationModel(self.factors)
+            events, latest = self._read_events()
+            users, items, ratings = model.observations(events)
+            model.fit(users, items, ratings, self.iterations)
+            model.full_trained_at = started
+        else:
+            mode = 'incremental'
+            # Fold-in needs every rating of a changed user, not just the changed ones
+            events, _ = self._read_events(user_ids=changed_users)
+            users, items, ratings = model.observations(events)
+            model.fold_in(users, items, ratings)
+        
+        recommendations = model.recommend(users, items, self.top_n)
+        if latest:
+            model.trained_through = max(latest, model.trained_through) if model.trained_through else latest
+        if not dry_run:
+            self._write(recommendations, started)
+            model.save(self.model_path)
+        
+        return {
+            'mode': mode,
+            'users': len(model.user_ids),
+            'coffees': len(model.item_keys),
+            'ratings': len(ratings),
+            'lists': len(recommendations),
+            'seconds': round((datetime.now() - started).total_seconds(), 2)
+        }
+    
+    def _write(self, recommendations: Dict[str, List[Dict]], generated_at: datetime):
+        """Store each user's list as userRecommendations/{user_id}, in batches"""
+        batch = self.db.batch()
+        pending_writes = 0
+        for user_id, items in recommendations.items():
+            batch.set(self.db.collection('userRecommendations').document(user_id),
+                      {'userId': user_id, 'items': items, 'generatedAt': generated_at})
+            pending_writes += 1
+            if pending_writes >= FIRESTORE_BATCH_LIMIT:
+                batch.commit()
+                batch = self.db.batch()
+                pending_writes = 0
+        if pending_writes:
+            batch.commit()
+
+
+_recommendation_manager = None
+_recommendation_manager_lock = threading.Lock()
+
+
+def get_recommendation_manager() -> RecommendationManager:
+    """Get the process-wide recommendation manager (RECOMMENDER_FACTORS, RECOMMENDER_ITERATIONS, RECOMMENDER_TOP_N, RECOMMENDER_MODEL_PATH)"""
+    global _recommendation_manager
+    if _recommendation_manager is None:
+        with _recommendation_manager_lock:
+            if _recommendation_manager is None:
+                _recommendation_manager = RecommendationManager(
+                    int(get_config_value('RECOMMENDER_FACTORS', DEFAULT_FACTORS)),
+                    int(get_config_value('RECOMMENDER_ITERATIONS', DEFAULT_ITERATIONS)),
+                    int(get_config_value('RECOMMENDER_TOP_N', DEFAULT_TOP_N)),
+                    get_config_value('RECOMMENDER_MODEL_PATH', DEFAULT_MODEL_PATH)
+                )
+    return _recommendation_manager
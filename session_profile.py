@@ -0,0 +1,114 @@
+"""
+Slim, immutable user profiles held in session state
+
+Sessions keep a SessionProfile instead of the full user document: no password
+hash or login bookkeeping, and one shared instance per user across sessions
+through a process-wide LRU cache.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from types import MappingProxyType
+from typing import Dict, Optional
+from firebase import get_config_value
+
+# Profiles kept in the process-wide cache before the least recently used are dropped
+DEFAULT_PROFILE_CACHE_SIZE = 10000
+
+
+class SessionProfile:
+    """Read-only view of the user fields the UI needs"""
+    
+    __slots__ = ('user_id', 'username', 'email', 'display_name', 'preferences', 'created_at')
+    
+    def __init__(self, user_id: str, username: str, email: Optional[str] = None,
+                 preferences: Optional[Dict] = None, created_at: Optional[datetime] = None):
+        preferences = dict(preferences or {})
+        display_name = username if preferences.get('show_name', True) else "Anonymous"
+        for name, value in (('user_id', user_id), ('username', username), ('email', email),
+                            ('display_name', display_name), ('preferences', MappingProxyType(preferences)),
+                            ('created_at', created_at)):
+            object.__setattr__(self, name, value)
+    
+    @classmethod
+    def from_user(cls, user: Dict) -> 'SessionProfile':
+        """Build a profile from a user document or session token payload"""
+        return cls(user['user_id'], user.get('username'), user.get('email'),
+                   user.get('preferences'), user.get('created_at'))
+    
+    def with_preferences(self, preferences: Dict) -> 'SessionProfile':
+        """Copy of this profile with new preferences"""
+        return SessionProfile(self.user_id, self.username, self.email, preferences, self.created_at)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("SessionProfile is immutable")
+    
+    def __delattr__(self, name):
+        raise AttributeError("SessionProfile is immutable")
+    
+    # Mapping-style access keeps existing current_user['user_id'] / .get() call sites working
+    def __getitem__(self, key: str):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+    
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+    
+    def __repr__(self) -> str:
+        return f"SessionProfile(user_id={self.user_id!r}, username={self.username!r})"
+
+
+class ProfileCache:
+    """Thread-safe LRU of session profiles keyed by user id"""
+    
+    def __init__(self, max_size: int = DEFAULT_PROFILE_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._profiles: OrderedDict = OrderedDict()
+    
+    def get(self, user_id: str) -> Optional[SessionProfile]:
+        """Cached profile for a user, if any"""
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            if profile is not None:
+                self._profiles.move_to_end(user_id)
+            return profile
+    
+    def put(self, profile: SessionProfile) -> SessionProfile:
+        """Cache a profile, replacing any older one for the same user"""
+        with self._lock:
+            self._profiles[profile.user_id] = profile
+            self._profiles.move_to_end(profile.user_id)
+            while len(self._profiles) > self.max_size:
+                self._profiles.popitem(last=False)
+            return profile
+    
+    def share(self, profile: SessionProfile) -> SessionProfile:
+        """The cached profile for this user, caching the given one if there is none"""
+        return self.get(profile.user_id) or self.put(profile)
+    
+    def invalidate(self, user_id: str):
+        """Drop a user's profile so sessions rebuild it"""
+        with self._lock:
+            self._profiles.pop(user_id, None)
+    
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+
+_profile_cache = None
+_profile_cache_lock = threading.Lock()
+
+
+def get_profile_cache() -> ProfileCache:
+    """Get the process-wide profile cache (PROFILE_CACHE_SIZE entries)"""
+    global _profile_cache
+    if _profile_cache is None:
+        with _profile_cache_lock:
+            if _profile_cache is None:
+                _profile_cache = ProfileCache(int(get_config_value('PROFILE_CACHE_SIZE', DEFAULT_PROFILE_CACHE_SIZE)))
+    return _profile_cache
@@ -0,0 +1,106 @@
+"""
+Revoked session tokens, mirrored in memory
+
+Logging out, or reissuing a token after a preference change, records the old
+token's id in revokedSessions. Each process keeps the ids of tokens that have
+not expired yet in a set, topped up with newly revoked ones every
+SESSION_REVOCATION_REFRESH_SECONDS, so restoring a session checks memory rather
+than reading Firestore. If a refresh fails the last known set stays in use, so
+a Firestore outage delays revocations instead of logging everyone out.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from firebase import get_firestore_db, get_config_value, FirebaseManager
+
+DEFAULT_REFRESH_SECONDS = 30
+
+
+class RevokedSessionCache:
+    """Ids of revoked, unexpired session tokens, refreshed on an interval"""
+    
+    def __init__(self, refresh_seconds: float = DEFAULT_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        # jti -> expiry as a Unix time; entries are dropped once the token would have expired anyway
+        self._expiry: Dict[str, float] = {}
+        self._loaded_through: Optional[datetime] = None
+        self._refreshed_at = 0.0
+    
+    def revoke(self, jti: str, expires: float):
+        """Record a revocation in Firestore and in this process's set"""
+        with self._lock:
+            self._expiry[jti] = expires
+        db = get_firestore_db()
+        if db:
+            db.collection('revokedSessions').document(jti).set({
+                'exp': expires,
+                # UTC, so a Firestore TTL policy on expiresAt fires when the token expires
+                'expiresAt': datetime.fromtimestamp(expires, timezone.utc),
+                'revokedAt': datetime.now(timezone.utc)
+            })
+    
+    def is_revoked(self, jti: str) -> bool:
+        """Whether a token id has been revoked, as of the last refresh"""
+        self._ensure_fresh()
+        with self._lock:
+            return jti in self._expiry
+    
+    def _ensure_fresh(self):
+        if time.monotonic() - self._refreshed_at > self.refresh_seconds:
+            try:
+                self.refresh()
+            except Exception:
+                # Keep answering from the last known set; try again at the next interval
+                self._refreshed_at = time.monotonic()
+    
+    def refresh(self) -> int:
+        """Load revocations made since the last refresh (every unexpired one the first time)"""
+        db = get_firestore_db()
+        if not db:
+            return 0
+        
+        started = datetime.now(timezone.utc)
+        query = db.collection('revokedSessions')
+        if self._loaded_through is None:
+            query = query.where('expiresAt', '>', started)
+        else:
+            # Inclusive so revocations sharing the last timestamp are not skipped
+            query = query.where('revokedAt', '>=', self._loaded_through)
+        rows = [(doc.id, doc.to_dict()) for doc in FirebaseManager.apply_projection(query, ['exp', 'revokedAt']).stream()]
+        
+        now = time.time()
+        with self._lock:
+            for jti, row in rows:
+                if row.get('exp', 0) > now:
+                    self._expiry[jti] = row['exp']
+                # Kept in UTC: it goes back to Firestore as the next query's bound
+                revoked_at = FirebaseManager.to_utc(row.get('revokedAt'))
+                if revoked_at and (self._loaded_through is None or revoked_at > self._loaded_through):
+                    self._loaded_through = revoked_at
+            if self._loaded_through is None:
+                # Nothing revoked yet: later refreshes start from before this one's query
+                self._loaded_through = started
+            self._expiry = {jti: expires for jti, expires in self._expiry.items() if expires > now}
+            self._refreshed_at = time.monotonic()
+        return len(rows)
+    
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+
+_revoked_sessions = None
+_revoked_sessions_lock = threading.Lock()
+
+
+def get_revoked_sessions() -> RevokedSessionCache:
+    """Get the process-wide revoked session cache (SESSION_REVOCATION_REFRESH_SECONDS)"""
+    global _revoked_sessions
+    if _revoked_sessions is None:
+        with _revoked_sessions_lock:
+            if _revoked_sessions is None:
+                _revoked_sessions = RevokedSessionCache(
+                    float(get_config_value('SESSION_REVOCATION_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS))
+                )
+    return _revoked_sessions
@@ -0,0 +1,296 @@
+"""
+Per-user dashboard summaries maintained incrementally by the data managers
+"""
+import streamlit as st
+from typing import Dict, Optional
+from firebase import get_firestore_db, run_in_transaction, FirebaseManager
+from datetime import datetime
+
+
+def _cupping_delta(cupping: Dict, sign: int) -> Dict:
+    """Summary contribution of one cupping record"""
+    score = cupping.get('overall_score')
+    origin = cupping.get('origin')
+    roaster = cupping.get('roaster')
+    return {'cuppings': {
+        'count': sign,
+        'scoreSum': sign * score if score else 0,
+        'scoreCount': sign if score else 0,
+        'origins': {origin: sign} if origin else {},
+        'roasters': {roaster: sign} if roaster else {}
+    }}
+
+
+def _review_delta(review: Dict, sign: int) -> Dict:
+    """Summary contribution of one coffee shop review"""
+    rating = review.get('coffeeRating')
+    preparation = review.get('preparationMethod')
+    shop = review.get('shopName')
+    return {'reviews': {
+        'count': sign,
+        'coffeeRatingSum': sign * rating if rating else 0,
+        'coffeeRatingCount': sign if rating else 0,
+        'preparations': {preparation: sign} if preparation else {},
+        'shops': {shop: sign} if shop else {}
+    }}
+
+
+def _bag_delta(bag: Dict, sign: int) -> Dict:
+    """Summary contribution of one coffee bag record"""
+    rating = bag.get('rating')
+    cost = bag.get('cost')
+    origin = bag.get('origin')
+    return {'bags': {
+        'count': sign,
+        'ratingSum': sign * rating if rating else 0,
+        'ratingCount': sign if rating else 0,
+        'totalSpent': sign * cost if cost else 0,
+        'wouldBuyAgain': sign if bag.get('wouldBuyAgain', False) else 0,
+        'origins': {origin: sign} if origin else {}
+    }}
+
+
+# Collection name -> (owner field, delta builder)
+_SUMMARY_SOURCES = {
+    'cuppings': ('user_id', _cupping_delta),
+    'coffeeShopsReviews': ('reviewedBy', _review_delta),
+    'coffeeBags': ('trackedBy', _bag_delta)
+}
+
+
+def _add_deltas(target: Dict, delta: Dict):
+    """Accumulate a nested numeric delta into target"""
+    for key, value in delta.items():
+        if isinstance(value, dict):
+            _add_deltas(target.setdefault(key, {}), value)
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+def _to_increments(delta: Dict) -> Dict:
+    """Turn a nested numeric delta into Increment transforms, dropping no-ops"""
+    increments = {}
+    for key, value in delta.items():
+        if isinstance(value, dict):
+            nested = _to_increments(value)
+            if nested:
+                increments[key] = nested
+        elif value:
+            increments[key] = FirebaseManager.increment(value)
+    return increments
+
+
+# A rebuild whose summary changed underneath it is retried this many times before giving up
+REBUILD_ATTEMPTS = 3
+
+
+def _favorite(histogram: Dict) -> str:
+    """Most frequent key with a positive count"""
+    counts = {key: count for key, count in (histogram or {}).items() if count > 0}
+    return max(counts, key=counts.get) if counts else 'N/A'
+
+
+class UserSummaryManager:
+    """Maintain one summary document per user so the dashboard is a single read"""
+    
+    @property
+    def db(self):
+        """Firestore client, resolved on first use"""
+        return get_firestore_db()
+    
+    def _summary_ref(self, user_id: str):
+        return self.db.collection('userSummaries').document(user_id)
+    
+    def apply_change(self, writer, collection: str, before: Optional[Dict], after: Optional[Dict]):
+        """Stage the summary delta for a create (before=None), update or delete (after=None)"""
+        # writer is the batch/transaction carrying the record write, so both commit atomically
+        owner_field, delta_builder = _SUMMARY_SOURCES[collection]
+        deltas_by_user: Dict[str, Dict] = {}
+        
+        for record, sign in ((before, -1), (after, 1)):
+            if record and record.get(owner_field):
+                _add_deltas(deltas_by_user.setdefault(record[owner_field], {}), delta_builder(record, sign))
+        
+        for user_id, delta in deltas_by_user.items():
+            increments = _to_increments(delta)
+            if increments:
+                writer.set(self._summary_ref(user_id), {
+                    **increments,
+                    # Lets a rebuild detect deltas committed while it was reading raw records
+                    'version': FirebaseManager.increment(1),
+                    'userId': user_id,
+                    'updatedAt': datetime.now()
+                }, merge=True)
+    
+    def add_pending_invitation(self, writer, user_id: str, invitation_id: str, expires_at: datetime):
+        """Stage a pending invitation entry for an invitee"""
+        writer.set(self._summary_ref(user_id), {
+            'pendingInvitations': {invitation_id: expires_at},
+            'version': FirebaseManager.increment(1),
+            'userId': user_id,
+            'updatedAt': datetime.now()
+        }, merge=True)
+    
+    def remove_pending_invitation(self, writer, user_id: str, invitation_id: str):
+        """Stage removal of a pending invitation once the invitee has responded"""
+        writer.set(self._summary_ref(user_id), {
+            'pendingInvitations': {invitation_id: FirebaseManager.delete_field()},
+            'version': FirebaseManager.increment(1),
+            'updatedAt': datetime.now()
+        }, merge=True)
+    
+    def get_summary(self, user_id: str) -> Optional[Dict]:
+        """Get the raw summary document for a user"""
+        try:
+            if not self.db:
+                return None
+            
+            doc = self._summary_ref(user_id).get()
+            if doc.exists:
+                return doc.to_dict()
+            return None
+            
+        except Exception as e:
+            st.error(f"Error getting user summary: {e}")
+            return None
+    
+    def get_dashboard_stats(self, user_id: str) -> Dict:
+        """Get cupping, review, bag and invitation stats from the summary document"""
+        summary = self.get_summary(user_id)
+        
+        # Users created before summaries existed get theirs built on first visit; an incremental
+        # write may have created a partial document first, so only a rebuilt one is trusted
+        if not self.is_complete(summary) and self.db:
+            summary = self.rebuild_summary(user_id)
+        elif summary:
+            self._prune_expired_invitations(user_id, summary)
+        
+        return self.summary_to_stats(summary or {})
+    
+    def _prune_expired_invitations(self, user_id: str, summary: Dict):
+        """Delete expired entries from the pendingInvitations map, which otherwise only grows"""
+        now = datetime.now()
+        expired = [invitation_id for invitation_id, expires_at in summary.get('pendingInvitations', {}).items()
+                   if not expires_at or FirebaseManager.firestore_to_datetime(expires_at) <= now]
+        if not expired:
+            return
+        try:
+            self._summary_ref(user_id).set({
+                'pendingInvitations': {invitation_id: FirebaseManager.delete_field() for invitation_id in expired}
+            }, merge=True)
+        except Exception as e:
+            st.error(f"Error pruning pending invitations: {e}")
+    
+    @staticmethod
+    def is_complete(summary: Optional[Dict]) -> bool:
+        """Whether a summary was built from the user's full history rather than only from increments"""
+        return bool(summary and summary.get('complete'))
+    
+    @staticmethod
+    def summary_to_stats(summary: Dict) -> Dict:
+        """Convert a summary document into the dashboard's stat dictionaries"""
+        cuppings = summary.get('cuppings', {})
+        reviews = summary.get('reviews', {})
+        bags = summary.get('bags', {})
+        
+        score_count = cuppings.get('scoreCount', 0)
+        coffee_rating_count = reviews.get('coffeeRatingCount', 0)
+        bag_rating_count = bags.get('ratingCount', 0)
+        total_bags = bags.get('count', 0)
+        
+        now = datetime.now()
+        pending_invitations = sum(
+            1 for expires_at in summary.get('pendingInvitations', {}).values()
+            if expires_at and FirebaseManager.firestore_to_datetime(expires_at) > now
+        )
+        
+        return {
+            'cupping_stats': {
+                'total_cuppings': cuppings.get('count', 0),
+                'average_score': round(cuppings.get('scoreSum', 0) / score_count, 1) if score_count else 0,
+                'favorite_origin': _favorite(cuppings.get('origins')),
+                'favorite_roaster': _favorite(cuppings.get('roasters'))
+            },
+            'review_stats': {
+                'total_reviews': reviews.get('count', 0),
+                'average_coffee_rating': round(reviews.get('coffeeRatingSum', 0) / coffee_rating_count, 1) if coffee_rating_count else 0,
+                'favorite_preparation': _favorite(reviews.get('preparations')),
+                'shops_reviewed': sum(1 for count in reviews.get('shops', {}).values() if count > 0)
+            },
+            'bag_stats': {
+                'total_bags': total_bags,
+                'average_rating': round(bags.get('ratingSum', 0) / bag_rating_count, 1) if bag_rating_count else 0,
+                'total_spent': round(bags.get('totalSpent', 0), 2),
+                'favorite_origin': _favorite(bags.get('origins')),
+                'repurchase_rate': round(bags.get('wouldBuyAgain', 0) / total_bags * 100, 1) if total_bags else 0
+            },
+            'pending_invitations': pending_invitations
+        }
+    
+    def build_summary(self, user_id: str) -> Dict:
+        """Compute a user's summary from their raw records"""
+        summary: Dict = {}
+        
+        for collection, (owner_field, delta_builder) in _SUMMARY_SOURCES.items():
+            query = self.db.collection(collection).where(owner_field, '==', user_id)
+            for doc in query.stream():
+                _add_deltas(summary, delta_builder(doc.to_dict(), 1))
+        
+        pending = {}
+        now = datetime.now()
+        invitations = self.db.collection('cuppingInvitations').where('inviteeIds', 'array_contains', user_id)
+        for doc in invitations.stream():
+            invitation = doc.to_dict()
+            expires_at = invitation.get('expiresAt')
+            if user_id in invitation.get('responses', {}):
+                continue
+            if expires_at and FirebaseManager.firestore_to_datetime(expires_at) > now:
+                pending[doc.id] = expires_at
+        
+        summary['pendingInvitations'] = pending
+        summary['complete'] = True
+        summary['userId'] = user_id
+        summary['updatedAt'] = datetime.now()
+        return summary
+    
+    def store_rebuilt(self, user_id: str, summary: Dict, expected_version: int) -> bool:
+        """Overwrite the summary with a rebuilt one unless a delta landed since expected_version was read"""
+        summary_ref = self._summary_ref(user_id)
+        
+        def replace_if_unchanged(transaction):
+            # A delta committed between the raw reads and this write would otherwise be lost for good
+            snapshot = summary_ref.get(transaction=transaction)
+            current = snapshot.to_dict().get('version', 0) if snapshot.exists else 0
+            if current != expected_version:
+                return False
+            transaction.set(summary_ref, {**summary, 'version': expected_version})
+            return True
+        
+        return run_in_transaction(replace_if_unchanged)
+    
+    def rebuild_summary(self, user_id: str) -> Optional[Dict]:
+        """Rebuild and overwrite a user's summary from raw data"""
+        try:
+            if not self.db:
+                return None
+            
+            for _ in range(REBUILD_ATTEMPTS):
+                version = (self.get_summary(user_id) or {}).get('version', 0)
+                summary = self.build_summary(user_id)
+                if self.store_rebuilt(user_id, summary, version):
+                    return summary
+            # Still changing: show this rebuild but leave the document incomplete, so a later visit retries
+            return summary
+            
+        except Exception as e:
+            st.error(f"Error rebuilding user summary: {e}")
+            return None
+
+
+# Global user summary manager instance
+user_summary_manager = UserSummaryManager()
+
+
+def get_user_summary_manager() -> UserSummaryManager:
+    """Get the global user summary manager instance"""
+    return user_summary_manager
@@ -0,0 +1,140 @@
+"""
+In-memory username prefix index for invitation autocomplete and validation
+
+Usernames are held in one sorted array keyed by their lower-case form, so a
+prefix lookup is a binary search plus a short scan. The array is loaded once
+per process, then topped up with users created since the last refresh: on a
+timer, when a name is missing, and directly when this process registers a user.
+"""
+import bisect
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from firebase import get_firestore_db, get_config_value, FirebaseManager, EARLIEST_TIMESTAMP
+
+DEFAULT_REFRESH_SECONDS = 300
+DEFAULT_SUGGESTION_LIMIT = 8
+
+
+class UsernameIndex:
+    """Sorted array of usernames with prefix search"""
+    
+    def __init__(self, refresh_seconds: float = DEFAULT_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        # Parallel arrays ordered by lower-case username
+        self._keys: List[str] = []
+        self._names: List[str] = []
+        self._loaded_through: Optional[datetime] = None
+        self._refreshed_at = 0.0
+    
+    def add(self, username: str):
+        """Insert one username, keeping the arrays sorted"""
+        key = username.lower()
+        with self._lock:
+            i = bisect.bisect_left(self._keys, key)
+            while i < len(self._keys) and self._keys[i] == key:
+                if self._names[i] == username:
+                    return
+                i += 1
+            self._keys.insert(i, key)
+            self._names.insert(i, username)
+    
+    def _prefix_range(self, prefix: str) -> Tuple[int, int]:
+        key = prefix.lower()
+        start = bisect.bisect_left(self._keys, key)
+        # Every key starting with the prefix sorts before prefix + the highest code point
+        end = bisect.bisect_left(self._keys, key + '\U0010ffff', lo=start)
+        return start, end
+    
+    def suggest(self, prefix: str, limit: int = DEFAULT_SUGGESTION_LIMIT) -> List[str]:
+        """Usernames starting with prefix (case-insensitive), alphabetically"""
+        self._ensure_fresh()
+        prefix = prefix.strip()
+        if not prefix:
+            return []
+        with self._lock:
+            start, end = self._prefix_range(prefix)
+            return self._names[start:min(end, start + limit)]
+    
+    def contains(self, username: str) -> bool:
+        """Whether the exact username is registered"""
+        with self._lock:
+            start, end = self._prefix_range(username)
+            return any(self._keys[i] == username.lower() and self._names[i] == username for i in range(start, end))
+    
+    def did_you_mean(self, username: str, limit: int = 3) -> List[str]:
+        """Usernames sharing the longest possible prefix with a name that was not found"""
+        for length in range(len(username), 0, -1):
+            matches = self.suggest(username[:length], limit)
+            if matches:
+                return matches
+        return []
+    
+    def partition(self, usernames: List[str]) -> Tuple[List[str], List[str]]:
+        """Split usernames into (known, unknown), checking once for users created since the last refresh"""
+        self._ensure_fresh()
+        unknown = [name for name in usernames if not self.contains(name)]
+        if unknown:
+            self.refresh()
+            unknown = [name for name in unknown if not self.contains(name)]
+        known = [name for name in usernames if name not in unknown]
+        return known, unknown
+    
+    def _ensure_fresh(self):
+        if time.monotonic() - self._refreshed_at > self.refresh_seconds:
+            self.refresh()
+    
+    def refresh(self) -> int:
+        """Load usernames created since the last refresh (all of them the first time)"""
+        db = get_firestore_db()
+        if not db:
+            return 0
+        
+        query = db.collection('users')
+        if self._loaded_through is not None:
+            # Inclusive so users sharing the last timestamp are not skipped; add() ignores repeats
+            query = query.where('created_at', '>=', self._loaded_through)
+        query = FirebaseManager.apply_projection(query, ['username', 'created_at'])
+        
+        rows = [doc.to_dict() for doc in query.stream()]
+        if self._loaded_through is None:
+            pairs = sorted((row['username'].lower(), row['username']) for row in rows if row.get('username'))
+            with self._lock:
+                self._keys = [key for key, _ in pairs]
+                self._names = [name for _, name in pairs]
+        else:
+            for row in rows:
+                if row.get('username'):
+                    self.add(row['username'])
+        
+        # Kept in UTC: it goes back to Firestore as the next query's bound
+        created = [FirebaseManager.to_utc(row['created_at']) for row in rows if isinstance(row.get('created_at'), datetime)]
+        if created:
+            self._loaded_through = max(created + [self._loaded_through or created[0]])
+        elif self._loaded_through is None:
+            self._loaded_through = EARLIEST_TIMESTAMP
+        self._refreshed_at = time.monotonic()
+        return len(rows)
+    
+    def stats(self) -> Dict:
+        """Size of the index and time since its last refresh"""
+        return {
+            'usernames': len(self._names),
+            'seconds_since_refresh': round(time.monotonic() - self._refreshed_at, 1) if self._refreshed_at else None
+        }
+
+
+_username_index = None
+_username_index_lock = threading.Lock()
+
+
+def get_username_index() -> UsernameIndex:
+    """Get the process-wide username index (USERNAME_INDEX_REFRESH_SECONDS)"""
+    global _username_index
+    if _username_index is None:
+        with _username_index_lock:
+            if _username_index is None:
+                _username_index = UsernameIndex(float(get_config_value('USERNAME_INDEX_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)))
+    return _username_index
@@ -0,0 +1,198 @@
+"""
+Write-behind queue for low-value field updates
+
+Writes such as last-login timestamps and notification read flags do not need
+to hold up the request that causes them. They are queued here, coalesced per
+document (later fields win), and flushed in batches by a background thread on
+an interval, when the queue fills up, or at process exit.
+"""
+import atexit
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+from firebase import get_firestore_db, get_config_value, FirebaseManager, FIRESTORE_BATCH_LIMIT
+
+DEFAULT_FLUSH_INTERVAL_SECONDS = 2.0
+
+# Flush latency samples kept for the p95
+FLUSH_SAMPLE_SIZE = 200
+
+
+class WriteBehindQueue:
+    """Coalesce field updates per document and flush them in batches off the request path"""
+    
+    def __init__(self, interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS, max_pending: int = FIRESTORE_BATCH_LIMIT):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        # Serializes flushes between the worker thread and explicit flush() calls
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], Dict] = {}
+        self._first_queued: Dict[Tuple[str, str], float] = {}
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self._flush_latency = deque(maxlen=FLUSH_SAMPLE_SIZE)
+        self._counters = {'enqueued': 0, 'coalesced': 0, 'written': 0, 'dropped': 0, 'flushes': 0, 'errors': 0}
+    
+    def enqueue(self, collection: str, document_id: str, fields: Dict):
+        """Queue a field update, merging it into any update already pending for the document"""
+        key = (collection, document_id)
+        with self._lock:
+            self._counters['enqueued'] += 1
+            if key in self._pending:
+                self._counters['coalesced'] += 1
+                self._pending[key].update(fields)
+            else:
+                self._pending[key] = dict(fields)
+                self._first_queued[key] = time.monotonic()
+            full = len(self._pending) >= self.max_pending
+        
+        self._ensure_worker()
+        if full:
+            self._wake.set()
+    
+    def pending_fields(self, collection: str, document_id: str) -> Optional[Dict]:
+        """Fields queued but not yet written for a document, so reads can show them"""
+        with self._lock:
+            fields = self._pending.get((collection, document_id))
+            return dict(fields) if fields else None
+    
+    def flush(self) -> int:
+        """Write everything pending now; returns the number of documents written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._first_queued = {}
+            if not pending:
+                return 0
+            
+            start = time.perf_counter()
+            written = 0
+            items = list(pending.items())
+            for i in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+                written += self._write_chunk(items[i:i + FIRESTORE_BATCH_LIMIT])
+            
+            with self._lock:
+                self._counters['flushes'] += 1
+                self._counters['written'] += written
+                self._flush_latency.append((time.perf_counter() - start) * 1000)
+            return written
+    
+    def _write_chunk(self, items) -> int:
+        """Commit one batch, falling back to per-document writes if the batch fails"""
+        db = get_firestore_db()
+        if not db:
+            self._requeue(items)
+            return 0
+        
+        try:
+            batch = db.batch()
+            for (collection, document_id), fields in items:
+                batch.update(db.collection(collection).document(document_id), fields)
+            batch.commit()
+            return len(items)
+        except Exception:
+            pass
+        
+        # One missing document fails the whole batch; retry individually so the rest land
+        written = 0
+        for key, fields in items:
+            collection, document_id = key
+            try:
+                db.collection(collection).document(document_id).update(fields)
+                written += 1
+            except Exception as e:
+                with self._lock:
+                    self._counters['errors'] += 1
+                    if FirebaseManager.is_not_found(e):
+                        self._counters['dropped'] += 1
+                        continue
+                self._requeue([(key, fields)])
+        return written
+    
+    def _requeue(self, items):
+        """Put failed updates back without overwriting newer fields queued meanwhile"""
+        now = time.monotonic()
+        with self._lock:
+            for key, fields in items:
+                self._pending[key] = {**fields, **self._pending.get(key, {})}
+                self._first_queued.setdefault(key, now)
+    
+    def _ensure_worker(self):
+        """Start the flush thread on first use"""
+        if self._thread is not None or self._stopped:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+    
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                with self._lock:
+                    self._counters['errors'] += 1
+    
+    def close(self):
+        """Stop the flush thread and write whatever is still pending"""
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.interval + 5)
+        self.flush()
+    
+    def stats(self) -> Dict:
+        """Queue depth, age of the oldest pending write, counters and flush latency"""
+        with self._lock:
+            samples = sorted(self._flush_latency)
+            oldest = min(self._first_queued.values(), default=None)
+            return {
+                'depth': len(self._pending),
+                'oldest_pending_s': round(time.monotonic() - oldest, 3) if oldest is not None else 0,
+                **self._counters,
+                'last_flush_ms': round(self._flush_latency[-1], 3) if samples else 0,
+                'p95_flush_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3) if samples else 0
+            }
+    
+    def to_prometheus(self) -> str:
+        """Queue metrics in the Prometheus text exposition format"""
+        stats = self.stats()
+        lines = []
+        
+        def metric(name: str, kind: str, help_text: str, value):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        
+        metric('write_behind_queue_depth', 'gauge', 'Documents with writes waiting to be flushed', stats['depth'])
+        metric('write_behind_oldest_pending_seconds', 'gauge', 'Age of the oldest unflushed write', stats['oldest_pending_s'])
+        metric('write_behind_enqueued_total', 'counter', 'Field updates queued', stats['enqueued'])
+        metric('write_behind_coalesced_total', 'counter', 'Field updates merged into an already pending write', stats['coalesced'])
+        metric('write_behind_written_total', 'counter', 'Documents written by flushes', stats['written'])
+        metric('write_behind_dropped_total', 'counter', 'Writes dropped because the document no longer exists', stats['dropped'])
+        metric('write_behind_errors_total', 'counter', 'Failed document writes', stats['errors'])
+        metric('write_behind_flushes_total', 'counter', 'Flushes of a non-empty queue', stats['flushes'])
+        metric('write_behind_flush_latency_ms_p95', 'gauge', 'p95 flush latency in milliseconds', stats['p95_flush_ms'])
+        return '\n'.join(lines) + '\n'
+
+
+_write_behind_queue = None
+_write_behind_lock = threading.Lock()
+
+
+def get_write_behind_queue() -> WriteBehindQueue:
+    """Get the process-wide write-behind queue (WRITE_BEHIND_INTERVAL_SECONDS)"""
+    global _write_behind_queue
+    if _write_behind_queue is None:
+        with _write_behind_lock:
+            if _write_behind_queue is None:
+                interval = float(get_config_value('WRITE_BEHIND_INTERVAL_SECONDS', DEFAULT_FLUSH_INTERVAL_SECONDS))
+                _write_behind_queue = WriteBehindQueue(interval)
+    return _write_behind_queue